@@ -8,20 +8,73 @@ import subprocess
 import logging
 import hashlib
 import csv
+import json
+import py_compile
+import importlib.util
+import shutil
 import shlex
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+# Shared with the service, which hashes deployed files the same way
+from src.hashing import (FileHasher, MMAP_THRESHOLD, RACY_WINDOW_NS, calculate_sha256,  # noqa: F401
+                         load_hash_cache, save_hash_cache)
+from src.plugin_index import PLUGIN_INDEX_FILE, PLUGIN_INDEX_VERSION
 
 # Load build configuration
 BUILD_CONFIG = "./build/build.conf"
 MANIFEST_FILE = "./build/manifest.csv"
 TEMP_DIR = "./build/temp/"
+# size and mtime_ns let the service verify a deployed tree with a stat per file
+MANIFEST_HEADER = ["file_name", "sha256_hash", "description", "size", "mtime_ns"]
+# (inode, size, mtime_ns) -> sha256 of every file hashed by a previous build.
+# Kept outside TEMP_DIR so it survives cleanup_temporary_files().
+HASH_CACHE_FILE = "./build/manifest.cache"
+# Signs manifest.csv (manifest.csv.sig); the matching public key is what the service verifies it with
+MANIFEST_SIGNING_KEY = "/etc/fxetrx/certificates/manifest_signing.key"
+# The plugin index (PLUGIN_INDEX_FILE, src/plugin_index.py) is written by build_plugin_index().
+PLUGINS_DIR = "./plugins"
+# Compiled modules, keyed by source digest, compile settings and toolchain;
+# outside TEMP_DIR so unchanged modules are never compiled twice.
+BUILD_CACHE_DIR = "./build/cache"
+BUILD_CACHE_MAX_ENTRIES = 4096  # least recently used entries beyond this are pruned
+DEPLOY_DIR = "./deployment"
+# Benchmarks and regression gate, run when PERFORMANCE_TESTS=1
+BENCHMARK_SCRIPT = "./tests/run_benchmarks.py"
+# Interpreted mode: every pure-Python module imported at startup, in one file (src/bundle.py)
+BUNDLE_FILE = "./deployment/fxetrx.bundle"
+IMPORT_PROFILE_FILE = "./deployment/import_profile.txt"
+BUNDLE_ENTRY_MODULES = ("src.main",)
+COMPILE_DIRS = ("src", "service")
+# Run by plugin venv interpreters as plain scripts; these must stay source.
+COMPILE_EXCLUDE = ("src/plugin_worker.py", "src/plugin_api.py", "src/ipc.py")
+# build.conf settings that change what the compiler produces; anything else
+# (verbosity, job count, test switches) leaves cached artifacts valid.
+COMPILE_SETTINGS = ("TARGET_PLATFORM", "OPTIMIZE", "DEBUG", "ASSERTIONS", "PROFILE", "COVERAGE",
+                    "COMPILE_COMMAND")
+
+
+_build_config = (None, None)  # (stat of build.conf, parsed settings)
 
 
 def load_build_config():
-    """Load build configuration settings from build.conf with default values."""
+    """
+    Load build configuration settings from build.conf with default values.
+    The file is parsed once; later calls return the same read-only mapping
+    until build.conf changes.
+    """
+    global _build_config
+    try:
+        st = os.stat(BUILD_CONFIG)
+        stamp = (BUILD_CONFIG, st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        stamp = (BUILD_CONFIG, None)
+    if _build_config[0] == stamp:
+        return _build_config[1]
     default_config = {
         "DEBUG": "0",
         "VERBOSE": "0",
-        "build_command": [sys.executable, "build.py"]
     }
     config = default_config.copy()
     if os.path.exists(BUILD_CONFIG):
@@ -35,29 +88,13 @@ def load_build_config():
                     logging.warning(f"Skipping malformed config line: {line}")
                     continue
                 key, value = line.split("=", 1)
-                config[key.strip()] = value.strip()
+                value = value.split(" #", 1)[0].strip()  # trailing comments
+                config[key.strip()] = value.strip('"')
+    config = types.MappingProxyType(config)
+    _build_config = (stamp, config)
     return config
 
 
-def calculate_sha256(file_path):
-    """Calculate SHA256 hash of a given file."""
-    hash_sha256 = hashlib.sha256()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
-    except FileNotFoundError:
-        logging.error(f"File not found: {file_path}")
-        return "FILE_NOT_FOUND"
-    except PermissionError:
-        logging.error(f"Permission denied when accessing: {file_path}")
-        return "PERMISSION_DENIED"
-    except Exception as e:
-        logging.error(f"Unexpected error accessing {file_path}: {e}")
-        return "ERROR"
-
-
 def cleanup_temporary_files():
     """Safely remove temporary build files without deleting unintended files."""
     if os.path.exists(TEMP_DIR):
@@ -85,44 +122,354 @@ def cleanup_temporary_files():
             logging.error(f"Failed to remove temp directory: {e}")
 
 
-def update_manifest():
-    """Update manifest.csv with SHA256 hashes."""
+def update_manifest(jobs=None):
+    """Update manifest.csv with SHA256 hashes, reusing cached digests of unchanged files."""
     if not os.path.exists(MANIFEST_FILE):
         logging.error("Manifest file not found.")
         return
     
-    temp_file = MANIFEST_FILE + ".tmp"
-    with open(MANIFEST_FILE, "r", newline='') as infile, open(temp_file, "w", newline='') as outfile:
+    with open(MANIFEST_FILE, "r", newline='') as infile:
         reader = csv.reader(infile)
-        writer = csv.writer(outfile)
-        
-        # Write header if present
         header = next(reader, None)
-        if header:
-            writer.writerow(header)
-        
-        # Process each file entry
+        rows = []
         for row in reader:
             if len(row) < 3 or any(not isinstance(item, str) for item in row):
                 logging.warning(f"Skipping malformed line in manifest: {row}")
                 continue
-            try:
-                file_path = row[0].strip()
-                sha256_hash = calculate_sha256(file_path) if os.path.isfile(file_path) else "DIRECTORY"
-                writer.writerow([file_path, sha256_hash, row[2].strip()])
-            except IndexError:
-                logging.warning(f"Skipping incomplete row in manifest: {row}")
-                continue
+            rows.append(row)
+    
+    start = time.monotonic()
+    hasher = FileHasher(load_hash_cache(HASH_CACHE_FILE), jobs)
+    temp_file = MANIFEST_FILE + ".tmp"
+    with open(temp_file, "w", newline='') as outfile:
+        writer = csv.writer(outfile)
+        if header:
+            writer.writerow(header + MANIFEST_HEADER[len(header):])
+        # Rows are written as their digests complete, in manifest order
+        file_paths = [row[0].strip() for row in rows]
+        for row, file_path, (sha256_hash, size, mtime_ns) in zip(rows, file_paths, hasher.map_entries(file_paths)):
+            writer.writerow([file_path, sha256_hash, row[2].strip(), size, mtime_ns])
     
     # Replace the old manifest with the updated one
     os.replace(temp_file, MANIFEST_FILE)
+    save_hash_cache(hasher.cache, HASH_CACHE_FILE)
+    logging.info(f"Manifest updated: {len(rows)} entries, {hasher.hits} unchanged, {hasher.misses} hashed "
+                 f"in {time.monotonic() - start:.2f}s")
+
+
+def sign_manifest(key_path=MANIFEST_SIGNING_KEY, manifest_file=MANIFEST_FILE):
+    """Write the manifest's detached signature over its SHA-256; returns False when there is no signing key."""
+    signature_file = manifest_file + ".sig"
+    if not os.path.exists(key_path):
+        # a signature left from an earlier build would no longer match the manifest
+        if os.path.exists(signature_file):
+            os.remove(signature_file)
+        logging.warning(f"No manifest signing key at {key_path}; the manifest is left unsigned")
+        return False
+    from src.crypto import CryptoError, Signer, sign_files
+    try:
+        sign_files(Signer.from_file(key_path, jobs=1), [manifest_file], FileHasher(jobs=1))
+    except CryptoError as e:
+        logging.error(f"Signing the manifest failed: {e}")
+        sys.exit(1)
+    logging.info(f"Manifest signed: {signature_file}")
+    return True
+
+
+def _plugin_files(plugin_path):
+    """Source files of a plugin, excluding its venv and bytecode caches."""
+    files = []
+    for root, dirs, names in os.walk(plugin_path):
+        dirs[:] = sorted(d for d in dirs if d not in ("venv", "__pycache__") and not d.startswith("."))
+        files.extend(os.path.join(root, name) for name in sorted(names) if not name.endswith(".pyc"))
+    return files
+
+
+def build_plugin_index(plugins_dir=PLUGINS_DIR, index_file=PLUGIN_INDEX_FILE, jobs=None,
+                       cache_file=HASH_CACHE_FILE):
+    """
+    Write the plugin index: for every plugin its module (entry point), declared
+    entry points and capabilities from manifest.json, venv interpreter, the
+    digest of its requirements and one digest over all of its source files.
+    """
+    if not os.path.isdir(plugins_dir):
+        logging.warning(f"No plugins directory {plugins_dir}; writing an empty plugin index")
+        names = []
+    else:
+        names = sorted(name for name in os.listdir(plugins_dir)
+                       if not name.startswith(".") and os.path.isdir(os.path.join(plugins_dir, name)))
+    hasher = FileHasher(load_hash_cache(cache_file), jobs)
+    plugins = {}
+    for name in names:
+        path = os.path.join(plugins_dir, name)
+        try:
+            with open(os.path.join(path, "manifest.json"), "r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except (OSError, ValueError) as e:
+            logging.error(f"Skipping plugin {name}: unreadable manifest.json: {e}")
+            continue
+        files = _plugin_files(path)
+        tree = hashlib.sha256()
+        for file_path, digest in zip(files, hasher.map(files)):
+            tree.update(f"{os.path.relpath(file_path, path)}\0{digest}\n".encode())
+        requirements = os.path.join(path, "requirements.txt")
+        venv_python = os.path.join("venv", "Scripts", "python.exe") if os.name == "nt" else os.path.join(
+            "venv", "bin", "python")
+        plugins[name] = {
+            "module": manifest.get("module", "plugin"),
+            "entry_points": manifest.get("entry_points", []),
+            "capabilities": manifest.get("capabilities", []),
+            "venv_python": venv_python if os.path.exists(os.path.join(path, venv_python)) else None,
+            "requirements_sha256": hasher.digest(requirements) if os.path.exists(requirements) else None,
+            "tree_sha256": tree.hexdigest(),
+        }
+    index = {"version": PLUGIN_INDEX_VERSION, "plugins": plugins}
+    temp_file = index_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(index, f, separators=(",", ":"), sort_keys=True)
+    os.replace(temp_file, index_file)
+    save_hash_cache(hasher.cache, cache_file)
+    logging.info(f"Plugin index written: {len(plugins)} plugins")
+    return index
+
+
+def toolchain_fingerprint(config):
+    """Identify the compiler: the interpreter and bytecode format, or the compile command's --version output."""
+    parts = [sys.version, importlib.util.MAGIC_NUMBER.hex()]
+    command = config.get("COMPILE_COMMAND")
+    if command:
+        version_command = config.get("COMPILER_VERSION_COMMAND") or f"{shlex.split(command)[0]} --version"
+        try:
+            result = subprocess.run(shlex.split(version_command), capture_output=True, text=True, check=True)
+            parts.append(result.stdout.strip())
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.error(f"Cannot identify the compiler with '{version_command}': {e}")
+            sys.exit(1)
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def compile_sources(root="."):
+    """Module sources to compile, relative to root."""
+    sources = []
+    for directory in COMPILE_DIRS:
+        for dirpath, dirs, names in os.walk(os.path.join(root, directory)):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__" and not d.startswith("."))
+            for name in sorted(names):
+                rel = os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/")
+                if name.endswith(".py") and rel not in COMPILE_EXCLUDE:
+                    sources.append(rel)
+    return sources
+
+
+def compile_module(source, output_dir, settings):
+    """
+    Compile one module into output_dir. Runs in a worker process.
+    With COMPILE_COMMAND set, that command is run with {source}, {output_dir}
+    and {module} filled in; otherwise the module is compiled to bytecode.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    command = settings.get("COMPILE_COMMAND")
+    if command:
+        module = os.path.splitext(source)[0].replace("/", ".")
+        args = [part.format(source=source, output_dir=output_dir, module=module) for part in shlex.split(command)]
+        subprocess.run(args, check=True, capture_output=True)
+    else:
+        optimize = 1 if settings.get("OPTIMIZE") == "1" and settings.get("ASSERTIONS") != "1" else 0
+        # unchecked hash: the .pyc does not embed the source mtime, so it is reproducible
+        py_compile.compile(source, cfile=os.path.join(output_dir, os.path.basename(source) + "c"),
+                           doraise=True, optimize=optimize,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    return source
+
+
+class BuildCache:
+    """Compiled artifacts stored under BUILD_CACHE_DIR/<key[:2]>/<key>/."""
+
+    def __init__(self, root=BUILD_CACHE_DIR, max_entries=BUILD_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
 
+    @staticmethod
+    def key(source, digest, settings, toolchain):
+        material = json.dumps([source, digest, settings, toolchain], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
 
-def build_service():
-    """Build the service if needed based on configuration."""
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        """The entry directory for key, or None; a hit marks the entry as recently used."""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def store(self, key, output_dir):
+        """Move a freshly compiled output directory into the cache."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(output_dir, path)
+        except OSError:
+            # a concurrent build stored the same key first; its artifacts are equivalent
+            shutil.rmtree(output_dir, ignore_errors=True)
+        return path
+
+    def prune(self):
+        """Drop the least recently used entries beyond max_entries."""
+        if not os.path.isdir(self.root):
+            return 0
+        entries = [os.path.join(self.root, shard, key) for shard in os.listdir(self.root)
+                   if not shard.startswith(".") for key in os.listdir(os.path.join(self.root, shard))]
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda entry: os.stat(entry).st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            shutil.rmtree(entry, ignore_errors=True)
+        return len(entries) - self.max_entries
+
+
+def _deploy(entry, source, deploy_dir):
+    """Hardlink (or copy) a cache entry's artifacts next to where the module lives in deploy_dir."""
+    target_dir = os.path.join(deploy_dir, os.path.dirname(source))
+    os.makedirs(target_dir, exist_ok=True)
+    for name in os.listdir(entry):
+        target = os.path.join(target_dir, name)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(os.path.join(entry, name), target)
+        except OSError:
+            shutil.copy2(os.path.join(entry, name), target)
+
+
+def compile_all(config, jobs=None, cache=None, deploy_dir=DEPLOY_DIR, root=".", cache_file=HASH_CACHE_FILE):
+    """Compile every module, reusing cached artifacts, and deploy them; returns the BuildCache."""
+    cache = cache or BuildCache()
+    settings = {name: config.get(name, "") for name in COMPILE_SETTINGS}
+    toolchain = toolchain_fingerprint(config)
+    sources = compile_sources(root)
+    start = time.monotonic()
+    hasher = FileHasher(load_hash_cache(cache_file), jobs)
+    digests = dict(zip(sources, hasher.map([os.path.join(root, source) for source in sources])))
+    save_hash_cache(hasher.cache, cache_file)
+
+    misses = []
+    for source in sources:
+        key = cache.key(source, digests[source], settings, toolchain)
+        entry = cache.lookup(key)
+        if entry is None:
+            misses.append((source, key))
+        else:
+            cache.hits += 1
+            _deploy(entry, source, deploy_dir)
+    cache.misses = len(misses)
+
+    # Modules compile independently, so every miss gets its own worker process.
+    failed = []
+    if misses:
+        work_dir = os.path.join(cache.root, ".tmp")  # same filesystem, so store() is a rename
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            futures = {source: (key, pool.submit(compile_module, os.path.join(root, source),
+                                                 os.path.join(work_dir, key), settings))
+                       for source, key in misses}
+            for source, (key, future) in futures.items():
+                try:
+                    future.result()
+                except (OSError, subprocess.CalledProcessError, py_compile.PyCompileError) as e:
+                    logging.error(f"Compiling {source} failed: {e}")
+                    failed.append(source)
+                    continue
+                _deploy(cache.store(key, os.path.join(work_dir, key)), source, deploy_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    pruned = cache.prune()
+
+    logging.info(f"Build cache: {cache.hits} hits, {cache.misses} misses ({len(failed)} failed) of "
+                 f"{len(sources)} modules in {time.monotonic() - start:.2f}s"
+                 + (f", {pruned} old entries pruned" if pruned else ""))
+    if failed:
+        sys.exit(1)
+    return cache
+
+
+# Run under `python -X importtime` from the fxetrx root: imports the entry
+# modules, then compiles everything that came from a .py file into a bundle.
+_BUNDLE_SCRIPT = """
+import sys
+bundle_file, optimize, entries = sys.argv[1], int(sys.argv[2]), sys.argv[3:]
+for name in entries:
+    __import__(name)
+import os
+from src.bundle import write_bundle
+root = os.getcwd() + os.sep
+modules = {}
+for name, module in list(sys.modules.items()):
+    spec = getattr(module, "__spec__", None)
+    origin = getattr(spec, "origin", None)
+    if name == "__main__" or not spec or not spec.has_location or not origin or not origin.endswith(".py"):
+        continue
+    with open(origin, "rb") as f:
+        code = compile(f.read(), origin, "exec", dont_inherit=True, optimize=optimize)
+    # the service's own modules are recorded relative to the root, so the bundle can be installed anywhere
+    modules[name] = (code, spec.submodule_search_locations is not None,
+                     origin[len(root):] if origin.startswith(root) else origin)
+print(write_bundle(bundle_file, modules, root))
+"""
+
+
+def write_import_profile(stderr, profile_file):
+    """Write the `-X importtime` output, slowest cumulative imports first; returns total startup import us."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    total = sum(self_us for _, self_us, _ in rows)
+    with open(profile_file, "w") as f:
+        f.write(f"# {len(rows)} imports, {total} us in total (self times summed)\n")
+        f.write("# cumulative [us] | self [us] | module (indented by import depth)\n")
+        for cumulative_us, self_us, name in sorted(rows, reverse=True):
+            f.write(f"{cumulative_us:>10} | {self_us:>9} | {name}\n")
+    return total
+
+
+def build_bundle(config, bundle_file=BUNDLE_FILE, profile_file=IMPORT_PROFILE_FILE,
+                 entries=BUNDLE_ENTRY_MODULES, root="."):
+    """Write the precompiled module bundle and the import-time profile of the entry modules."""
+    optimize = 1 if config.get("OPTIMIZE") == "1" and config.get("ASSERTIONS") != "1" else 0
+    for path in (bundle_file, profile_file):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    command = [sys.executable, "-X", "importtime", "-c", _BUNDLE_SCRIPT,
+               os.path.abspath(bundle_file), str(optimize), *entries]
+    try:
+        result = subprocess.run(command, cwd=root, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Building the module bundle failed: {e.stderr.strip().splitlines()[-1:]}")
+        sys.exit(1)
+    total = write_import_profile(result.stderr, profile_file)
+    logging.info(f"Bundled {result.stdout.strip()} modules into {bundle_file}; "
+                 f"startup imports took {total / 1000:.1f} ms (profile in {profile_file})")
+
+
+def build_service(jobs=None, config=None):
+    """Compile the service modules through the build cache, then run the configured build_command if any."""
     logging.info("Building the service...")
-    config = load_build_config()
-    build_command = config.get("build_command", [sys.executable, "build.py"])
+    config = config if config is not None else load_build_config()
+    compile_all(config, jobs)
+    if config.get("BUNDLE") == "1":
+        build_bundle(config)
+
+    build_command = config.get("build_command")
+    if not build_command:
+        return
+    if isinstance(build_command, str):
+        build_command = shlex.split(build_command)
     
     # Validate build command to ensure it's a list of strings
     if not isinstance(build_command, list) or any(not isinstance(cmd, str) for cmd in build_command):
@@ -140,6 +487,20 @@ def build_service():
         sys.exit(1)
 
 
+def run_performance_gate(config):
+    """Run the benchmark suite against its stored baseline; a regression fails the build."""
+    command = [sys.executable, BENCHMARK_SCRIPT]
+    threshold = config.get("PERFORMANCE_THRESHOLD")
+    if threshold:
+        command += ["--threshold", threshold]
+    logging.info("Running benchmarks...")
+    try:
+        subprocess.run(command, check=True)
+    except subprocess.CalledProcessError:
+        logging.error("Performance regression against tests/benchmark_baseline.json; failing the build")
+        sys.exit(1)
+
+
 def main():
     """Main function to execute the build process."""
     config = load_build_config()
@@ -154,8 +515,13 @@ def main():
     cleanup_temporary_files()
     
     # Update manifest and build the service
-    update_manifest()
-    build_service()
+    jobs = int(config.get("JOBS", "0")) or None
+    update_manifest(jobs=jobs)
+    sign_manifest(config.get("MANIFEST_SIGNING_KEY", MANIFEST_SIGNING_KEY))
+    build_plugin_index(jobs=jobs)
+    build_service(jobs=jobs, config=config)
+    if config.get("PERFORMANCE_TESTS") == "1":
+        run_performance_gate(config)
     
     logging.info("Build process completed successfully.")
 
@@ -1,4 +1,8 @@
 #venv_setup.py - setup the virtual environment for the build process
+import logging
+import os
+import platform
+import venv
 
 def setup_fxetrx_venv():
     """Ensure fxetrx has a dedicated Python installation and environment."""
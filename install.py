@@ -26,53 +26,49 @@
 # # - Automating the process while allowing user selection of the destination directory,
 # #   defaulting to the OS's standard third-party service directory.
 
+import argparse
 import os
 import sys
 import subprocess
 import logging
-import time
 import json
+from src import readiness
 from src.dependency_manager import check_dependencies
 from build.venv_setup import setup_venvs
 from service.install_service import install_service
+from service.status import StatusBase, check_service_status
 from build.build import load_build_config, verify_build
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Upper bounds only: waits end as soon as the service reports the state.
+START_TIMEOUT = 30.0
+STOP_TIMEOUT = 30.0
+
 def check_status(expected_running=False):
-    """Check if the service is installed and running, verifying uptime if expected to be running."""
-    result = subprocess.run([sys.executable, "service/status.py"], capture_output=True, text=True, check=False)
-    logging.info(f"Service status output:\n{result.stdout}")
-    
-    if result.returncode != 0:
-        logging.warning(f"Service status check failed with error:\n{result.stderr}")
-        return False
-    
-    try:
-        status_data = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        logging.error("Failed to parse service status JSON output.")
-        return False
-    
+    """
+    Check if the service is running. With expected_running, it must also have
+    reported that it is ready to serve, not just be starting.
+    """
+    status_data = check_service_status()
+    status_data["state"] = readiness.query_state()
+    logging.info(f"Service status: {json.dumps(status_data, default=StatusBase.custom_serializer)}")
     if expected_running:
-        uptime = status_data.get("uptime")
-        if uptime is None or not isinstance(uptime, int) or uptime > 5:  # Assuming service should have just started
-            logging.warning("Service uptime is longer than expected, possible issue.")
-            return False
-    return True
+        return status_data["state"] == "ready"
+    return status_data["state"] != "stopped" or status_data["status"] == "running"
 
 def start_service():
-    """Start the service and verify it starts correctly."""
+    """Start the service and wait until it reports that it is ready."""
     logging.info("Starting the service...")
     result = subprocess.run([sys.executable, "service/start.py"], capture_output=True, text=True, check=False)
     logging.info(f"Start service output:\n{result.stdout}")
     if result.returncode != 0:
         logging.error(f"Service failed to start:\n{result.stderr}")
         sys.exit(1)
-    time.sleep(2)  # Allow time for the service to initialize
-    if not check_status(expected_running=True):
-        logging.error("Service did not start correctly.")
+    state = readiness.wait_for_state("ready", START_TIMEOUT)
+    if state != "ready":
+        logging.error(f"Service did not start correctly (last reported state: {state}).")
         sys.exit(1)
 
 def stop_service():
@@ -82,6 +78,7 @@ def stop_service():
     logging.info(f"Stop service output:\n{result.stdout}")
     if result.returncode != 0:
         logging.warning(f"Service failed to stop:\n{result.stderr}")
+    readiness.wait_for_state("stopped", STOP_TIMEOUT)
     if check_status():
         logging.error("Service is still running after stop command. Additional details: "
                       f"Output:\n{result.stdout}\nError:\n{result.stderr}")
@@ -99,9 +96,13 @@ def uninstall_service():
         sys.exit(1)
 
 def main():
+    parser = argparse.ArgumentParser(description="Install fxetrx as a service")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="plugin venvs to set up in parallel (default: number of CPUs)")
+    args = parser.parse_args()
     try:
         config = load_build_config()
-        check_dependencies()
+        check_dependencies(jobs=args.jobs)
         setup_venvs()
         
         logging.info("Building the service...")
@@ -0,0 +1,271 @@
+# procfs.py - subprocess-free readers for fxetrx service state on Linux
+#
+# Status queries used to fork `ps -eo etimes,command` and `systemctl is-active`
+# and scan every process for the string "fxetrx". Everything needed is already
+# exposed by the kernel:
+# - the service's main PID comes from its pidfile, or from the cgroup systemd
+#   creates for the unit when there is no pidfile
+# - the unit is running while its cgroup is populated
+# - uptime is /proc/uptime minus the start time in /proc/<pid>/stat
+# A status query therefore costs a handful of small reads and no forks,
+# independent of how many processes are on the host, while the service runs.
+# Only when no service process is found is systemd asked for the unit's
+# ActiveState, to tell a unit that failed (crashed, or exited with an error)
+# from one that was stopped. That is one Properties.Get call on the system bus,
+# spoken directly over its socket, rather than a fork of `systemctl is-active`.
+import os
+import socket
+import struct
+
+PROC_ROOT = "/proc"
+CGROUP_ROOT = "/sys/fs/cgroup"
+PIDFILE = "/run/fxetrx/fxetrx.pid"
+SERVICE_NAME = "fxetrx"
+SYSTEMD_UNIT = "fxetrx.service"
+UNIT_DIRS = ("/etc/systemd/system", "/run/systemd/system", "/usr/lib/systemd/system", "/lib/systemd/system")
+SYSTEM_BUS = "/run/dbus/system_bus_socket"
+DBUS_TIMEOUT = 1  # seconds
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_stat(pid, proc_root=PROC_ROOT):
+    """Return the fields of /proc/<pid>/stat after the command name, or None."""
+    data = _read(f"{proc_root}/{pid}/stat")
+    if not data:
+        return None
+    # The command name is in parentheses and may itself contain spaces or ")".
+    return data[data.rindex(b")") + 2:].split()
+
+
+def is_service_process(pid, proc_root=PROC_ROOT):
+    """Check that pid is alive, not a zombie and belongs to fxetrx (guards against PID reuse)."""
+    fields = read_stat(pid, proc_root)
+    if fields is None or fields[0] == b"Z":
+        return False
+    cmdline = _read(f"{proc_root}/{pid}/cmdline")
+    return bool(cmdline) and SERVICE_NAME.encode() in cmdline
+
+
+def read_pidfile(path=PIDFILE):
+    """Return the PID recorded in the service pidfile, or None."""
+    data = _read(path)
+    if not data:
+        return None
+    try:
+        return int(data.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+def unit_cgroup(unit=SYSTEMD_UNIT, cgroup_root=CGROUP_ROOT):
+    """Return the cgroup directory systemd uses for the unit (v2 or v1 layout)."""
+    for candidate in (f"{cgroup_root}/system.slice/{unit}", f"{cgroup_root}/systemd/system.slice/{unit}"):
+        if os.path.isdir(candidate):
+            return candidate
+    return None
+
+
+def unit_pids(unit=SYSTEMD_UNIT, cgroup_root=CGROUP_ROOT):
+    """Return the PIDs in the unit's cgroup; empty when the unit is not running."""
+    cgroup = unit_cgroup(unit, cgroup_root)
+    if cgroup is None:
+        return []
+    data = _read(f"{cgroup}/cgroup.procs")
+    return [int(pid) for pid in data.split()] if data else []
+
+
+def unit_main_pid(unit=SYSTEMD_UNIT, cgroup_root=CGROUP_ROOT, proc_root=PROC_ROOT):
+    """Return the unit's main PID: the process in its cgroup whose parent is outside it."""
+    pids = unit_pids(unit, cgroup_root)
+    if len(pids) <= 1:
+        return pids[0] if pids else None
+    members = set(pids)
+    for pid in pids:
+        fields = read_stat(pid, proc_root)
+        if fields is not None and int(fields[1]) not in members:
+            return pid
+    return pids[0]
+
+
+def unit_installed(unit=SYSTEMD_UNIT, unit_dirs=UNIT_DIRS):
+    """Check whether a unit file exists in any of the systemd unit directories."""
+    return any(os.path.exists(os.path.join(directory, unit)) for directory in unit_dirs)
+
+
+def _align(buffer, alignment):
+    buffer += b"\0" * (-len(buffer) % alignment)
+
+
+def _put_string(buffer, code, value):
+    """Append a D-Bus string ("s", "o") or signature ("g") to a little-endian message."""
+    data = value.encode()
+    if code == "g":
+        buffer += bytes([len(data)]) + data + b"\0"
+    else:
+        _align(buffer, 4)
+        buffer += struct.pack("<I", len(data)) + data + b"\0"
+
+
+def dbus_message(msg_type, serial, fields, body=b""):
+    """Marshal a D-Bus message: fields is a list of (field code, type code, value)."""
+    message = bytearray(struct.pack("<cBBBII", b"l", msg_type, 0, 1, len(body), serial))
+    message += b"\0\0\0\0"  # header field array length, filled in below
+    for field, code, value in fields:
+        _align(message, 8)
+        message += bytes([field])
+        _put_string(message, "g", code)
+        if code == "u":
+            _align(message, 4)
+            message += struct.pack("<I", value)
+        else:
+            _put_string(message, code, value)
+    struct.pack_into("<I", message, 12, len(message) - 16)
+    _align(message, 8)
+    return bytes(message + body)
+
+
+class _Reader:
+    def __init__(self, data, endian):
+        self.data, self.endian, self.pos = data, endian, 0
+
+    def align(self, alignment):
+        self.pos += -self.pos % alignment
+
+    def uint32(self):
+        self.align(4)
+        (value,) = struct.unpack_from(self.endian + "I", self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def string(self, code):
+        length = self.data[self.pos] if code == "g" else self.uint32()
+        start = self.pos + 1 if code == "g" else self.pos
+        self.pos = start + length + 1
+        return self.data[start:start + length].decode()
+
+    def value(self, code):
+        if code == "u":
+            return self.uint32()
+        if code in ("s", "o", "g"):
+            return self.string(code)
+        raise ValueError(f"unexpected D-Bus type {code!r}")
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("D-Bus connection closed")
+        data += chunk
+    return data
+
+
+def read_dbus_message(sock):
+    """Read one message; return its type, serial, header fields by code and a reader over its body."""
+    fixed = _recv_exactly(sock, 16)
+    endian = "<" if fixed[:1] == b"l" else ">"
+    msg_type = fixed[1]
+    body_length, serial, fields_length = struct.unpack(endian + "III", fixed[4:])
+    rest = _recv_exactly(sock, fields_length + (-fields_length % 8) + body_length)
+    header = _Reader(fixed + rest[:fields_length], endian)
+    header.pos = 16
+    fields = {}
+    while header.pos < len(header.data):
+        header.align(8)
+        field = header.data[header.pos]
+        header.pos += 1
+        fields[field] = header.value(header.string("g"))
+    return msg_type, serial, fields, _Reader(rest[len(rest) - body_length:], endian)
+
+
+def _unit_object_path(unit):
+    # systemd's bus_label_escape(): everything but ASCII letters and digits becomes _xx
+    return "/org/freedesktop/systemd1/unit/" + "".join(
+        c if c.isascii() and c.isalnum() else f"_{ord(c):02x}" for c in unit)
+
+
+def unit_active_state(unit=SYSTEMD_UNIT, bus=SYSTEM_BUS):
+    """systemd's ActiveState of the unit ("inactive", "failed", ...), or None without a system bus."""
+    hello = dbus_message(1, 1, [(1, "o", "/org/freedesktop/DBus"), (2, "s", "org.freedesktop.DBus"),
+                                (3, "s", "Hello"), (6, "s", "org.freedesktop.DBus")])
+    body = bytearray()
+    _put_string(body, "s", "org.freedesktop.systemd1.Unit")
+    _put_string(body, "s", "ActiveState")
+    get = dbus_message(1, 2, [(1, "o", _unit_object_path(unit)), (2, "s", "org.freedesktop.DBus.Properties"),
+                              (3, "s", "Get"), (6, "s", "org.freedesktop.systemd1"), (8, "g", "ss")], bytes(body))
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DBUS_TIMEOUT)
+            sock.connect(bus)
+            sock.sendall(b"\0AUTH EXTERNAL " + str(os.getuid()).encode().hex().encode() + b"\r\n")
+            reply = b""
+            while not reply.endswith(b"\r\n"):
+                chunk = sock.recv(256)
+                if not chunk:
+                    return None
+                reply += chunk
+            if not reply.startswith(b"OK "):
+                return None
+            sock.sendall(b"BEGIN\r\n" + hello + get)
+            while True:
+                msg_type, _, fields, body = read_dbus_message(sock)
+                if fields.get(5) != 2:  # REPLY_SERIAL
+                    continue  # the Hello reply, or a signal
+                if msg_type != 2:  # an error: no systemd on the bus, or access denied
+                    return None
+                return body.value(body.string("g")) or None
+    except (OSError, ValueError, IndexError, UnicodeDecodeError, struct.error):
+        return None
+
+
+def find_service_pid(pidfile=PIDFILE, unit=SYSTEMD_UNIT, proc_root=PROC_ROOT, cgroup_root=CGROUP_ROOT):
+    """Locate the running service's PID via the pidfile, falling back to the systemd cgroup."""
+    pid = read_pidfile(pidfile)
+    if pid is not None and is_service_process(pid, proc_root):
+        return pid
+    pid = unit_main_pid(unit, cgroup_root, proc_root)
+    if pid is not None and read_stat(pid, proc_root) is not None:
+        return pid
+    return None
+
+
+def process_uptime(pid, proc_root=PROC_ROOT):
+    """Return how many whole seconds the process has been running, or None."""
+    fields = read_stat(pid, proc_root)
+    uptime = _read(f"{proc_root}/uptime")
+    if fields is None or not uptime:
+        return None
+    # starttime is field 22 of stat, i.e. index 19 once pid and comm are dropped.
+    started = int(fields[19]) / _CLK_TCK
+    return max(0, int(float(uptime.split()[0]) - started))
+
+
+def service_uptime(pidfile=PIDFILE, unit=SYSTEMD_UNIT, proc_root=PROC_ROOT, cgroup_root=CGROUP_ROOT):
+    """Return the service uptime in seconds, or None if it is not running."""
+    pid = find_service_pid(pidfile, unit, proc_root, cgroup_root)
+    return process_uptime(pid, proc_root) if pid is not None else None
+
+
+def service_state(pidfile=PIDFILE, unit=SYSTEMD_UNIT, proc_root=PROC_ROOT, cgroup_root=CGROUP_ROOT,
+                  unit_dirs=UNIT_DIRS, active_state=unit_active_state):
+    """Return "running", "stopped", "failed" or "not installed" for the service."""
+    if unit_pids(unit, cgroup_root):
+        return "running"
+    # Without systemd (or when started by hand) the pidfile is authoritative.
+    pid = read_pidfile(pidfile)
+    if pid is not None and is_service_process(pid, proc_root):
+        return "running"
+    if unit_installed(unit, unit_dirs):
+        # not running, so asking systemd is off the hot path; it costs no fork either
+        return "failed" if active_state(unit) == "failed" else "stopped"
+    return "not installed"
@@ -1,5 +1,6 @@
 # status.py - Manages the status of the fxetrx service
 
+import argparse
 import os
 import sys
 import json
@@ -8,8 +9,32 @@ import subprocess
 import re
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from service import procfs
+from src import readiness
+
 CONFIG_FILE = "/etc/fxetrx/config.json" if platform.system().lower() == "linux" else "C:\\ProgramData\\fxetrx\\config.json"
 
+class StatusBase:
+    """Interface implemented by the OS-specific status modules (status_linux.py, status_mac.py, status_win.py)."""
+
+    def get_uptime(self):
+        """Return the service uptime in seconds, or None if it is not running."""
+        raise NotImplementedError
+
+    def check_service_status(self):
+        """Return a dict describing the service status."""
+        raise NotImplementedError
+
+    @staticmethod
+    def custom_serializer(obj):
+        """Serialize objects json does not handle natively, such as datetime and sets."""
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        if isinstance(obj, set):
+            return sorted(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
 def get_uptime():
     """Retrieve uptime of the fxetrx service based on the operating system."""
     system = platform.system().lower()
@@ -26,12 +51,7 @@ def get_uptime():
                 if match:
                     return match.group(1)  # Convert to elapsed seconds if needed
         elif system == "linux":
-            result = subprocess.run(["ps", "-eo", "etimes,command"], capture_output=True, text=True)
-            for line in result.stdout.splitlines():
-                if "fxetrx" in line:
-                    match = re.search(r"(\d+)", line)
-                    if match:
-                        return int(match.group(1))
+            return procfs.service_uptime()
         elif system == "darwin":
             result = subprocess.run(["ps", "-eo", "etime,command"], capture_output=True, text=True)
             for line in result.stdout.splitlines():
@@ -55,13 +75,17 @@ def get_config_version():
         return None
     return None
 
-def check_service_status():
-    """Check the status of the fxetrx service across different operating systems."""
+def check_service_status(config=None):
+    """
+    Check the status of the fxetrx service across different operating systems.
+    config is the service's in-memory src.config.Config; without it the version
+    is read from CONFIG_FILE.
+    """
     system = platform.system().lower()
     status_info = {
         "status": "unknown",
         "uptime": get_uptime(),
-        "config_version": get_config_version(),
+        "config_version": config.version if config is not None else get_config_version(),
         "errors": []
     }
     
@@ -83,18 +107,7 @@ def check_service_status():
                 status_info["status"] = "unknown"
         
         elif system == "linux":
-            result = subprocess.run(["systemctl", "is-active", "fxetrx"], capture_output=True, text=True)
-            output = result.stdout.strip().lower()
-            if output == "active":
-                status_info["status"] = "running"
-            elif output == "inactive":
-                status_info["status"] = "stopped"
-            elif output == "failed":
-                status_info["status"] = "failed"
-            elif "not-found" in output:
-                status_info["status"] = "not installed"
-            else:
-                status_info["status"] = "unknown"
+            status_info["status"] = procfs.service_state()
         
         elif system == "darwin":  # macOS
             result = subprocess.run(["which", "launchctl"], capture_output=True, text=True)
@@ -126,13 +139,22 @@ def check_service_status():
     
     return status_info
 
-def main():
+def main(argv=None):
     """Main execution to check and print the service status in JSON format."""
+    parser = argparse.ArgumentParser(description="Print the fxetrx service status as JSON")
+    parser.add_argument("--wait", choices=("ready", "stopped"),
+                        help="first block until the service reports this state (exit status 1 on timeout)")
+    parser.add_argument("--timeout", type=float, default=readiness.DEFAULT_WAIT_TIMEOUT)
+    args = parser.parse_args(argv)
+    state = readiness.wait_for_state(args.wait, args.timeout) if args.wait else readiness.query_state()
     status_info = check_service_status()
+    status_info["state"] = state
     try:
         print(json.dumps(status_info, indent=4, ensure_ascii=False))
     except TypeError as e:
         print(json.dumps({"error": "Failed to serialize JSON", "details": str(e)}, indent=4, ensure_ascii=False))
+    if args.wait and state != args.wait:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
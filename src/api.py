@@ -12,3 +12,366 @@
 # fetch list of plugins
 # whoami
 # ???
+###########################################
+# status, uptime and version are answered from an in-memory StatusSnapshot.
+# StatusCache refreshes it in the background every `interval` seconds, or
+# straight away when notify_change() reports a service-state change, so a
+# request never re-reads config.json or re-probes the OS. Every response
+# carries the snapshot's age and generation; passing ?since=<generation>&wait=<s>
+# long-polls until a newer snapshot exists instead of busy-polling.
+#
+# metrics - Prometheus text exposition of the service's metrics.py registry;
+# with a registry attached, every request is counted and timed per endpoint.
+#
+# plugins - every installed plugin from the plugin index, and /plugins/<name>
+# for one plugin with its worker pool state. ?stream=ndjson (or frames) sends
+# one frame per plugin while the list is walked, instead of one JSON document.
+#
+# batch - POST /batch with a JSON list of calls (paths, or {"id", "path"}
+# objects) runs them concurrently and streams one result frame per call as it
+# completes: NDJSON lines by default, or with ?stream=frames each JSON document
+# prefixed by its 4-byte big-endian length. ?stream=none returns one document
+# with the results in request order.
+import asyncio
+import getpass
+import json
+import logging
+import math
+import struct
+import time
+
+from service.status import check_service_status
+from src.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from src.net import Request, Response, StreamingResponse
+
+DEFAULT_REFRESH_INTERVAL = 5.0
+MAX_LONG_POLL = 60.0
+MAX_BATCH_CALLS = 1000
+BATCH_CONCURRENCY = 64  # calls of one batch running at once
+STREAM_ITEMS = 64  # plugin frames sent per chunk
+NDJSON_TYPE = "application/x-ndjson"
+FRAMES_TYPE = "application/x-fxetrx-frames"
+STREAM_FORMATS = {"ndjson": NDJSON_TYPE, "frames": FRAMES_TYPE}
+_LENGTH = struct.Struct(">I")
+
+
+class StatusSnapshot:
+    """The service status as observed at one point in time."""
+
+    __slots__ = ("generation", "taken", "data")
+
+    def __init__(self, generation, data):
+        self.generation = generation
+        self.taken = time.monotonic()
+        self.data = data
+
+    @property
+    def age(self):
+        """Seconds since the snapshot was taken."""
+        return time.monotonic() - self.taken
+
+    def uptime(self):
+        """Service uptime now, extrapolated from the uptime recorded in the snapshot."""
+        uptime = self.data.get("uptime")
+        if not isinstance(uptime, (int, float)):
+            return uptime
+        return int(uptime + self.age)
+
+
+class StatusCache:
+    """Keeps the latest StatusSnapshot and refreshes it in the background."""
+
+    def __init__(self, collect=check_service_status, interval=DEFAULT_REFRESH_INTERVAL):
+        self.collect = collect
+        self.interval = interval
+        self._snapshot = None
+        self._changed = None
+        self._wake = None
+        self._task = None
+        self._loop = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    async def start(self):
+        """Take the first snapshot and start the refresh task."""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Condition()
+        self._wake = asyncio.Event()
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Stop the refresh task."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify_change(self):
+        """Request an immediate refresh; safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def refresh(self):
+        """Collect the status once; bump the generation only if something changed."""
+        data = await self._loop.run_in_executor(None, self._collect)
+        previous = self._snapshot
+        if previous is not None and _without_uptime(previous.data) == _without_uptime(data):
+            # Nothing a client could act on changed; just record the fresher reading.
+            self._snapshot = StatusSnapshot(previous.generation, data)
+            return
+        self._snapshot = StatusSnapshot(previous.generation + 1 if previous else 1, data)
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_change(self, generation, timeout):
+        """Wait until the snapshot is newer than generation or timeout elapses."""
+        if self._snapshot.generation > generation:
+            return self._snapshot
+        try:
+            async with self._changed:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self._snapshot.generation > generation), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._snapshot
+
+    def _collect(self):
+        data = self.collect()
+        data["user"] = getpass.getuser()
+        return data
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Status refresh failed: {e}")
+
+
+def _without_uptime(data):
+    return {key: value for key, value in data.items() if key != "uptime"}
+
+
+def _json(status, payload):
+    return Response(status, json.dumps(payload, ensure_ascii=False))
+
+
+def _frame(payload, fmt):
+    """One stream frame: an NDJSON line, or a length-prefixed JSON document."""
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return data + b"\n" if fmt == "ndjson" else _LENGTH.pack(len(data)) + data
+
+
+def _stream_format(request, default=None):
+    """The frame format a request asks for (ndjson or frames), or None for one JSON document."""
+    fmt = request.query.get("stream")
+    if fmt is None:
+        accept = request.headers.get("accept", "")
+        fmt = next((name for name, content_type in STREAM_FORMATS.items() if content_type in accept), default)
+    if fmt in (None, "none"):
+        return None
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"stream must be one of none, {', '.join(STREAM_FORMATS)}")
+    return fmt
+
+
+def _parse_batch(body):
+    """The (id, path) pairs of a batch request body."""
+    try:
+        calls = json.loads(body or b"null")
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("batch body must be JSON")
+    if isinstance(calls, dict):
+        calls = calls.get("calls")
+    if not isinstance(calls, list):
+        raise ValueError('batch body must be a list of calls or {"calls": [...]}')
+    if len(calls) > MAX_BATCH_CALLS:
+        raise ValueError(f"at most {MAX_BATCH_CALLS} calls per batch")
+    parsed = []
+    for i, call in enumerate(calls):
+        call_id, path = (i, call) if isinstance(call, str) else (call.get("id", i), call.get("path")) \
+            if isinstance(call, dict) else (i, None)
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError(f"call {i} needs a path starting with /")
+        if path.split("?", 1)[0] in ("/batch", "/metrics"):
+            raise ValueError(f"call {i}: {path} cannot be batched")
+        parsed.append((call_id, path))
+    return parsed
+
+
+class Api:
+    """Routes requests from net.py to the calls listed above."""
+
+    def __init__(self, status_cache, metrics=None, plugins=None, loop_lag=None):
+        self.status_cache = status_cache
+        self.metrics = metrics
+        self.plugins = plugins  # plugin_pool.PluginPools, for /plugins
+        self.loop_lag = loop_lag  # metrics.LoopLagMonitor, probing only while requests come in
+        self.routes = {
+            "/status": self.status,
+            "/uptime": self.uptime,
+            "/version": self.version,
+        }
+        self._requests = self._latency = None
+        if metrics is not None:
+            self._requests = metrics.counter("fxetrx_http_requests_total", "HTTP requests served",
+                                             ("endpoint", "status"))
+            self._latency = metrics.histogram("fxetrx_http_request_duration_seconds",
+                                              "Time to produce a response; streams until their last chunk is sent",
+                                              ("endpoint",))
+
+    async def handle(self, request):
+        """Entry point used as the RequestServer handler."""
+        if self._requests is None:
+            return await self._handle(request)
+        if self.loop_lag is not None:
+            self.loop_lag.activity()
+        start = time.perf_counter()
+        response = await self._handle(request)
+        # Unknown paths share one label so clients cannot grow the metric without bound.
+        endpoint = request.path if request.path in self.routes or request.path in ("/metrics", "/batch", "/plugins") \
+            else "/plugins/{name}" if request.path.startswith("/plugins/") else "other"
+        latency = self._latency.labels(endpoint)
+        if isinstance(response, StreamingResponse):
+            # a stream is timed until its last chunk is sent
+            response.on_done = lambda: latency.observe(time.perf_counter() - start)
+        else:
+            latency.observe(time.perf_counter() - start)
+        self._requests.labels(endpoint, response.status).inc()
+        return response
+
+    async def _handle(self, request):
+        if request.path == "/metrics" and self.metrics is not None:
+            if request.method not in ("GET", "HEAD"):
+                return _json(405, {"error": "method not allowed"})
+            return Response(200, self.metrics.render(), content_type=METRICS_CONTENT_TYPE)
+        if request.path == "/batch":
+            return await self.batch(request)
+        if request.path == "/plugins" and self.plugins is not None and request.method in ("GET", "HEAD"):
+            try:
+                fmt = _stream_format(request)
+            except ValueError as e:
+                return _json(400, {"error": str(e)})
+            if fmt is not None:
+                return StreamingResponse(200, self._plugin_frames(fmt), STREAM_FORMATS[fmt])
+        return _json(*await self.call(request))
+
+    async def call(self, request):
+        """Answer one GET-style call; returns (status, payload) so batches can frame it themselves."""
+        path = request.path
+        if self.plugins is not None and (path == "/plugins" or path.startswith("/plugins/")):
+            if request.method not in ("GET", "HEAD"):
+                return 405, {"error": "method not allowed"}
+            return self.plugin_list(request) if path == "/plugins" else self.plugin(request)
+        route = self.routes.get(path)
+        if route is None:
+            return 404, {"error": "not found"}
+        if request.method not in ("GET", "HEAD"):
+            return 405, {"error": "method not allowed"}
+        try:
+            snapshot = await self._snapshot_for(request)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        payload = route(snapshot)
+        payload["snapshot_age"] = round(snapshot.age, 3)
+        payload["generation"] = snapshot.generation
+        return 200, payload
+
+    async def batch(self, request):
+        """Run the calls of a batch concurrently; stream their results as they complete."""
+        if request.method != "POST":
+            return _json(405, {"error": "method not allowed"})
+        try:
+            fmt = _stream_format(request, default="ndjson")
+            calls = _parse_batch(request.body)
+        except ValueError as e:
+            return _json(400, {"error": str(e)})
+        limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run(call_id, path):
+            async with limit:
+                try:
+                    status, payload = await self.call(Request("GET", path, "HTTP/1.1", {}))
+                except Exception as e:
+                    # one failing call must not cut off the results of the others
+                    logging.error(f"Unhandled error serving batched {path}: {e}")
+                    status, payload = 500, {"error": "internal server error"}
+            return {"id": call_id, "status": status, "body": payload}
+
+        if fmt is None:
+            results = await asyncio.gather(*(run(call_id, path) for call_id, path in calls))
+            return _json(200, {"results": results})
+        return StreamingResponse(200, self._batch_frames(run, calls, fmt), STREAM_FORMATS[fmt])
+
+    @staticmethod
+    async def _batch_frames(run, calls, fmt):
+        # the calls start with the stream: a response that is never sent leaves no coroutine behind
+        finished = asyncio.Queue()
+        tasks = [asyncio.ensure_future(run(call_id, path)) for call_id, path in calls]
+        for task in tasks:
+            task.add_done_callback(finished.put_nowait)
+        try:
+            remaining = len(tasks)
+            while remaining:
+                # wait for one result, then send it with whatever else has finished meanwhile
+                done = [await finished.get()]
+                while len(done) < STREAM_ITEMS and not finished.empty():
+                    done.append(finished.get_nowait())
+                remaining -= len(done)
+                yield b"".join(_frame(task.result(), fmt) for task in done)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _plugin_frames(self, fmt):
+        names = self.plugins.available
+        for start in range(0, len(names), STREAM_ITEMS):
+            yield b"".join(_frame(self.plugins.describe(name), fmt) for name in names[start:start + STREAM_ITEMS])
+
+    def plugin_list(self, request):
+        names = self.plugins.available
+        return 200, {"count": len(names), "plugins": [self.plugins.describe(name) for name in names]}
+
+    def plugin(self, request):
+        info = self.plugins.describe(request.path[len("/plugins/"):])
+        return (200, info) if info is not None else (404, {"error": "unknown plugin"})
+
+    async def _snapshot_for(self, request):
+        """Return the current snapshot, or long-poll for a newer one if asked to."""
+        query = request.query
+        if "since" not in query:
+            return self.status_cache.snapshot
+        try:
+            since = int(query["since"])
+            wait = float(query.get("wait", MAX_LONG_POLL))
+        except ValueError:
+            raise ValueError("since must be an integer and wait a number of seconds")
+        if not math.isfinite(wait) or wait < 0:
+            raise ValueError("wait must be a finite number of seconds, not negative")
+        wait = min(wait, MAX_LONG_POLL)
+        return await self.status_cache.wait_for_change(since, wait)
+
+    @staticmethod
+    def status(snapshot):
+        payload = dict(snapshot.data)
+        payload["uptime"] = snapshot.uptime()
+        return payload
+
+    @staticmethod
+    def uptime(snapshot):
+        return {"uptime": snapshot.uptime()}
+
+    @staticmethod
+    def version(snapshot):
+        return {"version": snapshot.data.get("config_version")}
@@ -0,0 +1,153 @@
+# bundle.py - import the service from one precompiled bundle file
+#
+# The build (build.py, BUNDLE=1) writes every pure-Python module the service
+# imports at startup, its own and the standard library's, into one file:
+#
+#   MAGIC | magic number | version length | index length | sys.version | marshal(index) | code objects
+#
+# The index maps module names to (offset, length, is_package, origin, stamp).
+# The file is mmapped, and BundleFinder sits first on sys.meta_path and answers
+# find_spec() with one dict lookup and no filesystem probes. Code is
+# unmarshalled only when a module is actually imported. Anything not in the
+# bundle (extension modules, plugins, modules added after the build) falls
+# through to the normal import system.
+#
+# Stale code is never run:
+# - a bundle built by another interpreter, or by another build of the same
+#   version (sys.version differs, e.g. after a distro update of the standard
+#   library), is ignored rather than loaded
+# - the service's own modules carry the (mtime_ns, size) of their source when
+#   the bundle was built; one whose source has changed since is left to the
+#   normal import system
+#
+#   python -m src.bundle deployment/fxetrx.bundle src.main [args...]
+import importlib.machinery
+import marshal
+import mmap
+import os
+import struct
+import sys
+# Only modules the interpreter has loaded anyway: importlib.abc and importlib.util
+# pull in typing, contextlib and friends before the bundle can serve them.
+from importlib._bootstrap_external import MAGIC_NUMBER  # importlib.util.MAGIC_NUMBER
+
+MAGIC = b"FXBUNDL2"
+HEADER = struct.Struct("<8s4sHI")  # MAGIC, interpreter MAGIC_NUMBER, sys.version length, index length
+
+
+def source_stamp(path):
+    """(mtime_ns, size) of a source file, or None if it cannot be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def write_bundle(path, modules, root="."):
+    """
+    Write a bundle. modules maps module names to (code object, is_package,
+    origin), where origin is the source path reported as __file__; relative
+    origins are the service's own modules, below root.
+    """
+    index, blobs, offset = {}, [], 0
+    for name, (code, is_package, origin) in sorted(modules.items()):
+        blob = marshal.dumps(code)
+        stamp = None if os.path.isabs(origin) else source_stamp(os.path.join(root, origin))
+        index[name] = (offset, len(blob), is_package, origin, stamp)
+        blobs.append(blob)
+        offset += len(blob)
+    index_blob = marshal.dumps(index)
+    version = sys.version.encode("utf-8")
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, MAGIC_NUMBER, len(version), len(index_blob)))
+        f.write(version)
+        f.write(index_blob)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(temp_file, path)
+    return len(index)
+
+
+class BundleFinder:
+    """Finder and loader for the modules of one bundle file."""
+
+    def __init__(self, path, root="."):
+        self.root = os.path.abspath(root)  # the service's own modules are recorded relative to it
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, python_magic, version_length, index_length = HEADER.unpack_from(self._map)
+        index_start = HEADER.size + version_length
+        if (magic != MAGIC or python_magic != MAGIC_NUMBER
+                or self._map[HEADER.size:index_start] != sys.version.encode("utf-8")):
+            self._map.close()
+            raise ImportError(f"{path} is not a bundle for this interpreter")
+        self._base = index_start + index_length
+        self.index = marshal.loads(self._map[index_start:self._base])
+        self.path = path
+
+    def __repr__(self):
+        return f"<BundleFinder {self.path!r}>"
+
+    def find_spec(self, fullname, path=None, target=None):
+        entry = self.index.get(fullname)
+        if entry is None:
+            return None
+        is_package, origin, stamp = entry[2:]
+        if not os.path.isabs(origin):
+            origin = os.path.join(self.root, origin)
+            if source_stamp(origin) != stamp:
+                return None  # edited since the build: import the source instead
+        spec = importlib.machinery.ModuleSpec(fullname, self, origin=origin, is_package=is_package)
+        spec.has_location = True  # __file__ points at the source, for tracebacks and data files
+        if is_package:
+            # submodules left out of the bundle are still found next to the source
+            spec.submodule_search_locations = [os.path.dirname(origin)]
+        return spec
+
+    def get_code(self, fullname):
+        offset, length = self.index[fullname][:2]
+        start = self._base + offset
+        return marshal.loads(self._map[start:start + length])
+
+    def get_source(self, fullname):
+        import importlib.util
+        try:
+            with open(self.get_filename(fullname), "rb") as f:
+                return importlib.util.decode_source(f.read())
+        except OSError:
+            return None
+
+    def is_package(self, fullname):
+        return self.index[fullname][2]
+
+    def create_module(self, spec):
+        return None  # default module creation
+
+    def exec_module(self, module):
+        exec(self.get_code(module.__name__), module.__dict__)
+
+    def get_filename(self, fullname):
+        return os.path.join(self.root, self.index[fullname][3])
+
+
+def install(path, root="."):
+    """Put the bundle at path first on sys.meta_path; returns the finder, or None if it cannot be used."""
+    try:
+        finder = BundleFinder(path, root)
+    except (OSError, ValueError, EOFError, struct.error, ImportError) as e:
+        sys.stderr.write(f"fxetrx: not using bundle {path}: {e}\n")
+        return None
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("Usage: python -m src.bundle BUNDLE MODULE [args...]")
+    import runpy
+    install(sys.argv[1])
+    module = sys.argv[2]
+    sys.argv = [module] + sys.argv[3:]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
@@ -0,0 +1,322 @@
+# config.py - the service configuration (/etc/fxetrx/config.json), held in memory
+#
+# The file is parsed and validated once into an immutable Config. Readers take
+# ConfigStore.current, which is one attribute read and never touches the disk.
+# A watcher notices edits: inotify on the configuration directory on Linux, a
+# stat every `poll_interval` seconds elsewhere. While the directory does not
+# exist yet, inotify watches its nearest existing ancestor and follows it down
+# as the missing directories are created. The new file is read, parsed
+# and validated off the event loop and swapped in with a single assignment,
+# then subscribers are told. A file that does not parse or validate is logged
+# and rejected, and the running configuration stays in place.
+import asyncio
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import types
+
+from service.status import CONFIG_FILE
+
+DEFAULT_POLL_INTERVAL = 10.0  # seconds between stats where there is no inotify (not Linux)
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class ConfigError(ValueError):
+    """Raised for a configuration file that cannot be used."""
+
+
+def _string(choices=None):
+    def check(key, value):
+        if not isinstance(value, str):
+            raise ConfigError(f"{key} must be a string")
+        if choices and value not in choices:
+            raise ConfigError(f"{key} must be one of {', '.join(choices)}")
+    return check
+
+
+def _number(minimum=None, exclusive=False):
+    def check(key, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"{key} must be a number")
+        if minimum is not None and (value <= minimum if exclusive else value < minimum):
+            raise ConfigError(f"{key} must be {'greater than' if exclusive else 'at least'} {minimum}")
+    return check
+
+
+# Settings the service understands; anything else is kept but not checked.
+SCHEMA = {
+    "version": _string(),
+    "log_level": _string(LOG_LEVELS),
+    "status_interval": _number(0, exclusive=True),
+    "secret_ttl": _number(0),
+}
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class Config:
+    """One validated version of the configuration; read-only."""
+
+    __slots__ = ("generation", "data", "digest", "loaded")
+
+    def __init__(self, generation, data, digest=None):
+        self.generation = generation
+        self.data = _freeze(data)
+        self.digest = digest
+        self.loaded = time.time()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    @property
+    def version(self):
+        return self.data.get("version")
+
+
+def parse_config(raw):
+    """Parse and validate the bytes of a configuration file; returns the data as a dict."""
+    try:
+        data = json.loads(raw)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ConfigError(f"not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise ConfigError("the top level must be an object")
+    for key, check in SCHEMA.items():
+        if key in data:
+            check(key, data[key])
+    return data
+
+
+def load_config(path=CONFIG_FILE, generation=1, missing_ok=True):
+    """Read, parse and validate path; a missing file is an empty configuration if missing_ok."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        if not missing_ok:
+            raise ConfigError(f"{path} does not exist")
+        return Config(generation, {})
+    except OSError as e:
+        raise ConfigError(f"cannot read {path}: {e}")
+    return Config(generation, parse_config(raw), hashlib.sha256(raw).hexdigest())
+
+
+class _Inotify:
+    """Just enough of inotify(7) through libc to watch a directory at a time."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, directory, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)  # fails harmlessly once the directory is gone
+
+    def events(self):
+        """The pending events, as (watch descriptor, mask, file name)."""
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigStore:
+    """Service component holding the current Config and reloading it when the file changes."""
+
+    def __init__(self, path=CONFIG_FILE, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.reloads = 0
+        self.failures = 0
+        self._current = Config(0, {})
+        self._subscribers = []
+        self._loop = None
+        self._directory = os.path.dirname(os.path.abspath(path))
+        self._inotify = None
+        self._watched = None  # (watch descriptor, directory)
+        self._poll_task = None
+        self._reload_task = None
+        self._pending = False
+
+    @property
+    def current(self):
+        return self._current
+
+    def subscribe(self, callback):
+        """Call callback(old, new) on the event loop whenever a new Config is swapped in."""
+        self._subscribers.append(callback)
+
+    def register_metrics(self, registry):
+        registry.gauge("fxetrx_config_generation", "Configuration versions loaded since start",
+                       lambda: self._current.generation)
+        registry.gauge("fxetrx_config_reload_failures_total", "Configuration edits rejected",
+                       lambda: self.failures, kind="counter")
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._swap(load_config(self.path))
+        except ConfigError as e:
+            self.failures += 1
+            logging.error(f"Configuration {self.path} rejected: {e}; starting with defaults")
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify()
+                self._watch()
+                self._loop.add_reader(self._inotify.fd, self._on_events)
+                return
+            except (OSError, AttributeError) as e:
+                # out of inotify instances or watches, or a libc without them
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+                logging.warning(f"Cannot watch {self.path} with inotify, polling it instead: {e}")
+        self._poll_task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = self._watched = None
+        for task in (self._poll_task, self._reload_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._poll_task = self._reload_task = None
+
+    def reload(self):
+        """Schedule a reload; edits arriving while one runs are picked up by one more reload."""
+        if self._reload_task is not None and not self._reload_task.done():
+            self._pending = True
+            return self._reload_task
+        self._reload_task = asyncio.ensure_future(self._reload())
+        return self._reload_task
+
+    async def _reload(self):
+        while True:
+            self._pending = False
+            try:
+                config = await self._loop.run_in_executor(None, load_config, self.path,
+                                                          self._current.generation + 1, False)
+            except ConfigError as e:
+                self.failures += 1
+                logging.error(f"Configuration change rejected, keeping generation "
+                              f"{self._current.generation}: {e}")
+            else:
+                if config.digest != self._current.digest:
+                    self._swap(config)
+            if not self._pending:
+                return
+
+    def _swap(self, config):
+        old, self._current = self._current, config
+        self.reloads += 1
+        logging.info(f"Configuration generation {config.generation} loaded (version {config.version})")
+        for callback in self._subscribers:
+            try:
+                callback(old, config)
+            except Exception as e:
+                logging.error(f"Applying configuration generation {config.generation} failed: {e}")
+
+    def _watch(self):
+        """Watch the configuration directory, or its nearest existing ancestor until that is created."""
+        directory = self._directory
+        while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+            directory = os.path.dirname(directory)
+        if self._watched is not None:
+            self._inotify.rm_watch(self._watched[0])
+        if directory == self._directory:
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        else:
+            mask = IN_CREATE | IN_MOVED_TO
+        self._watched = (self._inotify.add_watch(directory, mask | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR),
+                         directory)
+        if directory != self._directory and os.path.isdir(self._next_step(directory)):
+            return self._watch()  # created before the watch was in place
+        return directory
+
+    def _next_step(self, directory):
+        """The path one level below directory on the way to the configuration directory."""
+        rest = os.path.relpath(self._directory, directory)
+        return os.path.join(directory, rest.split(os.sep, 1)[0])
+
+    def _on_events(self):
+        wd, directory = self._watched
+        name = os.path.basename(self.path)
+        for event_wd, mask, event_name in self._inotify.events():
+            if event_wd != wd:
+                continue  # left over from a directory no longer watched
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._watch()  # back up to the nearest ancestor that is still there
+                return
+            if directory == self._directory:
+                if event_name == name:
+                    self.reload()
+                    return
+            elif os.path.join(directory, event_name) == self._next_step(directory):
+                if self._watch() == self._directory and os.path.exists(self.path):
+                    self.reload()  # the file may have been written before its directory was watched
+                return
+
+    async def _poll(self):
+        previous = _stat_key(self.path)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = _stat_key(self.path)
+            if current != previous:
+                previous = current
+                await self.reload()
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
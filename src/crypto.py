@@ -1 +1,373 @@
 #crypto.py - fxetrx creates it's own PKI to sign the certificate securing the service, sign things, whatever
+#
+# - the PKI: a local CA (ECDSA P-256) that issues the service's TLS certificate,
+#   and an Ed25519 signing key for manifests and plugin bundles
+# - keys are loaded and parsed once per process and kept in memory; loading the
+#   same file again only costs a stat
+# - Signer and Verifier work on SHA-256 digests, one at a time or in batches;
+#   large batches are split across one process per core, each of which parses
+#   the key once
+# - a VerificationCache remembers which (key id, digest) pairs have verified, so
+#   unchanged artifacts are not re-verified at every start. A verified pair
+#   proves the key signed that digest, whichever signature is presented later,
+#   so the signature is not part of the cache key. Failures are never cached.
+import datetime
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.x509.oid import NameOID
+
+from src.hashing import FileHasher
+
+CERT_DIR = "/etc/fxetrx/certificates"
+CA_KEY_FILE = os.path.join(CERT_DIR, "ca.key")
+CA_CERT_FILE = os.path.join(CERT_DIR, "ca.crt")
+SERVICE_KEY_FILE = os.path.join(CERT_DIR, "fxetrx.key")
+SERVICE_CERT_FILE = os.path.join(CERT_DIR, "fxetrx.crt")
+SIGNING_KEY_FILE = os.path.join(CERT_DIR, "manifest_signing.key")
+SIGNING_PUBLIC_KEY_FILE = os.path.join(CERT_DIR, "manifest_signing.pub")
+VERIFY_CACHE_FILE = "/var/lib/fxetrx/verified.json"
+SIGNATURE_SUFFIX = ".sig"
+CA_DAYS = 3650
+CERT_DAYS = 397
+# Batches smaller than this are not worth starting worker processes for.
+PARALLEL_THRESHOLD = 4096
+
+
+class CryptoError(Exception):
+    """Raised when a key cannot be loaded or does not match what is expected."""
+
+
+# realpath -> ((st_ino, st_size, st_mtime_ns), parsed key)
+_key_cache = {}
+
+
+def _load_key(path, loader):
+    real = os.path.realpath(path)
+    try:
+        st = os.stat(real)
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        cached = _key_cache.get(real)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(real, "rb") as f:
+            key = loader(f.read())
+    except (OSError, ValueError, TypeError) as e:
+        raise CryptoError(f"Cannot load key {path}: {e}")
+    _key_cache[real] = (stamp, key)
+    return key
+
+
+def load_private_key(path):
+    """Parsed PEM private key at path; parsed again only once the file changes."""
+    return _load_key(path, lambda data: serialization.load_pem_private_key(data, password=None))
+
+
+def load_public_key(path):
+    """Parsed PEM public key at path; parsed again only once the file changes."""
+    return _load_key(path, serialization.load_pem_public_key)
+
+
+def public_bytes(public_key):
+    """Raw 32-byte form of an Ed25519 public key."""
+    return public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+def key_id(public_key):
+    """Stable identifier of an Ed25519 public key: hex SHA-256 of its raw bytes."""
+    return hashlib.sha256(public_bytes(public_key)).hexdigest()
+
+
+def _write_private_key(key, path):
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+
+
+def _write_public_key(key, path):
+    with open(path, "wb") as f:
+        f.write(key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+
+
+def generate_signing_key(key_path=SIGNING_KEY_FILE, public_key_path=SIGNING_PUBLIC_KEY_FILE):
+    """Create the Ed25519 signing key pair; returns its key id."""
+    key = Ed25519PrivateKey.generate()
+    _write_private_key(key, key_path)
+    _write_public_key(key.public_key(), public_key_path)
+    return key_id(key.public_key())
+
+
+def _name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, "fxetrx"),
+                      x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def create_ca(key_path=CA_KEY_FILE, cert_path=CA_CERT_FILE, days=CA_DAYS):
+    """Create the local CA key and self-signed certificate."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(_name("fxetrx local CA"))
+            .issuer_name(_name("fxetrx local CA"))
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=days))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+            .add_extension(x509.KeyUsage(digital_signature=False, content_commitment=False, key_encipherment=False,
+                                         data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                                         crl_sign=True, encipher_only=False, decipher_only=False), critical=True)
+            .sign(key, hashes.SHA256()))
+    _write_private_key(key, key_path)
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return cert
+
+
+def issue_service_certificate(hostnames=("localhost", "127.0.0.1"), ca_key_path=CA_KEY_FILE,
+                              ca_cert_path=CA_CERT_FILE, key_path=SERVICE_KEY_FILE, cert_path=SERVICE_CERT_FILE,
+                              days=CERT_DAYS):
+    """Issue the service's TLS certificate from the local CA; writes the key and certificate chain."""
+    ca_key = load_private_key(ca_key_path)
+    with open(ca_cert_path, "rb") as f:
+        ca_pem = f.read()
+    ca_cert = x509.load_pem_x509_certificate(ca_pem)
+    # P-256 keeps TLS handshakes cheap compared with RSA.
+    key = ec.generate_private_key(ec.SECP256R1())
+    names = []
+    for hostname in hostnames:
+        try:
+            names.append(x509.IPAddress(ipaddress.ip_address(hostname)))
+        except ValueError:
+            names.append(x509.DNSName(hostname))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(_name(hostnames[0]))
+            .issuer_name(ca_cert.subject)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=days))
+            .add_extension(x509.SubjectAlternativeName(names), critical=False)
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+            .add_extension(x509.ExtendedKeyUsage([x509.ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+            .sign(ca_key, hashes.SHA256()))
+    _write_private_key(key, key_path)
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM) + ca_pem)
+    return cert
+
+
+# Worker-process side of batch signing and verification. The key material is
+# handed over once per process by the pool initializer.
+_worker_signing_key = None
+_worker_public_keys = {}
+
+
+def _init_sign_worker(private_raw):
+    global _worker_signing_key
+    _worker_signing_key = Ed25519PrivateKey.from_private_bytes(private_raw)
+
+
+def _sign_chunk(digests):
+    return [_worker_signing_key.sign(digest) for digest in digests]
+
+
+def _init_verify_worker(public_raw):
+    _worker_public_keys.update((kid, Ed25519PublicKey.from_public_bytes(raw)) for kid, raw in public_raw.items())
+
+
+def _verify_chunk(items):
+    results = []
+    for kid, digest, signature in items:
+        try:
+            _worker_public_keys[kid].verify(signature, digest)
+            results.append(True)
+        except InvalidSignature:
+            results.append(False)
+    return results
+
+
+def _chunks(items, count):
+    size = -(-len(items) // count)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class Signer:
+    """Signs digests with one Ed25519 private key held in memory."""
+
+    def __init__(self, private_key, jobs=None):
+        if not isinstance(private_key, Ed25519PrivateKey):
+            raise CryptoError("Signing keys must be Ed25519")
+        self.private_key = private_key
+        self.key_id = key_id(private_key.public_key())
+        self.jobs = jobs or os.cpu_count() or 1
+
+    @classmethod
+    def from_file(cls, path=SIGNING_KEY_FILE, jobs=None):
+        return cls(load_private_key(path), jobs)
+
+    def sign(self, digest):
+        """64-byte signature of digest."""
+        return self.private_key.sign(digest)
+
+    def sign_batch(self, digests):
+        """Signatures of digests, in order; large batches are signed on every core."""
+        digests = list(digests)
+        if self.jobs < 2 or len(digests) < PARALLEL_THRESHOLD:
+            return [self.private_key.sign(digest) for digest in digests]
+        private_raw = self.private_key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                                     serialization.NoEncryption())
+        with ProcessPoolExecutor(self.jobs, initializer=_init_sign_worker, initargs=(private_raw,)) as pool:
+            return [signature for chunk in pool.map(_sign_chunk, _chunks(digests, self.jobs))
+                    for signature in chunk]
+
+
+class VerificationCache:
+    """(key id, digest) pairs that have verified before, optionally persisted between runs."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.verified = set()
+        self.dirty = False
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.verified = {tuple(pair) for pair in json.load(f)}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable verification cache {self.path}: {e}")
+
+    def save(self):
+        """Atomically write the cache if anything was added."""
+        if not self.path or not self.dirty:
+            return
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(sorted(self.verified), f, separators=(",", ":"))
+        os.replace(temp_file, self.path)
+        self.dirty = False
+
+    def __contains__(self, pair):
+        return pair in self.verified
+
+    def add(self, pair):
+        if pair not in self.verified:
+            self.verified.add(pair)
+            self.dirty = True
+
+
+class Verifier:
+    """Verifies digest signatures against known Ed25519 public keys, skipping pairs already in the cache."""
+
+    def __init__(self, cache=None, jobs=None):
+        self.keys = {}
+        self.cache = cache if cache is not None else VerificationCache()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.hits = 0
+        self.misses = 0
+
+    def add_key(self, public_key):
+        """Trust public_key; returns its key id."""
+        if not isinstance(public_key, Ed25519PublicKey):
+            raise CryptoError("Signing keys must be Ed25519")
+        kid = key_id(public_key)
+        self.keys[kid] = public_key
+        return kid
+
+    def add_key_file(self, path=SIGNING_PUBLIC_KEY_FILE):
+        return self.add_key(load_public_key(path))
+
+    def verify(self, kid, digest, signature):
+        """True if signature is kid's signature of digest."""
+        return self.verify_batch([(kid, digest, signature)])[0]
+
+    def verify_batch(self, items):
+        """Verify (key id, digest, signature) items; returns one bool per item, in order."""
+        items = list(items)
+        results = [False] * len(items)
+        pending = []
+        for index, (kid, digest, signature) in enumerate(items):
+            if kid not in self.keys:
+                raise CryptoError(f"Unknown key id {kid}")
+            if (kid, digest.hex()) in self.cache:
+                self.hits += 1
+                results[index] = True
+            else:
+                pending.append(index)
+        self.misses += len(pending)
+        for index, ok in zip(pending, self._verify([items[index] for index in pending])):
+            results[index] = ok
+            if ok:
+                kid, digest, _ = items[index]
+                self.cache.add((kid, digest.hex()))
+        return results
+
+    def _verify(self, items):
+        if self.jobs < 2 or len(items) < PARALLEL_THRESHOLD:
+            results = []
+            for kid, digest, signature in items:
+                try:
+                    self.keys[kid].verify(signature, digest)
+                    results.append(True)
+                except InvalidSignature:
+                    results.append(False)
+            return results
+        public_raw = {kid: public_bytes(key) for kid, key in self.keys.items()}
+        with ProcessPoolExecutor(self.jobs, initializer=_init_verify_worker, initargs=(public_raw,)) as pool:
+            return [ok for chunk in pool.map(_verify_chunk, _chunks(items, self.jobs)) for ok in chunk]
+
+
+def sign_files(signer, file_paths, hasher=None):
+    """Write a detached <file>.sig holding signer's signature of each file's SHA-256."""
+    hasher = hasher or FileHasher()
+    file_paths = list(file_paths)
+    digests = []
+    for file_path, digest in zip(file_paths, hasher.map(file_paths)):
+        try:
+            digests.append(bytes.fromhex(digest))
+        except ValueError:
+            # FileHasher returns an error marker instead of a digest
+            raise CryptoError(f"Cannot sign {file_path}: {digest}")
+    for file_path, signature in zip(file_paths, signer.sign_batch(digests)):
+        with open(file_path + SIGNATURE_SUFFIX, "wb") as f:
+            f.write(signature)
+
+
+def verify_files(verifier, kid, file_paths, hasher=None):
+    """
+    Check the detached signatures of file_paths against key kid.
+    Returns the files that are unsigned or do not verify. Files are re-hashed
+    unless a hasher with a stat cache is passed in; only the signature checks
+    are skipped for digests the verifier has seen before.
+    """
+    hasher = hasher or FileHasher()
+    file_paths = list(file_paths)
+    items, failed = [], []
+    for file_path, digest in zip(file_paths, hasher.map(file_paths)):
+        try:
+            with open(file_path + SIGNATURE_SUFFIX, "rb") as f:
+                signature = f.read()
+            items.append((file_path, (kid, bytes.fromhex(digest), signature)))
+        except (OSError, ValueError):
+            # unreadable file (error marker instead of a digest) or missing signature
+            failed.append(file_path)
+    for (file_path, _), ok in zip(items, verifier.verify_batch(item for _, item in items)):
+        if not ok:
+            failed.append(file_path)
+    return failed
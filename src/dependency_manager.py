@@ -1,25 +1,61 @@
 #dependency_manager.py - manages dependencies for fxetrx and its plugins
+import argparse
+import logging
+import os
+import subprocess
 
+from build.venv_setup import setup_fxetrx_venv
+from src.plugin_venv_setup import (WheelStore, provision_plugins, interpreter_fingerprint,
+                                   requirements_fingerprint, read_fingerprint, write_fingerprint)
 
-def check_dependencies():
-    """Check if required dependencies are installed."""
+CORE_REQUIREMENTS = "core_requirements.txt"
+
+
+def install_core_requirements(fxetrx_python):
+    """pip install the core requirements, unless they are unchanged since the last install."""
+    venv_path = os.path.dirname(os.path.dirname(fxetrx_python))
+    fingerprint = {
+        "interpreter": interpreter_fingerprint(),
+        "requirements": requirements_fingerprint(CORE_REQUIREMENTS),
+    }
+    if read_fingerprint(venv_path) == fingerprint:
+        logging.info("Core dependencies unchanged, skipping pip")
+        return
+    subprocess.run([fxetrx_python, "-m", "pip", "install", "-r", CORE_REQUIREMENTS], check=True)
+    write_fingerprint(venv_path, fingerprint)
+
+
+def check_dependencies(jobs=None):
+    """Check if required dependencies are installed; plugin venvs are set up `jobs` at a time."""
     logging.info("Checking service dependencies...")
     fxetrx_python = setup_fxetrx_venv()
-    subprocess.run([fxetrx_python, "-m", "pip", "install", "-r", "core_requirements.txt"], check=True)
+    install_core_requirements(fxetrx_python)
     
     plugins_dir = "plugins"
     if not os.path.exists(plugins_dir):
         logging.warning("Plugins directory not found. Skipping venv setup.")
         return
     
-    for plugin in os.listdir(plugins_dir):
-        plugin_path = os.path.join(plugins_dir, plugin)
-        if os.path.isdir(plugin_path):
-            venv_path = os.path.join(plugin_path, "venv")
-            if not os.path.exists(venv_path):
-                logging.info(f"Creating virtual environment for {plugin}...")
-                venv.create(venv_path, with_pip=True)
-            
-            logging.info(f"Installing dependencies for {plugin}...")
-            subprocess.run([os.path.join(venv_path, "bin", "pip"), "install", "-r", os.path.join(plugin_path, "requirements.txt")], check=True)
+    # Plugin venvs are assembled from one shared, content-addressed wheel store
+    store = WheelStore(os.path.join(plugins_dir, ".store"), python=fxetrx_python)
+    plugin_paths = [os.path.join(plugins_dir, plugin) for plugin in sorted(os.listdir(plugins_dir))
+                    if os.path.isdir(os.path.join(plugins_dir, plugin)) and not plugin.startswith(".")]
+    logging.info(f"Installing dependencies for {len(plugin_paths)} plugins...")
+    reports = provision_plugins(plugin_paths, store, jobs)
+    
+    if reports:
+        saved = sum(report.bytes_shared for report in reports)
+        logging.info(f"Plugin venvs: {len(reports)} set up, {saved / 1048576:.1f} MiB saved by linking from the store")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install fxetrx core and plugin dependencies")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="plugin venvs to set up in parallel (default: number of CPUs)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    check_dependencies(jobs=args.jobs)
+
 
+if __name__ == "__main__":
+    main()
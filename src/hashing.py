@@ -0,0 +1,114 @@
+# hashing.py - SHA-256 of files, shared by the build and the running service
+#
+# The build hashes every file into manifest.csv and the plugin index; the
+# service re-hashes deployed files to verify them and signs or checks their
+# digests (integrity.py, crypto.py). Both sides use the same FileHasher, so a
+# digest means the same thing everywhere:
+# - files of MMAP_THRESHOLD bytes and more are hashed from an mmap, which lets
+#   hashlib release the GIL and hash on several threads at once
+# - a stat cache maps (inode, size, mtime_ns) to a digest, so unchanged files
+#   are not read again; files modified within RACY_WINDOW_NS are never cached
+# - a file that cannot be hashed gets an error marker instead of a digest
+#   (FILE_NOT_FOUND, PERMISSION_DENIED, ERROR, or DIRECTORY)
+import hashlib
+import json
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+READ_CHUNK = 1024 * 1024
+MMAP_THRESHOLD = 8 * 1024 * 1024
+# Files modified this recently are not cached: another write within the same
+# mtime tick would otherwise go unnoticed on the next run.
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+
+def calculate_sha256(file_path):
+    """Calculate SHA256 hash of a given file."""
+    hash_sha256 = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= MMAP_THRESHOLD:
+                # hashlib releases the GIL while hashing a large buffer, so mapped
+                # files hash in parallel across worker threads.
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hash_sha256.update(mapped)
+            else:
+                for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                    hash_sha256.update(chunk)
+        return hash_sha256.hexdigest()
+    except FileNotFoundError:
+        logging.error(f"File not found: {file_path}")
+        return "FILE_NOT_FOUND"
+    except PermissionError:
+        logging.error(f"Permission denied when accessing: {file_path}")
+        return "PERMISSION_DENIED"
+    except Exception as e:
+        logging.error(f"Unexpected error accessing {file_path}: {e}")
+        return "ERROR"
+
+
+def load_hash_cache(path):
+    """Load the stat cache of previously computed digests."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable hash cache {path}: {e}")
+        return {}
+
+
+def save_hash_cache(cache, path):
+    """Atomically write the stat cache."""
+    temp_file = path + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+    os.replace(temp_file, path)
+
+
+class FileHasher:
+    """Hashes files on a thread pool, reusing digests of files whose (inode, size, mtime_ns) is unchanged."""
+
+    def __init__(self, cache=None, jobs=None):
+        self.cache = cache if cache is not None else {}
+        self.jobs = jobs or os.cpu_count() or 1
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, file_path):
+        """Return (sha256, size, mtime_ns) for file_path; anything but a regular file is ("DIRECTORY", "", "")."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return calculate_sha256(file_path), "", ""  # logs and returns the error marker
+        if not os.path.isfile(file_path):
+            return "DIRECTORY", "", ""
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        cached = self.cache.get(file_path)
+        if cached and cached[:3] == key:
+            self.hits += 1
+            return cached[3], st.st_size, st.st_mtime_ns
+        self.misses += 1
+        digest = calculate_sha256(file_path)
+        if len(digest) == 64 and time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+            self.cache[file_path] = key + [digest]
+        return digest, st.st_size, st.st_mtime_ns
+
+    def digest(self, file_path):
+        """Return the SHA256 of file_path, or "DIRECTORY" for anything that is not a regular file."""
+        return self.entry(file_path)[0]
+
+    def map(self, file_paths):
+        """Digests for file_paths, in order, computed in parallel."""
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="hash") as pool:
+            yield from pool.map(self.digest, file_paths)
+
+    def map_entries(self, file_paths):
+        """(sha256, size, mtime_ns) for file_paths, in order, computed in parallel."""
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="hash") as pool:
+            yield from pool.map(self.entry, file_paths)
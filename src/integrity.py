@@ -0,0 +1,173 @@
+#integrity.py - verify the deployed fxetrx tree against the build manifest
+#
+# manifest.csv records a SHA-256, size and mtime for every built file. Checking
+# a deployment against it has three levels so tamper detection stays off the
+# restart critical path:
+# - fast:    stat every file and compare size and mtime with the manifest;
+#            a file of the right size with another mtime (a copied
+#            deployment, or a touched file) is re-hashed instead of reported
+# - sampled: fast, plus re-hashing a random subset of files
+# - full:    fast at startup, then re-hashing every file in parallel in the
+#            background once the service is already serving
+# The manifest itself is only trusted if its detached signature
+# (manifest.csv.sig, written by the build) verifies against the manifest
+# signing key.
+import csv
+import hashlib
+import logging
+import os
+import random
+import time
+
+from src.hashing import FileHasher
+
+MANIFEST_FILE = "./build/manifest.csv"  # written by build.update_manifest()
+LEVELS = ("off", "fast", "sampled", "full")
+DEFAULT_SAMPLE_SIZE = 32
+SIGNATURE_SUFFIX = ".sig"
+MANIFEST_KEY_FILE = "/etc/fxetrx/certificates/manifest_signing.pub"
+
+
+class IntegrityError(Exception):
+    """Raised when the manifest or its signature cannot be trusted."""
+
+
+class ManifestEntry:
+    """One file listed in the manifest."""
+
+    __slots__ = ("path", "sha256", "size", "mtime_ns")
+
+    def __init__(self, path, sha256, size, mtime_ns):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+class IntegrityReport:
+    """Outcome of one verification pass."""
+
+    def __init__(self, level):
+        self.level = level
+        self.checked = 0
+        self.hashed = 0
+        self.problems = []
+        self.signed = False
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def __str__(self):
+        state = "ok" if self.ok else f"{len(self.problems)} problems"
+        return (f"{self.level} integrity check: {state}, {self.checked} files checked, {self.hashed} hashed, "
+                f"{'signed' if self.signed else 'UNSIGNED'} manifest, {self.seconds:.2f}s")
+
+
+def verify_manifest_signature(manifest_path, public_key_path=MANIFEST_KEY_FILE):
+    """
+    Check the manifest's detached Ed25519 signature, which the build writes
+    with crypto.sign_files() over the manifest's SHA-256; returns False when no
+    signing key is installed.
+    """
+    signature_path = manifest_path + SIGNATURE_SUFFIX
+    if not os.path.exists(public_key_path):
+        return False
+    # Once a signing key is installed, a missing signature is as bad as a wrong one.
+    if not os.path.exists(signature_path):
+        raise IntegrityError(f"Manifest signature missing: {signature_path}")
+    from src.crypto import CryptoError, Verifier
+    verifier = Verifier(jobs=1)
+    try:
+        kid = verifier.add_key_file(public_key_path)
+    except CryptoError as e:
+        raise IntegrityError(str(e))
+    with open(manifest_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).digest()
+    with open(signature_path, "rb") as f:
+        signature = f.read()
+    if not verifier.verify(kid, digest, signature):
+        raise IntegrityError(f"Manifest signature does not verify: {manifest_path}")
+    return True
+
+
+def load_manifest(manifest_path, root):
+    """Read the file entries of the manifest, resolved against root."""
+    entries = []
+    manifest_real = os.path.realpath(manifest_path)
+    with open(manifest_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 2 or row[1].strip() in ("", "DIRECTORY"):
+                continue
+            path = os.path.normpath(os.path.join(root, row[0].strip()))
+            # The manifest lists itself, but can never contain its own final hash.
+            if os.path.realpath(path) == manifest_real:
+                continue
+            size = int(row[3]) if len(row) > 3 and row[3].strip().isdigit() else None
+            mtime_ns = int(row[4]) if len(row) > 4 and row[4].strip().isdigit() else None
+            entries.append(ManifestEntry(path, row[1].strip(), size, mtime_ns))
+    return entries
+
+
+def check_stat(entries, report):
+    """Compare size and mtime of every entry with the file on disk; returns the entries to re-hash."""
+    rehash = []
+    for entry in entries:
+        report.checked += 1
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            report.problems.append(f"missing: {entry.path}")
+            continue
+        if entry.size is not None and st.st_size != entry.size:
+            report.problems.append(f"size changed: {entry.path}")
+        elif entry.mtime_ns is not None and st.st_mtime_ns != entry.mtime_ns:
+            rehash.append(entry)
+    return rehash
+
+
+def check_hashes(entries, report, jobs=None):
+    """Re-hash entries in parallel and compare with the manifest digests."""
+    # No stat cache here: trusting cached digests would defeat the check.
+    hasher = FileHasher(jobs=jobs)
+    for entry, digest in zip(entries, hasher.map([entry.path for entry in entries])):
+        report.hashed += 1
+        if digest != entry.sha256:
+            report.problems.append(f"hash mismatch: {entry.path}")
+
+
+def verify(level, manifest_path=MANIFEST_FILE, root=".", sample_size=DEFAULT_SAMPLE_SIZE, jobs=None,
+           public_key_path=MANIFEST_KEY_FILE):
+    """Run the startup part of a verification level; for "full" this is the fast check only."""
+    report = IntegrityReport("fast" if level == "full" else level)
+    start = time.monotonic()
+    report.signed = verify_manifest_signature(manifest_path, public_key_path)
+    if not report.signed:
+        logging.warning(f"Manifest {manifest_path} is not signed; integrity checks only detect accidental changes")
+    entries = load_manifest(manifest_path, root)
+    rehash = check_stat(entries, report)
+    if rehash:
+        logging.info(f"{len(rehash)} files have other mtimes than in the manifest; comparing their hashes")
+    if level == "sampled":
+        queued = set(rehash)
+        unchanged = [entry for entry in entries if entry not in queued]
+        rehash += random.sample(unchanged, min(sample_size, len(unchanged)))
+    if rehash:
+        check_hashes(rehash, report, jobs)
+    report.seconds = time.monotonic() - start
+    return report
+
+
+def verify_full(manifest_path=MANIFEST_FILE, root=".", jobs=None, public_key_path=MANIFEST_KEY_FILE):
+    """Re-hash every file listed in the manifest; meant to run in the background."""
+    report = IntegrityReport("full")
+    start = time.monotonic()
+    report.signed = verify_manifest_signature(manifest_path, public_key_path)
+    entries = load_manifest(manifest_path, root)
+    report.checked = len(entries)
+    check_hashes(entries, report, jobs)
+    report.seconds = time.monotonic() - start
+    return report
@@ -0,0 +1,264 @@
+# ipc.py - framed binary channel between the core service and plugin workers
+#
+# Messages travel over a Unix domain socket (a socketpair whose child end is
+# inherited by the worker) as frames:
+#
+#   header  kind (u8) | flags (u8) | reserved (u16) | message id (u32) | length (u32)
+#   body    `length` bytes: a marshal-encoded payload (raw bytes with FLAG_RAW),
+#           or with FLAG_SHM an (offset, length, end) reference to that payload
+#           in the sender's ring buffer
+#
+# marshal is the interpreter's own binary format for plain data (None, bools,
+# numbers, str, bytes, lists, tuples, dicts, sets); it is several times faster
+# than JSON both ways and carries bytes without base64. It is not hardened
+# against hostile input, which is fine here: workers run as the service user
+# and are trusted exactly as much as the plugin code they already execute.
+#
+# Payloads of SHM_THRESHOLD bytes and more do not go through the socket: each
+# direction has a shared-memory Ring (a memfd, also inherited by the worker)
+# that the sender copies the encoded payload into once, and the receiver
+# decodes straight out of the mapping. A payload that does not fit in the free
+# part of the ring falls back to an inline frame, so a send never blocks on
+# the receiver.
+#
+# Only the standard library may be imported here: plugin workers import this
+# module under their own venv interpreter.
+import asyncio
+import marshal
+import mmap
+import os
+import socket
+import struct
+import tempfile
+
+HEADER = struct.Struct("<BBHII")
+SHM_REF = struct.Struct("<QQQ")  # offset, length, end counter
+RING_HEADER = struct.Struct("<Q")  # consumed counter, written by the receiver
+RING_DATA = 64  # ring data starts after a cache line holding the consumed counter
+DEFAULT_RING_SIZE = 64 * 1024 * 1024  # bytes; memfd pages are only allocated once touched
+SHM_THRESHOLD = 256 * 1024  # bytes
+MAX_FRAME = 1024 * 1024 * 1024  # inline frames larger than this are rejected
+
+# Frame kinds
+READY = 1
+CALL = 2
+RESULT = 3
+ERROR = 4
+SECRET = 5  # worker -> core during a CALL: {"name"}; answered with a SECRET frame {"value"}
+
+FLAG_SHM = 0x01
+FLAG_RAW = 0x02  # the payload is a bytes object, sent as is rather than marshalled
+
+
+class ChannelError(Exception):
+    """Raised on a malformed frame or a closed channel."""
+
+
+def create_ring_fd(size=DEFAULT_RING_SIZE):
+    """An anonymous shared-memory file of `size` bytes that child processes can inherit."""
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("fxetrx-ipc", os.MFD_CLOEXEC)
+    else:
+        fd, path = tempfile.mkstemp(prefix="fxetrx-ipc-")
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd
+
+
+class Ring:
+    """
+    Single-producer, single-consumer byte ring in shared memory.
+    The producer tracks `head` privately; the consumer publishes how far it has
+    read in the ring header. Both are running byte counters, so free space is
+    size - (head - consumed).
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.map = mmap.mmap(fd, 0)
+        self.size = len(self.map) - RING_DATA
+        self.view = memoryview(self.map)
+        self.head = 0
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+    @property
+    def consumed(self):
+        return RING_HEADER.unpack_from(self.map, 0)[0]
+
+    def put(self, data):
+        """Copy data into the ring; returns the SHM_REF body, or None if it does not fit right now."""
+        n = len(data)
+        position = self.head % self.size
+        start = self.head
+        if position + n > self.size:
+            start += self.size - position  # skip the tail end; messages are never split
+            position = 0
+        end = start + n
+        if end - self.consumed > self.size:
+            return None
+        self.view[RING_DATA + position:RING_DATA + position + n] = data
+        self.head = end
+        return SHM_REF.pack(position, n, end)
+
+    def get(self, ref):
+        """Return (memoryview of the payload, end counter) for an SHM_REF body."""
+        position, n, end = SHM_REF.unpack(ref)
+        if position + n > self.size:
+            raise ChannelError("Ring reference out of bounds")
+        return self.view[RING_DATA + position:RING_DATA + position + n], end
+
+    def release(self, end):
+        """Mark everything up to the `end` counter as consumed."""
+        RING_HEADER.pack_into(self.map, 0, end)
+
+
+def encode(kind, message_id, payload, ring=None):
+    """Build the frame(s) for one message; large payloads go into ring when it has room."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        body, flags = payload, FLAG_RAW
+    else:
+        body, flags = marshal.dumps(payload), 0
+    if ring is not None and len(body) >= SHM_THRESHOLD:
+        ref = ring.put(body)
+        if ref is not None:
+            body, flags = ref, flags | FLAG_SHM
+    return HEADER.pack(kind, flags, 0, message_id, len(body)), body
+
+
+def decode_header(header):
+    """Return (kind, flags, message id, body length)."""
+    kind, flags, _, message_id, length = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ChannelError(f"Frame too large: {length} bytes")
+    return kind, flags, message_id, length
+
+
+def decode_body(flags, body, ring=None):
+    """Decode a frame body, reading it out of ring for FLAG_SHM frames."""
+    load = bytes if flags & FLAG_RAW else marshal.loads
+    if not flags & FLAG_SHM:
+        return load(body)
+    if ring is None:
+        raise ChannelError("Shared-memory frame on a channel without a ring")
+    data, end = ring.get(body)
+    try:
+        return load(data)
+    finally:
+        data.release()
+        ring.release(end)
+
+
+class Channel:
+    """Blocking end of a channel; used inside the worker."""
+
+    def __init__(self, sock, send_ring=None, recv_ring=None):
+        self.sock = sock
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+
+    def send(self, kind, message_id, payload):
+        header, body = encode(kind, message_id, payload, self.send_ring)
+        if len(body) < SHM_THRESHOLD:
+            self.sock.sendall(header + body)  # one syscall for small frames
+        else:
+            self.sock.sendall(header)
+            self.sock.sendall(body)
+
+    def recv(self):
+        """Return (kind, message id, payload), or None once the other end has closed."""
+        header = self._recv_exactly(HEADER.size)
+        if header is None:
+            return None
+        kind, flags, message_id, length = decode_header(header)
+        body = self._recv_exactly(length) if length else b""
+        if body is None:
+            raise ChannelError("Channel closed mid-frame")
+        return kind, message_id, decode_body(flags, body, self.recv_ring)
+
+    def _recv_exactly(self, n):
+        buffer = bytearray(n)
+        view = memoryview(buffer)
+        received = 0
+        while received < n:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                if received == 0:
+                    return None
+                raise ChannelError("Channel closed mid-frame")
+            received += count
+        return buffer
+
+    def close(self):
+        self.sock.close()
+        for ring in (self.send_ring, self.recv_ring):
+            if ring is not None:
+                ring.close()
+
+
+class AsyncChannel:
+    """asyncio end of a channel; used by the core service."""
+
+    def __init__(self, reader, writer, send_ring=None, recv_ring=None):
+        self.reader = reader
+        self.writer = writer
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+
+    @classmethod
+    async def connect(cls, sock, send_ring=None, recv_ring=None):
+        reader, writer = await asyncio.open_unix_connection(sock=sock, limit=SHM_THRESHOLD)
+        return cls(reader, writer, send_ring, recv_ring)
+
+    async def send(self, kind, message_id, payload):
+        header, body = encode(kind, message_id, payload, self.send_ring)
+        self.writer.writelines((header, body))
+        await self.writer.drain()
+
+    async def recv(self):
+        """Return (kind, message id, payload), or None once the other end has closed."""
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise ChannelError("Channel closed mid-frame")
+        kind, flags, message_id, length = decode_header(header)
+        try:
+            body = await self.reader.readexactly(length) if length else b""
+        except asyncio.IncompleteReadError:
+            raise ChannelError("Channel closed mid-frame")
+        return kind, message_id, decode_body(flags, body, self.recv_ring)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        for ring in (self.send_ring, self.recv_ring):
+            if ring is not None:
+                ring.close()
+
+
+def channel_pair(ring_size=DEFAULT_RING_SIZE):
+    """
+    Create both ends of a channel for a child process.
+    Returns (parent socket, parent send ring, parent receive ring, child fds)
+    where child fds = (socket fd, child-to-parent ring fd, parent-to-child ring fd)
+    must be passed to the child (pass_fds) and closed in the parent after spawning.
+    """
+    parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    to_child = create_ring_fd(ring_size)
+    to_parent = create_ring_fd(ring_size)
+    child_fds = (child.detach(), to_parent, to_child)
+    return parent, Ring(to_child), Ring(to_parent), child_fds
+
+
+def child_channel(sock_fd, send_ring_fd, recv_ring_fd):
+    """Open the child's end of a channel from the fds it inherited."""
+    sock = socket.socket(fileno=sock_fd)
+    sock.setblocking(True)
+    return Channel(sock, Ring(send_ring_fd), Ring(recv_ring_fd))
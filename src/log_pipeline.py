@@ -0,0 +1,309 @@
+# log_pipeline.py - non-blocking logging for the service core
+#
+# Logging calls never touch the disk. A QueueingHandler on the root logger
+# turns each record into plain data (message and traceback rendered in the
+# calling thread) and appends it to an in-memory queue; a LogWriter thread
+# drains the queue in batches, formats them and writes each batch with one
+# write() to a RotatingLogFile under /var/log/fxetrx/.
+#
+# - the file rotates once it passes max_bytes, and every rotate_interval
+#   seconds; `backups` old files are kept (fxetrx.log.1 is the newest)
+# - records are written as text lines or, with fmt="json", as compact JSON
+#   lines with any `extra=` fields attached to the record
+# - under backpressure nothing blocks: past half the queue, only one DEBUG
+#   record in `debug_sample` is kept; with the queue full, records below ERROR
+#   are dropped, and ERROR and above go past the bound. Dropped and sampled
+#   counts are logged once the writer catches up.
+import atexit
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_DIR = "/var/log/fxetrx"
+LOG_FILE = "fxetrx.log"
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = 24 * 3600.0  # seconds
+DEFAULT_BACKUPS = 7
+DEFAULT_QUEUE_SIZE = 65536  # records
+DEFAULT_DEBUG_SAMPLE = 16
+BATCH_SIZE = 1024  # records written per write()
+FLUSH_INTERVAL = 0.2  # seconds the first record of a batch may wait in the queue
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed with extra=.
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT lines; tracebacks were already rendered by QueueingHandler."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        return line.replace("\n", "\n  ")  # keep one record per line prefix for grep/tail
+
+
+class QueueingHandler(logging.Handler):
+    """Puts records on an in-memory queue for a LogWriter; never blocks on I/O."""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, debug_sample=DEFAULT_DEBUG_SAMPLE):
+        super().__init__()
+        # deque.append/popleft are atomic, so producers take no lock; the bound is
+        # checked with len(), which may overshoot by a few records under contention.
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.high_water = queue_size // 2
+        self.debug_sample = max(1, debug_sample)
+        self.wake = threading.Event()
+        self.sleeping = False  # the writer waits, with no timeout, for the next record
+        self.dropped = 0
+        self.sampled = 0
+        self._debug_seen = 0
+
+    def handle(self, record):
+        # Handler.handle() would take the handler lock around emit(); the queue needs none.
+        if self.filter(record):
+            self.emit(record)
+
+    def emit(self, record):
+        backlog = len(self.queue)
+        if backlog >= self.high_water:
+            if backlog >= self.queue_size and record.levelno < logging.ERROR:
+                self.dropped += 1
+                return
+            if record.levelno <= logging.DEBUG:
+                self._debug_seen += 1
+                if self._debug_seen % self.debug_sample:
+                    self.sampled += 1
+                    return
+        try:
+            self.queue.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if self.sleeping or (backlog + 1 >= BATCH_SIZE and not self.wake.is_set()):
+            self.sleeping = False
+            self.wake.set()
+
+    @staticmethod
+    def prepare(record):
+        """Render everything that refers to live objects, so the writer only sees plain data."""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = (record.exc_text + "\n" if record.exc_text else "") + record.stack_info
+            record.stack_info = None
+        return record
+
+
+class RotatingLogFile:
+    """Append-only log file rotated by size and by age."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, rotate_interval=DEFAULT_ROTATE_INTERVAL,
+                 backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.file = None
+        self.size = 0
+        self.next_rotation = None
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        # A restart must not postpone time-based rotation: an existing file is
+        # as old as the last rotation, which is when fxetrx.log.1 was last written.
+        opened = time.time()
+        if self.size:
+            try:
+                opened = os.stat(f"{self.path}.1").st_mtime
+            except OSError:
+                pass
+        self.next_rotation = opened + self.rotate_interval if self.rotate_interval else None
+
+    def write(self, text):
+        if self.size and ((self.max_bytes and self.size + len(text) > self.max_bytes)
+                          or (self.next_rotation is not None and time.time() >= self.next_rotation)):
+            self.rotate()
+        self.file.write(text)
+        self.file.flush()
+        self.size += len(text)
+
+    def rotate(self):
+        self.file.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class LogWriter(threading.Thread):
+    """Drains a QueueingHandler in batches into a RotatingLogFile."""
+
+    def __init__(self, handler, output, formatter):
+        super().__init__(name="log-writer", daemon=True)
+        self.handler = handler
+        self.output = output
+        self.formatter = formatter
+        self.written = 0
+        self._stopping = False
+        self._reported = (0, 0)
+
+    def run(self):
+        handler = self.handler
+        while not self._stopping:
+            if not handler.queue:
+                self._sleep()
+                continue
+            # the flush timer runs only once a record is queued
+            handler.wake.wait(FLUSH_INTERVAL)
+            handler.wake.clear()
+            self.drain()
+        self.drain()
+
+    def _sleep(self):
+        """Block until a record is queued or stop() is called; an idle writer never wakes."""
+        handler = self.handler
+        handler.sleeping = True
+        if not handler.queue:  # a record queued before `sleeping` was set would not wake us
+            handler.wake.wait()
+        handler.sleeping = False
+        handler.wake.clear()
+
+    def drain(self):
+        """Write everything queued so far."""
+        queue = self.handler.queue
+        while queue:
+            lines = []
+            while queue and len(lines) < BATCH_SIZE:
+                lines.append(self._format(queue.popleft()))
+            self._write(lines)
+        self._report_losses()
+
+    def _format(self, record):
+        try:
+            return self.formatter.format(record)
+        except Exception as e:
+            return f"unformattable log record from {record.name}: {e}"
+
+    def _write(self, lines):
+        try:
+            self.output.write("\n".join(lines) + "\n")
+            self.written += len(lines)
+        except OSError as e:
+            sys.stderr.write(f"fxetrx: cannot write log ({e}); {len(lines)} records lost\n")
+
+    def _report_losses(self):
+        current = (self.handler.dropped, self.handler.sampled)
+        if current == self._reported:
+            return
+        dropped, sampled = current[0] - self._reported[0], current[1] - self._reported[1]
+        self._reported = current
+        record = logging.LogRecord("fxetrx.log", logging.WARNING, __file__, 0,
+                                   "Log backpressure: %d records dropped, %d debug records sampled out",
+                                   (dropped, sampled), None)
+        record.dropped, record.sampled = dropped, sampled
+        self._write([self._format(QueueingHandler.prepare(record))])
+
+    def stop(self):
+        """Write out what is queued and stop the thread."""
+        self._stopping = True
+        self.handler.wake.set()
+        self.join()
+        self.output.close()
+
+
+class LogPipeline:
+    """The handler and writer installed by setup_logging()."""
+
+    def __init__(self, handler, writer):
+        self.handler = handler
+        self.writer = writer
+
+    def close(self):
+        logging.getLogger().removeHandler(self.handler)
+        if self.writer.is_alive():
+            self.writer.stop()
+
+
+_pipeline = None
+
+
+def register_metrics(registry):
+    """Queue depth and losses of the pipeline installed by setup_logging()."""
+    def stat(name):
+        return lambda: getattr(_pipeline.handler, name) if _pipeline is not None else 0
+
+    registry.gauge("fxetrx_log_queue_depth", "Log records waiting for the writer",
+                   lambda: len(_pipeline.handler.queue) if _pipeline is not None else 0)
+    registry.gauge("fxetrx_log_dropped_total", "Log records dropped under backpressure", stat("dropped"),
+                   kind="counter")
+    registry.gauge("fxetrx_log_sampled_total", "Debug records sampled out under backpressure", stat("sampled"),
+                   kind="counter")
+
+
+def setup_logging(directory=LOG_DIR, level=logging.INFO, fmt="text", max_bytes=DEFAULT_MAX_BYTES,
+                  rotate_interval=DEFAULT_ROTATE_INTERVAL, backups=DEFAULT_BACKUPS,
+                  queue_size=DEFAULT_QUEUE_SIZE, debug_sample=DEFAULT_DEBUG_SAMPLE):
+    """
+    Route the root logger through a queue to a rotating file in directory.
+    Falls back to stderr logging if the directory cannot be written.
+    """
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.close()
+    root = logging.getLogger()
+    root.setLevel(level)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        output = RotatingLogFile(os.path.join(directory, LOG_FILE), max_bytes, rotate_interval, backups)
+    except OSError as e:
+        logging.basicConfig(level=level, format=TEXT_FORMAT)
+        logging.error(f"Cannot log to {directory}: {e}; logging to stderr")
+        return None
+    handler = QueueingHandler(queue_size, debug_sample)
+    writer = LogWriter(handler, output, JsonFormatter() if fmt == "json" else TextFormatter())
+    writer.start()
+    root.addHandler(handler)
+    _pipeline = LogPipeline(handler, writer)
+    atexit.register(_pipeline.close)
+    return _pipeline
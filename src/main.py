@@ -1,3 +1,189 @@
 #main.py - the fxetrx core service
+#
+# Run from the fxetrx root with `python -m src.main`.
+import argparse
+import asyncio
+import logging
+import os
+import sys
 
-#GNDN
+from src import integrity
+from src import log_pipeline, metrics, readiness
+from src.config import ConfigStore, CONFIG_FILE
+from src.api import Api, StatusCache, DEFAULT_REFRESH_INTERVAL
+from src.net import RequestServer, create_ssl_context, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_MAX_CONNECTIONS, DEFAULT_BACKLOG
+from src.plugin_index import PLUGIN_INDEX_FILE
+from src.plugin_pool import PluginPools, DEFAULT_MAX_WORKERS, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_CALLS, DEFAULT_MAX_RSS
+from src.scheduler import Scheduler
+from service.status import check_service_status
+from src.secret_cache import SecretCache, DEFAULT_TTL as DEFAULT_SECRET_TTL, DEFAULT_MAX_ENTRIES as DEFAULT_SECRET_ENTRIES
+from src.service_template import CrossPlatformService
+
+CERT_DIR = "/etc/fxetrx/certificates"
+CERT_FILE = os.path.join(CERT_DIR, "fxetrx.crt")
+KEY_FILE = os.path.join(CERT_DIR, "fxetrx.key")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="fxetrx core service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--certfile", default=CERT_FILE)
+    parser.add_argument("--keyfile", default=KEY_FILE)
+    parser.add_argument("--insecure-http", action="store_true", help="serve plain HTTP (development only)")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument("--status-interval", type=float, default=DEFAULT_REFRESH_INTERVAL,
+                        help="seconds between background status refreshes")
+    parser.add_argument("--root", default=".", help="fxetrx installation directory the manifest is relative to")
+    parser.add_argument("--manifest", default=integrity.MANIFEST_FILE, help="build manifest, relative to --root")
+    parser.add_argument("--verify", choices=integrity.LEVELS,
+                        help="integrity check against the manifest: fast (size/mtime, the default), sampled (plus "
+                             "a random re-hashed subset) or full (plus a background re-hash of everything); when "
+                             "given, a missing manifest fails the check")
+    parser.add_argument("--verify-sample", type=int, default=integrity.DEFAULT_SAMPLE_SIZE,
+                        help="files re-hashed by --verify sampled")
+    parser.add_argument("--verify-action", choices=("warn", "stop"), default="stop",
+                        help="what to do when the integrity check fails")
+    parser.add_argument("--plugins-dir", default="plugins")
+    parser.add_argument("--plugin-index", default=PLUGIN_INDEX_FILE,
+                        help="plugin index written by the build; plugins are started on first use")
+    parser.add_argument("--plugin-min-workers", type=int, default=1, help="warm workers kept per plugin")
+    parser.add_argument("--plugin-max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--plugin-idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds before an idle worker above the minimum is reaped")
+    parser.add_argument("--plugin-max-calls", type=int, default=DEFAULT_MAX_CALLS,
+                        help="calls after which a worker is recycled (0: never)")
+    parser.add_argument("--plugin-max-rss", type=int, default=DEFAULT_MAX_RSS // 1048576,
+                        help="MiB of RSS after which a worker is recycled (0: no limit)")
+    parser.add_argument("--config", default=CONFIG_FILE,
+                        help="service configuration, reloaded without a restart when it changes")
+    parser.add_argument("--pidfile", default=readiness.PIDFILE)
+    parser.add_argument("--state-socket", default=readiness.STATE_SOCKET,
+                        help="unix socket reporting starting/ready/stopping to local clients")
+    parser.add_argument("--no-metrics", action="store_true", help="disable instrumentation and /metrics")
+    parser.add_argument("--log-dir", default=log_pipeline.LOG_DIR)
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    parser.add_argument("--log-format", default="text", choices=("text", "json"),
+                        help="json writes one compact JSON object per record")
+    parser.add_argument("--log-max-bytes", type=int, default=log_pipeline.DEFAULT_MAX_BYTES,
+                        help="rotate the log file past this size (0: no size limit)")
+    parser.add_argument("--log-rotate-interval", type=float, default=log_pipeline.DEFAULT_ROTATE_INTERVAL,
+                        help="seconds between time-based log rotations (0: never)")
+    parser.add_argument("--log-backups", type=int, default=log_pipeline.DEFAULT_BACKUPS)
+    parser.add_argument("--secret-ttl", type=float, default=DEFAULT_SECRET_TTL,
+                        help="seconds a keyring secret stays cached in memory (0: no caching)")
+    parser.add_argument("--secret-cache-size", type=int, default=DEFAULT_SECRET_ENTRIES,
+                        help="secrets kept in the in-memory cache")
+    args = parser.parse_args(argv)
+    args.manifest = os.path.join(args.root, args.manifest)  # an absolute --manifest stays as it is
+    return args
+
+
+def _integrity_failed(args, report):
+    """Log a failed integrity report; returns True if the service must stop."""
+    for problem in report.problems:
+        logging.error(f"Integrity: {problem}")
+    return args.verify_action == "stop"
+
+
+def check_integrity(args):
+    """Run the startup integrity check; returns False if the service must not start."""
+    if args.verify == "off":
+        return True
+    if args.verify is None and not os.path.exists(args.manifest):
+        # an installation without a build manifest: nothing to check against unless asked to
+        logging.warning(f"No manifest at {args.manifest}; skipping the integrity check")
+        return True
+    try:
+        report = integrity.verify(args.verify or "fast", args.manifest, args.root, args.verify_sample)
+    except (OSError, integrity.IntegrityError) as e:
+        logging.error(f"Integrity check failed: {e}")
+        return args.verify_action != "stop"
+    logging.info(str(report))
+    return report.ok or not _integrity_failed(args, report)
+
+
+class FullIntegrityCheck:
+    """Service component that re-hashes the installation in the background once the service is up."""
+
+    def __init__(self, args, service):
+        self.args = args
+        self.service = service
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            report = await loop.run_in_executor(None, integrity.verify_full, self.args.manifest, self.args.root)
+        except (OSError, integrity.IntegrityError) as e:
+            logging.error(f"Background integrity check failed: {e}")
+        else:
+            logging.info(str(report))
+            if report.ok or not _integrity_failed(self.args, report):
+                return
+        if self.args.verify_action == "stop":
+            logging.critical("Stopping service after failed integrity check")
+            self.service.request_stop()
+
+
+def apply_config(config, args, status_cache, secrets):
+    """Apply the settings of a newly loaded config; settings it leaves out go back to the command line's."""
+    logging.getLogger().setLevel(config.get("log_level", args.log_level))
+    status_cache.interval = config.get("status_interval", args.status_interval)
+    secrets.ttl = config.get("secret_ttl", args.secret_ttl)
+    status_cache.notify_change()  # the version in the status snapshot
+
+
+def build_service(args):
+    """Assemble the service components on one event loop."""
+    ssl_context = None if args.insecure_http else create_ssl_context(args.certfile, args.keyfile)
+    registry = None if args.no_metrics else metrics.Registry()
+    scheduler = Scheduler()
+    config = ConfigStore(args.config)
+    status_cache = StatusCache(lambda: check_service_status(config.current), interval=args.status_interval)
+    secrets = SecretCache(ttl=args.secret_ttl, max_entries=args.secret_cache_size, scheduler=scheduler)
+    plugins = PluginPools(args.plugins_dir, scheduler, args.plugin_index, min_workers=args.plugin_min_workers,
+                          max_workers=args.plugin_max_workers, idle_timeout=args.plugin_idle_timeout,
+                          max_calls=args.plugin_max_calls, max_rss=args.plugin_max_rss * 1048576,
+                          secrets=secrets)
+    loop_lag = None
+    if registry is not None:
+        loop_lag = metrics.LoopLagMonitor(registry.histogram("fxetrx_event_loop_lag_seconds",
+                                                             "How late the event loop ran a timer"))
+    server = RequestServer(Api(status_cache, registry, plugins, loop_lag).handle, host=args.host, port=args.port,
+                           ssl_context=ssl_context, max_connections=args.max_connections, backlog=args.backlog)
+    config.subscribe(lambda old, new: apply_config(new, args, status_cache, secrets))
+    service = CrossPlatformService([config, scheduler, status_cache, secrets, plugins, server],
+                                   readiness.ServiceNotifier(args.pidfile, args.state_socket))
+    if registry is not None:
+        service.add_component(loop_lag)
+        for component in (config, scheduler, secrets, plugins, server):
+            component.register_metrics(registry)
+        log_pipeline.register_metrics(registry)
+        metrics.process_metrics(registry)
+    if args.verify == "full":
+        service.add_component(FullIntegrityCheck(args, service))
+    return service
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log_pipeline.setup_logging(args.log_dir, getattr(logging, args.log_level), args.log_format,
+                               args.log_max_bytes, args.log_rotate_interval, args.log_backups)
+    if not check_integrity(args):
+        logging.critical("Refusing to start: integrity check failed")
+        sys.exit(1)
+    # Runs until SIGTERM/SIGINT
+    build_service(args).run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# metrics.py - in-process metrics, served by api.py as /metrics (Prometheus text format)
+#
+# Instrumentation is cheap enough to leave on:
+# - Counter and Histogram keep one shard per thread, so recording is a couple
+#   of list updates with no lock; shards are only summed when /metrics is scraped
+# - everything else (queue depths, per-plugin CPU and RSS, scheduler counters)
+#   is a gauge read from the owning component at scrape time, so the hot paths
+#   do not record it at all
+# - LoopLagMonitor measures how late the event loop runs a timer, which is
+#   how long some callback held the loop; it probes only while requests come in
+import asyncio
+import bisect
+import math
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# seconds; from sub-millisecond local calls up to long plugin calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_INTERVAL = 0.5  # seconds between event loop lag probes
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shards:
+    """Per-thread lists of numbers, summed on demand."""
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._all = []  # list.append is atomic; shards of finished threads keep their counts
+
+    def get(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = [0] * self.size
+            self._all.append(values)
+            return values
+
+    def total(self):
+        totals = [0] * self.size
+        for values in list(self._all):
+            for i, value in enumerate(values):
+                totals[i] += value
+        return totals
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.get()[0] += amount
+
+    @property
+    def value(self):
+        return self._shards.total()[0]
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # one count per bucket, one for +Inf, then the sum
+        self._shards = _Shards(len(self.buckets) + 2)
+
+    def observe(self, value):
+        values = self._shards.get()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self):
+        """Return (cumulative counts per bucket including +Inf, sum, count)."""
+        totals = self._shards.total()
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1], running
+
+    def time(self):
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Family:
+    """A named metric and its children, one per combination of label values."""
+
+    def __init__(self, name, help, kind, labels=(), factory=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.factory = factory
+        self.children = {}
+        if not self.label_names and factory is not None:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    def __getattr__(self, name):
+        # An unlabelled family stands for its only child: family.inc(), family.observe()
+        children = self.__dict__.get("children")
+        if children is not None and () in children:
+            attribute = getattr(children[()], name)
+            if callable(attribute):
+                setattr(self, name, attribute)  # later calls skip __getattr__
+            return attribute
+        raise AttributeError(name)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+    """Every metric of the service; render() produces the /metrics body."""
+
+    def __init__(self):
+        self.families = []
+        self.gauges = []  # (name, help, kind, label names, function returning {label values: value})
+
+    def counter(self, name, help, labels=()):
+        return self._add(Family(name, help, "counter", labels, Counter))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Family(name, help, "histogram", labels, lambda: Histogram(buckets)))
+
+    def gauge(self, name, help, function, labels=(), kind="gauge"):
+        """
+        A value read at scrape time. function() returns a number, or with labels a
+        dict mapping tuples of label values to numbers. kind="counter" for totals
+        that are kept elsewhere.
+        """
+        self.gauges.append((name, help, kind, tuple(labels), function))
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in list(family.children.items()):
+                if family.kind == "histogram":
+                    self._render_histogram(lines, family, values, child)
+                else:
+                    lines.append(f"{family.name}{_label_text(family.label_names, values)} {_number(child.value)}")
+        for name, help, kind, label_names, function in self.gauges:
+            try:
+                samples = function()
+            except Exception as e:
+                lines.append(f"# {name} unavailable: {type(e).__name__}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if not label_names:
+                samples = {(): samples}
+            for values, value in samples.items():
+                lines.append(f"{name}{_label_text(label_names, values)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(lines, family, values, histogram):
+        cumulative, total, count = histogram.snapshot()
+        for bound, running in zip(histogram.buckets + (math.inf,), cumulative):
+            le = 'le="+Inf"' if math.isinf(bound) else f'le="{bound}"'
+            lines.append(f"{family.name}_bucket{_label_text(family.label_names, values, le)} {running}")
+        labels = _label_text(family.label_names, values)
+        lines.append(f"{family.name}_sum{labels} {_number(float(total))}")
+        lines.append(f"{family.name}_count{labels} {count}")
+
+
+class LoopLagMonitor:
+    """Service component that records how late the event loop fires a timer while requests come in.
+
+    activity() arms the timer; it keeps re-arming every `interval` seconds until
+    an interval passes without a request, so an idle service has no timer at all.
+    """
+
+    def __init__(self, histogram, interval=LAG_INTERVAL):
+        self.histogram = histogram
+        self.interval = interval
+        self.last_lag = 0.0
+        self._loop = None
+        self._handle = None
+        self._expected = 0.0
+        self._busy = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self._loop = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def activity(self):
+        """Note a request; called on the event loop for every request."""
+        self._busy = True
+        if self._handle is None and self._loop is not None:
+            self._arm()
+
+    def _arm(self):
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._probe)
+
+    def _probe(self):
+        self.last_lag = max(0.0, self._loop.time() - self._expected)
+        self.histogram.observe(self.last_lag)
+        if self._busy:
+            self._busy = False
+            self._arm()
+        else:
+            self._handle = None
+
+
+def process_metrics(registry):
+    """CPU time and memory of the core service process itself (threads only, where resource is missing)."""
+    def cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def resident():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            return None
+
+    if resource is not None:
+        registry.gauge("fxetrx_process_cpu_seconds_total", "CPU time of the core service process", cpu,
+                       kind="counter")
+        registry.gauge("fxetrx_process_resident_memory_bytes", "Resident memory of the core service process",
+                       resident)
+    registry.gauge("fxetrx_process_threads", "Threads in the core service process", threading.active_count)
@@ -1 +1,436 @@
 #net.py - manage network connetions, requests, etc.
+#
+# fxetrx listens on 127.0.0.1:7777 with HTTPS. Everything runs on a single
+# asyncio event loop:
+# - TLS contexts are created once and shared so session tickets issued on one
+#   connection can be used to resume on the next one
+# - HTTP/1.1 keep-alive and pipelining, so local tools polling the daemon pay
+#   for the handshake once per connection instead of once per request
+# - a fixed number of connection slots; once they are all taken the accept loop
+#   stops accepting and further clients wait in the kernel's listen backlog
+# - a bounded queue of in-flight requests per connection; when it is full the
+#   connection stops being read, which pushes back on the client through TCP
+# - a StreamingResponse is sent with chunked transfer encoding while its body is
+#   still being produced (closing the connection to end it for HTTP/1.0 clients)
+import argparse
+import asyncio
+import logging
+import socket
+import ssl
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7777
+DEFAULT_MAX_CONNECTIONS = 1024
+DEFAULT_BACKLOG = 512
+DEFAULT_KEEPALIVE_TIMEOUT = 75  # seconds an idle keep-alive connection is held open
+DEFAULT_MAX_PIPELINE = 16  # requests in flight per connection before reading pauses
+HANDSHAKE_TIMEOUT = 10
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+WRITE_HIGH_WATER = 256 * 1024  # drain the transport once this much output is buffered
+
+_REASONS = {status.value: status.phrase for status in HTTPStatus}
+
+
+class HTTPError(Exception):
+    """Raised while parsing a request that cannot be served."""
+
+    def __init__(self, status, message=""):
+        super().__init__(message or _REASONS.get(status, ""))
+        self.status = status
+
+
+class Request:
+    """A parsed HTTP/1.1 request."""
+
+    __slots__ = ("method", "target", "path", "query_string", "version", "headers", "body", "keep_alive", "_query")
+
+    def __init__(self, method, target, version, headers, body=b""):
+        self.method = method
+        self.target = target
+        split = urlsplit(target)
+        self.path = split.path or "/"
+        self.query_string = split.query
+        self.version = version
+        self.headers = headers
+        self.body = body
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.0":
+            self.keep_alive = connection == "keep-alive"
+        else:
+            self.keep_alive = connection != "close"
+        self._query = None
+
+    @property
+    def query(self):
+        """Query string parameters, parsed on first use."""
+        if self._query is None:
+            self._query = {key: values[-1] for key, values in parse_qs(self.query_string).items()}
+        return self._query
+
+
+class Response:
+    """An HTTP response; the body is sent as-is."""
+
+    __slots__ = ("status", "body", "content_type", "headers")
+
+    def __init__(self, status=200, body=b"", content_type="application/json", headers=None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    def encode(self, keep_alive, head=False):
+        """Serialize status line, headers and body into a single buffer; a reply to HEAD has no body."""
+        lines = [
+            f"HTTP/1.1 {self.status} {_REASONS.get(self.status, '')}",
+            f"Content-Type: {self.content_type}",
+            f"Content-Length: {len(self.body)}",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in self.headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (b"" if head else self.body)
+
+
+class StreamingResponse:
+    """An HTTP response whose body is sent chunk by chunk as an async iterator produces it."""
+
+    __slots__ = ("status", "chunks", "content_type", "headers", "on_done")
+
+    def __init__(self, status, chunks, content_type="application/json", headers=None):
+        self.status = status
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.on_done = None  # called once the body is sent, or sending it failed
+
+    def encode_head(self, keep_alive, chunked):
+        """Serialize status line and headers; without chunked, closing the connection ends the body."""
+        lines = [
+            f"HTTP/1.1 {self.status} {_REASONS.get(self.status, '')}",
+            f"Content-Type: {self.content_type}",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+        ]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.extend(f"{name}: {value}" for name, value in self.headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def not_found(request):
+    """Default handler used until the API layer is attached."""
+    return Response(404, b'{"error": "not found"}')
+
+
+def create_ssl_context(certfile, keyfile):
+    """Create the server TLS context shared by every connection."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    # Session tickets let returning clients skip the full handshake. Tickets are
+    # encrypted with keys held by this context, which is why it must be reused.
+    context.options &= ~ssl.OP_NO_TICKET
+    context.options |= ssl.OP_NO_COMPRESSION
+    context.num_tickets = 2
+    return context
+
+
+def parse_request_head(head):
+    """Parse the request line and headers of a request."""
+    try:
+        text = head.decode("latin-1")
+    except UnicodeDecodeError:
+        raise HTTPError(400)
+    lines = text.split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        raise HTTPError(400, "Malformed request line")
+    method, target, version = parts
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HTTPError(400, "Malformed header line")
+        headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+class RequestServer:
+    """HTTP/1.1 server with keep-alive, pipelining and a connection limit."""
+
+    def __init__(self, handler=not_found, host=DEFAULT_HOST, port=DEFAULT_PORT, ssl_context=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, backlog=DEFAULT_BACKLOG,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT, max_pipeline=DEFAULT_MAX_PIPELINE):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.max_connections = max_connections
+        self.backlog = backlog
+        self.keepalive_timeout = keepalive_timeout
+        self.max_pipeline = max_pipeline
+        self.active_connections = 0
+        self._slots = None
+        self._sock = None
+        self._accept_task = None
+        self._connections = set()
+
+    async def start(self):
+        """Bind the listening socket and start accepting connections."""
+        self._sock = socket.create_server((self.host, self.port), backlog=self.backlog)
+        self._sock.setblocking(False)
+        self.port = self._sock.getsockname()[1]
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._accept_task = asyncio.create_task(self._accept_loop())
+        logging.info(f"Listening on {self.host}:{self.port} ({'https' if self.ssl_context else 'http'}, "
+                     f"max {self.max_connections} connections, backlog {self.backlog})")
+
+    def register_metrics(self, registry):
+        """Open connections and the connection limit, both read at scrape time."""
+        registry.gauge("fxetrx_http_connections", "Open client connections", lambda: self.active_connections)
+        registry.gauge("fxetrx_http_connection_slots", "Connection limit", lambda: self.max_connections)
+
+    async def serve_forever(self):
+        """Start the server if needed and run until stopped."""
+        if self._accept_task is None:
+            await self.start()
+        try:
+            await self._accept_task
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self):
+        """Stop accepting, then close every open connection."""
+        if self._accept_task:
+            self._accept_task.cancel()
+            try:
+                await self._accept_task
+            except asyncio.CancelledError:
+                pass
+        if self._sock:
+            self._sock.close()
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        logging.info("Network server closed")
+
+    async def _accept_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Waiting for a free slot before accepting leaves excess clients in
+            # the listen backlog instead of accepting and then rejecting them.
+            await self._slots.acquire()
+            try:
+                conn, _ = await loop.sock_accept(self._sock)
+            except (asyncio.CancelledError, Exception) as e:
+                self._slots.release()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                logging.error(f"Accept failed: {e}")
+                continue
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            task = asyncio.create_task(self._serve_socket(conn))
+            self._connections.add(task)
+            task.add_done_callback(self._connections.discard)
+
+    async def _serve_socket(self, conn):
+        loop = asyncio.get_running_loop()
+        self.active_connections += 1
+        writer = None
+        try:
+            reader = asyncio.StreamReader(limit=MAX_HEADER_BYTES, loop=loop)
+            protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+            try:
+                transport, _ = await loop.connect_accepted_socket(
+                    lambda: protocol, conn, ssl=self.ssl_context,
+                    ssl_handshake_timeout=HANDSHAKE_TIMEOUT if self.ssl_context else None)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                logging.debug(f"Connection setup failed: {e}")
+                conn.close()
+                return
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+            await self._serve_connection(reader, writer)
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, ssl.SSLError) as e:
+            logging.debug(f"Connection dropped: {e}")
+        finally:
+            if writer is not None:
+                writer.close()
+            self.active_connections -= 1
+            self._slots.release()
+
+    async def _serve_connection(self, reader, writer):
+        """Read pipelined requests and write their responses back in order."""
+        pending = asyncio.Queue(maxsize=self.max_pipeline)
+        responder = asyncio.create_task(self._write_responses(pending, writer))
+        try:
+            while not responder.done():
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except HTTPError as e:
+                    await self._enqueue(pending, (None, False, e.status, False, False), responder)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                if request is None:
+                    break
+                task = asyncio.create_task(self._dispatch(request))
+                chunked = request.version != "HTTP/1.0"
+                head = request.method == "HEAD"
+                if not await self._enqueue(pending, (task, request.keep_alive, None, chunked, head), responder):
+                    task.cancel()
+                    break
+                if not request.keep_alive:
+                    break
+        finally:
+            await self._enqueue(pending, None, responder)
+            try:
+                await responder
+            finally:
+                while not pending.empty():
+                    item = pending.get_nowait()
+                    if item and item[0]:
+                        item[0].cancel()
+
+    @staticmethod
+    async def _enqueue(pending, item, responder):
+        """Queue an item for the responder; blocks while the pipeline is full."""
+        if not pending.full():
+            pending.put_nowait(item)
+            return True
+        if responder.done():
+            return False
+        put = asyncio.ensure_future(pending.put(item))
+        await asyncio.wait((put, responder), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            return False
+        return True
+
+    async def _write_responses(self, pending, writer):
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            task, keep_alive, error_status, chunked, head = item
+            if error_status is not None:
+                body = f'{{"error": "{_REASONS.get(error_status, "")}"}}'
+                writer.write(Response(error_status, body).encode(False))
+                await writer.drain()
+                return
+            response = await task
+            if isinstance(response, StreamingResponse):
+                keep_alive = keep_alive and chunked
+                try:
+                    sent = await self._write_stream(response, writer, keep_alive, chunked, head)
+                finally:
+                    if response.on_done is not None:
+                        response.on_done()
+                if not sent:
+                    return
+                if not keep_alive:
+                    return
+                continue
+            writer.write(response.encode(keep_alive, head))
+            # Pipelined responses are coalesced into one write; drain only when
+            # nothing else is queued or the client is falling behind.
+            if pending.empty() or writer.transport.get_write_buffer_size() > WRITE_HIGH_WATER:
+                await writer.drain()
+            if not keep_alive:
+                return
+
+    @staticmethod
+    async def _write_stream(response, writer, keep_alive, chunked, head=False):
+        """Send a StreamingResponse; returns False if it failed part way and the connection must close."""
+        writer.write(response.encode_head(keep_alive, chunked))
+        if head:
+            # the client expects headers only; the body is never produced
+            aclose = getattr(response.chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            await writer.drain()
+            return True
+        try:
+            async for chunk in response.chunks:
+                if not chunk:
+                    continue
+                # transport.write() sends straight away when the socket allows, so
+                # each chunk leaves as soon as it is produced; drain only bounds memory.
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                if writer.transport.get_write_buffer_size() > WRITE_HIGH_WATER:
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            # The status line is already out; a cut-off body is the only way to signal the failure.
+            logging.error(f"Streaming response failed: {e}")
+            writer.transport.abort()
+            return False
+        finally:
+            aclose = getattr(response.chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise HTTPError(400, "Truncated request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+        method, target, version, headers = parse_request_head(head[:-4])
+        if "transfer-encoding" in headers:
+            raise HTTPError(501, "Chunked request bodies are not supported")
+        body = b""
+        length = headers.get("content-length")
+        if length:
+            if not length.isdigit():
+                raise HTTPError(400, "Invalid Content-Length")
+            if int(length) > MAX_BODY_BYTES:
+                raise HTTPError(413)
+            body = await reader.readexactly(int(length))
+        return Request(method, target, version, headers, body)
+
+    async def _dispatch(self, request):
+        try:
+            return await self.handler(request)
+        except Exception as e:
+            logging.error(f"Unhandled error serving {request.method} {request.path}: {e}")
+            return Response(500, b'{"error": "internal server error"}')
+
+
+def main():
+    """Run the network server standalone with the default handler."""
+    parser = argparse.ArgumentParser(description="fxetrx network server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    ssl_context = create_ssl_context(args.certfile, args.keyfile) if args.certfile else None
+    server = RequestServer(host=args.host, port=args.port, ssl_context=ssl_context,
+                           max_connections=args.max_connections, backlog=args.backlog)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        logging.info("Network server exiting due to keyboard interrupt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# plugin_api.py - what a plugin can ask of the core service while it runs
+#
+# Plugins run in plugin_worker.py processes; importing this module there gives
+# them calls back into the core over the worker's ipc.py channel:
+#
+#   import plugin_api
+#   token = plugin_api.get_secret("api_token")
+#
+# Secrets come from the core's SecretCache, under the keyring service
+# "fxetrx/<plugin>", so repeated lookups cost one IPC round trip rather than a
+# keyring (D-Bus) call. These calls only work while the worker is serving a
+# call from the core.
+#
+# Only the standard library and ipc.py may be imported here.
+import threading
+
+import ipc
+
+_channel = None
+_lock = threading.Lock()  # one request on the channel at a time, even from plugin threads
+_next_id = 0
+
+
+class CoreError(Exception):
+    """Raised when the core cannot answer a request."""
+
+
+def install(channel):
+    """Used by plugin_worker.py to hand over its channel."""
+    global _channel
+    _channel = channel
+
+
+def get_secret(name):
+    """The plugin's secret `name`, or None if it is not set."""
+    global _next_id
+    if _channel is None:
+        raise CoreError("Not running inside a plugin worker")
+    with _lock:
+        _next_id = (_next_id + 1) & 0xFFFFFFFF
+        _channel.send(ipc.SECRET, _next_id, {"name": name})
+        message = _channel.recv()
+    if message is None:
+        raise CoreError("Core closed the channel")
+    kind, message_id, reply = message
+    if kind != ipc.SECRET or message_id != _next_id:
+        raise CoreError(f"Unexpected reply from core: kind {kind}, message {message_id}")
+    if "error" in reply:
+        raise CoreError(reply["error"])
+    return reply["value"]
@@ -0,0 +1,29 @@
+# plugin_index.py - the plugin index written by the build and read by the service
+#
+# build.build_plugin_index() records everything the core needs to know about
+# the installed plugins (module, entry points, capabilities, venv interpreter,
+# digests of the requirements and of the source files) in one JSON file, so
+# the service does not read each plugin directory at startup.
+# PLUGIN_INDEX_VERSION changes whenever the layout does; an index of another
+# version is ignored and the plugins directory is listed instead.
+import json
+import logging
+
+PLUGIN_INDEX_FILE = "./build/plugin_index.json"
+PLUGIN_INDEX_VERSION = 1
+
+
+def load_plugin_index(index_file=PLUGIN_INDEX_FILE):
+    """The plugins recorded by the build, as {name: entry}, or None if there is no usable index."""
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable plugin index {index_file}: {e}")
+        return None
+    if index.get("version") != PLUGIN_INDEX_VERSION:
+        logging.warning(f"Ignoring plugin index {index_file} of version {index.get('version')}")
+        return None
+    return index.get("plugins", {})
@@ -0,0 +1,521 @@
+# plugin_pool.py - warm worker pools for plugin calls
+#
+# Plugin code has to run under the plugin's own venv interpreter, and starting
+# that interpreter and importing the plugin costs 100-500 ms. Instead of paying
+# that on every call, each plugin gets a WorkerPool of long-lived
+# plugin_worker.py processes that have already imported the plugin module, so a
+# call is one round trip over the worker's ipc.py channel.
+#
+# - a pool keeps at least min_workers running and grows on demand up to
+#   max_workers (one call per worker at a time, so calls to one plugin run on
+#   as many cores as it has workers)
+# - workers idle for longer than idle_timeout are reaped down to min_workers
+#   by a recurring scheduler job
+# - a worker is recycled after max_calls calls, or once its RSS passes
+#   max_rss bytes, so leaky plugins cannot grow forever
+# - which module to import comes from the plugin's manifest.json ("module"),
+#   defaulting to plugin.py
+# - plugins are known from the plugin index the build writes
+#   (build/plugin_index.json), and a plugin's pool is only started on the
+#   first call to it, so startup costs the same with 5 or 500 plugins installed
+# - while a call runs, the plugin may ask for its secrets (plugin_api.py); the
+#   worker answers those requests from the core's SecretCache
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import time
+
+from src import ipc
+from src.plugin_index import PLUGIN_INDEX_FILE, load_plugin_index
+from src.plugin_venv_setup import venv_paths
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin_worker.py")
+PLUGIN_MANIFEST = "manifest.json"
+DEFAULT_MODULE = "plugin"
+DEFAULT_MIN_WORKERS = 1
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+DEFAULT_IDLE_TIMEOUT = 300.0  # seconds
+DEFAULT_MAX_CALLS = 10000
+DEFAULT_MAX_RSS = 512 * 1024 * 1024  # bytes
+REAP_INTERVAL = 30.0  # seconds
+STARTUP_TIMEOUT = 60.0  # seconds
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class PluginError(Exception):
+    """Raised when a plugin call fails or its worker dies."""
+
+
+def plugin_module(plugin_path):
+    """The module a plugin's workers import, from its manifest.json."""
+    try:
+        with open(os.path.join(plugin_path, PLUGIN_MANIFEST)) as f:
+            return json.load(f).get("module", DEFAULT_MODULE)
+    except (OSError, ValueError):
+        return DEFAULT_MODULE
+
+
+def plugin_python(plugin_path):
+    """The plugin venv's interpreter, or the core interpreter for plugins without a venv."""
+    python = venv_paths(os.path.join(plugin_path, "venv"))[2]
+    return python if os.path.exists(python) else sys.executable
+
+
+def process_rss(pid):
+    """Private resident memory of a process in bytes (Linux /proc), or None where unavailable."""
+    # resident - shared: the IPC rings and shared libraries are not the worker's to leak
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            fields = f.read().split()
+            return (int(fields[1]) - int(fields[2])) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_cpu(pid):
+    """User + system CPU seconds used by a process (Linux /proc), or None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # the command name may contain spaces; the fixed fields start after its ")"
+            fields = f.read().rpartition(")")[2].split()
+            return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Worker:
+    """One warm worker process, reached over an ipc.py channel; serves one call at a time."""
+
+    def __init__(self, process, channel, plugin=None, secrets=None):
+        self.process = process
+        self.channel = channel
+        self.plugin = plugin
+        self.secrets = secrets
+        self.pid = process.pid
+        self.calls = 0
+        self.last_used = time.monotonic()
+        self.broken = False  # set when the channel can no longer be trusted
+        self._next_id = 0
+
+    @classmethod
+    async def spawn(cls, python, plugin_path, module, secrets=None):
+        sock, send_ring, recv_ring, child_fds = ipc.channel_pair()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                python, "-I", WORKER_SCRIPT, plugin_path, module, *(str(fd) for fd in child_fds),
+                stdin=asyncio.subprocess.DEVNULL, pass_fds=child_fds)
+        except BaseException:
+            sock.close()
+            send_ring.close()
+            recv_ring.close()
+            raise
+        finally:
+            for fd in child_fds:
+                os.close(fd)
+        channel = await ipc.AsyncChannel.connect(sock, send_ring, recv_ring)
+        worker = cls(process, channel, os.path.basename(os.path.normpath(plugin_path)), secrets)
+        try:
+            message = await asyncio.wait_for(worker.channel.recv(), STARTUP_TIMEOUT)
+            hello = message[2] if message else {"error": "exited during startup"}
+        except (asyncio.TimeoutError, ipc.ChannelError, ValueError, EOFError) as e:
+            hello = {"error": f"no ready message: {e}"}
+        if not hello.get("ready"):
+            await worker.close()
+            raise PluginError(f"Worker for {plugin_path} failed to start: {hello.get('error')}")
+        return worker
+
+    @property
+    def alive(self):
+        return self.process.returncode is None and not self.broken
+
+    def rss(self):
+        return process_rss(self.pid)
+
+    def cpu(self):
+        return process_cpu(self.pid)
+
+    async def call(self, function, args, kwargs):
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        request = {"function": function, "args": args, "kwargs": kwargs}
+        try:
+            await self.channel.send(ipc.CALL, self._next_id, request)
+        except ValueError as e:
+            # marshal refused the arguments before anything was sent
+            raise PluginError(f"Cannot send arguments to {function}: {e}")
+        except ConnectionError as e:
+            self.broken = True
+            raise PluginError(f"Worker {self.pid} I/O failed: {e}")
+        while True:
+            try:
+                message = await self.channel.recv()
+                if message is None:
+                    self.broken = True
+                    raise PluginError(f"Worker {self.pid} exited")
+                kind, message_id, reply = message
+                if kind != ipc.SECRET:
+                    break
+                await self.channel.send(ipc.SECRET, message_id, await self._secret(reply))
+            except (ConnectionError, ipc.ChannelError, EOFError, ValueError, TypeError) as e:
+                self.broken = True
+                raise PluginError(f"Worker {self.pid} I/O failed: {e}")
+        if message_id != self._next_id:
+            self.broken = True
+            raise PluginError(f"Worker {self.pid} answered message {message_id}, expected {self._next_id}")
+        self.calls += 1
+        self.last_used = time.monotonic()
+        if kind == ipc.ERROR:
+            raise PluginError(reply["error"])
+        return reply
+
+    async def _secret(self, request):
+        """Answer a plugin_api.get_secret() request from the worker."""
+        if self.secrets is None:
+            return {"error": "secrets are not available to plugins"}
+        name = request.get("name") if isinstance(request, dict) else None
+        if not isinstance(name, str):
+            return {"error": "secret name must be a string"}
+        try:
+            return {"value": await self.secrets.get_plugin_secret(self.plugin, name)}
+        except Exception as e:
+            logging.error(f"Secret lookup for plugin {self.plugin} failed: {e}")
+            return {"error": f"secret lookup failed: {type(e).__name__}"}
+
+    async def close(self):
+        """Close the channel so the worker exits on its own; kill it if it does not."""
+        await self.channel.close()
+        if self.process.returncode is None:
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+
+class WorkerPool:
+    """Warm workers for one plugin."""
+
+    def __init__(self, plugin_path, min_workers=DEFAULT_MIN_WORKERS, max_workers=DEFAULT_MAX_WORKERS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_calls=DEFAULT_MAX_CALLS, max_rss=DEFAULT_MAX_RSS,
+                 secrets=None, module=None, python=None):
+        self.plugin_path = plugin_path
+        self.name = os.path.basename(os.path.normpath(plugin_path))
+        # module and python come from the plugin index when the pool was started from it
+        self.module = module or plugin_module(plugin_path)
+        self.python = python or plugin_python(plugin_path)
+        self.min_workers = min_workers
+        self.max_workers = max(1, max_workers, min_workers)
+        self.idle_timeout = idle_timeout
+        self.max_calls = max_calls
+        self.max_rss = max_rss
+        self.secrets = secrets
+        self._idle = collections.deque()  # most recently used on the right
+        self._workers = set()  # every live worker, idle or busy
+        self._size = 0  # idle + busy + spawning
+        self._waiters = collections.deque()
+        self._tasks = set()  # retires and closes in the background; the loop only keeps weak references
+        self._closed = False
+        self.calls = 0
+        self.spawned = 0
+        self.recycled = 0
+        self.retired_cpu = 0.0  # CPU seconds of workers that are gone
+        self.call_seconds = None  # a metrics.Histogram of call latency, set by PluginPools.register_metrics
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def waiting(self):
+        """Calls queued for a free worker."""
+        return len(self._waiters)
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def cpu(self):
+        """CPU seconds used by every worker this pool has run."""
+        return self.retired_cpu + sum(worker.cpu() or 0.0 for worker in list(self._workers))
+
+    def rss(self):
+        """Private resident memory of the live workers, in bytes."""
+        return sum(worker.rss() or 0 for worker in list(self._workers))
+
+    async def start(self):
+        """Spawn min_workers workers in parallel; if any spawn fails, the others are closed again."""
+        results = await asyncio.gather(*(self._spawn() for _ in range(self.min_workers)), return_exceptions=True)
+        workers = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for worker in workers:
+                self._size -= 1
+                self._workers.discard(worker)
+            await asyncio.gather(*(worker.close() for worker in workers))
+            raise errors[0]
+        self._idle.extend(workers)
+
+    async def stop(self):
+        self._closed = True
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_exception(PluginError(f"Plugin pool {self.name} is closed"))
+        self._idle.clear()
+        for worker in self._workers:
+            self.retired_cpu += worker.cpu() or 0.0
+        await asyncio.gather(*(worker.close() for worker in list(self._workers)))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def call(self, function, *args, timeout=None, **kwargs):
+        """Run module.function(*args, **kwargs) in a warm worker and return its result."""
+        start = time.perf_counter()
+        worker = await self._acquire()
+        try:
+            result = await asyncio.wait_for(worker.call(function, args, kwargs), timeout)
+        except (PluginError, asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # A worker is only reusable after a clean reply; anything else may have left it mid-message.
+            if isinstance(e, PluginError) and worker.alive:
+                self.calls += 1
+                self._release(worker)
+            else:
+                await self._retire(worker)
+            raise
+        finally:
+            if self.call_seconds is not None:
+                self.call_seconds.observe(time.perf_counter() - start)
+        self.calls += 1
+        self._release(worker)
+        return result
+
+    async def _spawn(self):
+        self._size += 1
+        try:
+            worker = await Worker.spawn(self.python, self.plugin_path, self.module, self.secrets)
+        except BaseException:
+            self._size -= 1
+            raise
+        self.spawned += 1
+        self._workers.add(worker)
+        return worker
+
+    async def _acquire(self):
+        if self._closed:
+            raise PluginError(f"Plugin pool {self.name} is closed")
+        while self._idle:
+            worker = self._idle.pop()  # warmest first; the cold end is what reap() trims
+            if worker.alive:
+                return worker
+            self._size -= 1
+            self._workers.discard(worker)
+        if self._size < self.max_workers:
+            return await self._spawn()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # Handed a worker just as we were cancelled: give it to the next caller.
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self._release(waiter.result())
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release(self, worker):
+        if self._closed or self._should_recycle(worker):
+            self._background(self._retire(worker))
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(worker)
+                return
+        self._idle.append(worker)
+
+    def _should_recycle(self, worker):
+        if not worker.alive:
+            return True
+        if self.max_calls and worker.calls >= self.max_calls:
+            return True
+        if self.max_rss:
+            rss = worker.rss()
+            if rss is not None and rss > self.max_rss:
+                logging.info(f"Recycling {self.name} worker {worker.pid}: RSS {rss // 1048576} MiB")
+                return True
+        return False
+
+    async def _retire(self, worker):
+        """Close a worker and keep the pool at min_workers, handing a replacement to a waiter if any."""
+        self._size -= 1
+        self.recycled += 1
+        self._workers.discard(worker)
+        self.retired_cpu += worker.cpu() or 0.0
+        await worker.close()
+        if self._closed or (self._size >= self.min_workers and not self._waiters):
+            return
+        try:
+            replacement = await self._spawn()
+        except Exception as e:
+            # runs as a task nobody awaits, so every failure ends here
+            error = e if isinstance(e, PluginError) else PluginError(f"Cannot replace {self.name} worker: {e}")
+            logging.error(str(error))
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(error)
+            return
+        self._release(replacement)
+
+    def reap(self):
+        """Close workers idle for longer than idle_timeout, down to min_workers."""
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.min_workers and self._idle[0].last_used < cutoff:
+            worker = self._idle.popleft()
+            self._size -= 1
+            self._workers.discard(worker)
+            self.retired_cpu += worker.cpu() or 0.0
+            self._background(worker.close())
+            logging.debug(f"Reaped idle {self.name} worker {worker.pid}")
+
+
+class PluginPools:
+    """Service component that starts a WorkerPool for a plugin on its first call."""
+
+    def __init__(self, plugins_dir="plugins", scheduler=None, index_file=PLUGIN_INDEX_FILE, **pool_options):
+        self.plugins_dir = plugins_dir
+        self.scheduler = scheduler
+        self.index_file = index_file
+        self.pool_options = pool_options
+        self.index = {}
+        self.pools = {}  # started pools only
+        self._starting = {}  # name -> task starting that plugin's pool
+        self._reaper = None
+        self._call_seconds = None
+
+    def discover(self):
+        """Plugin directories: every non-hidden directory under plugins_dir."""
+        if not os.path.isdir(self.plugins_dir):
+            return []
+        return [os.path.join(self.plugins_dir, name) for name in sorted(os.listdir(self.plugins_dir))
+                if not name.startswith(".") and os.path.isdir(os.path.join(self.plugins_dir, name))]
+
+    @property
+    def available(self):
+        """Names of every installed plugin, started or not."""
+        return sorted(self.index)
+
+    async def start(self):
+        """Load the plugin index; no plugin is started until it is called."""
+        index = load_plugin_index(self.index_file)
+        if index is None:
+            # No build index (development tree): list directories, but still read nothing inside them.
+            logging.info(f"No plugin index at {self.index_file}; listing {self.plugins_dir}")
+            index = {os.path.basename(path): {} for path in self.discover()}
+        self.index = index
+        if self.index:
+            logging.info(f"{len(self.index)} plugins available")
+        if self.scheduler is not None:
+            self._reaper = self.scheduler.every(REAP_INTERVAL, self.reap, name="plugin-pool-reaper")
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for task in list(self._starting.values()):
+            task.cancel()
+        await asyncio.gather(*self._starting.values(), return_exceptions=True)
+        await asyncio.gather(*(pool.stop() for pool in self.pools.values()))
+
+    async def pool(self, plugin):
+        """The plugin's WorkerPool, started on first use; concurrent first calls share one start."""
+        pool = self.pools.get(plugin)
+        if pool is not None:
+            return pool
+        task = self._starting.get(plugin)
+        if task is None:
+            task = asyncio.ensure_future(self._start_pool(plugin))
+            self._starting[plugin] = task
+            task.add_done_callback(lambda _: self._starting.pop(plugin, None))
+        return await asyncio.shield(task)
+
+    async def _start_pool(self, plugin):
+        path = os.path.join(self.plugins_dir, plugin)
+        entry = self.index.get(plugin)
+        if entry is None:
+            # Installed after the index was built: accept it if it is really there.
+            if plugin.startswith(".") or os.sep in plugin or (os.altsep and os.altsep in plugin) \
+                    or not os.path.isdir(path):
+                raise PluginError(f"Unknown plugin: {plugin}")
+            entry = self.index[plugin] = {}
+        python = entry.get("venv_python")
+        pool = WorkerPool(path, module=entry.get("module"), python=os.path.join(path, python) if python else None,
+                          **self.pool_options)
+        if self._call_seconds is not None:
+            pool.call_seconds = self._call_seconds.labels(pool.name)
+        start = time.monotonic()
+        try:
+            await pool.start()
+        except Exception as e:
+            # A broken plugin must not keep the service down; the next call retries the start.
+            await pool.stop()
+            raise PluginError(f"Plugin {plugin} did not start: {e}")
+        self.pools[plugin] = pool
+        logging.info(f"Started plugin {plugin} in {time.monotonic() - start:.2f}s")
+        return pool
+
+    def register_metrics(self, registry):
+        """Per-plugin call latency, and counters and resource use read from the pools at scrape time."""
+        self._call_seconds = registry.histogram("fxetrx_plugin_call_duration_seconds",
+                                                "Plugin call latency, including waiting for a worker", ("plugin",))
+
+        def per_pool(read):
+            return lambda: {(name,): read(pool) for name, pool in list(self.pools.items())}
+
+        for name, help, read, kind in (
+                ("fxetrx_plugin_calls_total", "Plugin calls answered", lambda pool: pool.calls, "counter"),
+                ("fxetrx_plugin_cpu_seconds_total", "CPU time of the plugin's workers", WorkerPool.cpu, "counter"),
+                ("fxetrx_plugin_resident_memory_bytes", "Private resident memory of the plugin's live workers",
+                 WorkerPool.rss, "gauge"),
+                ("fxetrx_plugin_workers", "Worker processes, idle, busy or starting", lambda pool: pool.size, "gauge"),
+                ("fxetrx_plugin_idle_workers", "Idle warm workers", lambda pool: pool.idle, "gauge"),
+                ("fxetrx_plugin_waiting_calls", "Calls queued for a free worker", lambda pool: pool.waiting, "gauge"),
+                ("fxetrx_plugin_workers_spawned_total", "Workers started", lambda pool: pool.spawned, "counter"),
+                ("fxetrx_plugin_workers_recycled_total", "Workers retired after errors or limits",
+                 lambda pool: pool.recycled, "counter")):
+            registry.gauge(name, help, per_pool(read), ("plugin",), kind)
+
+    def describe(self, plugin):
+        """What the index says about an installed plugin, and its pool's state; None if unknown."""
+        entry = self.index.get(plugin)
+        if entry is None:
+            return None
+        info = {
+            "name": plugin,
+            "module": entry.get("module"),
+            "entry_points": entry.get("entry_points", []),
+            "capabilities": entry.get("capabilities", []),
+            "started": plugin in self.pools,
+        }
+        pool = self.pools.get(plugin)
+        if pool is not None:
+            info.update(workers=pool.size, idle=pool.idle, waiting=pool.waiting, calls=pool.calls,
+                        spawned=pool.spawned, recycled=pool.recycled)
+        return info
+
+    def reap(self):
+        for pool in self.pools.values():
+            pool.reap()
+
+    async def call(self, plugin, function, *args, timeout=None, **kwargs):
+        """Call function in plugin's module on one of its warm workers."""
+        pool = self.pools.get(plugin) or await self.pool(plugin)
+        return await pool.call(function, *args, timeout=timeout, **kwargs)
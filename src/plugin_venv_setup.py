@@ -1 +1,471 @@
 # plugin_venv_setup.py - manages setting up venv for fxetrx plugins
+#
+# Every plugin gets its own venv, but plugins mostly depend on the same
+# handful of packages. Instead of pip installing a private copy of each package
+# into each venv, wheels are unpacked once into a content-addressed store keyed
+# by the wheel's SHA-256:
+#
+#   plugins/.store/wheelhouse/<wheel file>     wheels as downloaded/built (pip --find-links)
+#   plugins/.store/trees/<sha256>/...          unpacked wheel contents, read-only
+#
+# A plugin venv is then assembled by hardlinking (or reflinking, or as a last
+# resort copying) the store's files into its site-packages, so identical
+# packages share disk blocks across all plugins.
+#
+# provision_plugins() sets up many plugins at once on a bounded thread pool
+# (the work is pip subprocesses and file I/O). All workers share one pip cache.
+# Two plugins only wait for each other when both need a package that is not in
+# the wheelhouse yet: the first one fetches it, the other then finds it warm.
+# Unpacking and storing a wheel is locked per digest, which also covers
+# dependencies that no requirements file names.
+#
+# Each venv records a fingerprint (requirements file hash, interpreter and the
+# resolved wheel digests) in fxetrx-fingerprint.json. Plugins whose fingerprint
+# still matches are skipped without running pip at all.
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+import venv
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+STORE_DIR = os.path.join("plugins", ".store")
+INSTALLER = "fxetrx"
+FINGERPRINT_FILE = "fxetrx-fingerprint.json"
+FICLONE = 0x40049409  # Linux ioctl: share the source file's extents with the destination
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+SCRIPT_TEMPLATE = """#!{python}
+import re
+import sys
+from {module} import {attr_head}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({attr}())
+"""
+
+
+def sha256_file(path):
+    """SHA-256 of a file, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_file(src, dst):
+    """Place src at dst sharing storage where possible; returns "hardlink", "reflink" or "copy"."""
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        _reflink(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def normalize_name(name):
+    """PEP 503 normalized project name."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def requirement_names(requirements_file):
+    """Top-level project names listed in a requirements file (options and comments skipped)."""
+    names = set()
+    with open(requirements_file) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line or line.startswith("-"):
+                continue
+            match = REQUIREMENT_NAME.match(line)
+            if match:
+                names.add(normalize_name(match.group(1)))
+    return names
+
+
+def venv_paths(venv_path):
+    """Return (site-packages, scripts dir, python executable) for a plugin venv."""
+    variables = {"base": venv_path, "platbase": venv_path, "installed_base": venv_path,
+                 "installed_platbase": venv_path}
+    scheme = "nt" if os.name == "nt" else "posix_prefix"
+    site_packages = sysconfig.get_path("purelib", scheme, variables)
+    scripts = sysconfig.get_path("scripts", scheme, variables)
+    python = os.path.join(scripts, "python.exe" if os.name == "nt" else "python")
+    return site_packages, scripts, python
+
+
+class LinkReport:
+    """What assembling one plugin venv cost and saved."""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.files = 0
+        self.bytes_shared = 0  # hardlinked or reflinked: no new data blocks
+        self.bytes_copied = 0
+        self.seconds = 0.0
+        self.wait_seconds = 0.0  # blocked on another plugin fetching the same cold package
+        self.fetch_seconds = 0.0
+        self.skipped = False  # fingerprint matched, nothing to do
+        self.removed = 0
+
+    def add(self, mode, size):
+        self.files += 1
+        if mode == "copy":
+            self.bytes_copied += size
+        else:
+            self.bytes_shared += size
+
+    def __str__(self):
+        if self.skipped:
+            return f"{self.plugin}: unchanged, skipped in {self.seconds:.3f}s"
+        return (f"{self.plugin}: {self.files} files, {self.bytes_shared / 1048576:.1f} MiB saved by linking, "
+                f"{self.bytes_copied / 1048576:.1f} MiB copied, {self.removed} removed, {self.seconds:.2f}s "
+                f"(waited {self.wait_seconds:.2f}s, fetch {self.fetch_seconds:.2f}s)")
+
+
+class WheelStore:
+    """Content-addressed store of unpacked wheels shared by all plugin venvs."""
+
+    def __init__(self, root=STORE_DIR, python=sys.executable):
+        self.root = root
+        self.python = python
+        self.wheelhouse = os.path.join(root, "wheelhouse")
+        self.trees = os.path.join(root, "trees")
+        self.cache_dir = os.path.join(root, "pip-cache")
+        os.makedirs(self.wheelhouse, exist_ok=True)
+        os.makedirs(self.trees, exist_ok=True)
+        self._locks = {}  # project name -> Lock held while fetching it cold
+        self._wheel_locks = {}  # wheel digest -> Lock held while unpacking and storing it
+        self._locks_guard = threading.Lock()
+
+    def tree(self, digest):
+        return os.path.join(self.trees, digest)
+
+    def has_wheel(self, name):
+        """Check whether the wheelhouse already holds a wheel for the (normalized) project name."""
+        for wheel in os.listdir(self.wheelhouse):
+            if wheel.endswith(".whl") and normalize_name(wheel.split("-", 1)[0]) == name:
+                return True
+        return False
+
+    def cold_locks(self, names):
+        """Locks for the names not yet in the wheelhouse, in a fixed order so they can be taken without deadlock."""
+        with self._locks_guard:
+            return [self._locks.setdefault(name, threading.Lock())
+                    for name in sorted(names) if not self.has_wheel(name)]
+
+    def fetch(self, requirements_file, dest):
+        """Download or build wheels for requirements_file (and dependencies) into dest."""
+        subprocess.run([self.python, "-m", "pip", "wheel", "--quiet", "-r", requirements_file,
+                        "--wheel-dir", dest, "--find-links", self.wheelhouse, "--cache-dir", self.cache_dir],
+                       check=True)
+        return sorted(os.path.join(dest, name) for name in os.listdir(dest) if name.endswith(".whl"))
+
+    def wheel_lock(self, digest):
+        """The lock for one wheel digest; dependencies that no requirement names are shared too."""
+        with self._locks_guard:
+            return self._wheel_locks.setdefault(digest, threading.Lock())
+
+    def add(self, wheel_path):
+        """Add a wheel to the store and return its digest; unpacks it only if the digest is new."""
+        digest = sha256_file(wheel_path)
+        with self.wheel_lock(digest):
+            self._add(wheel_path, digest)
+        return digest
+
+    def _add(self, wheel_path, digest):
+        tree = self.tree(digest)
+        if not os.path.isdir(tree):
+            staging = tempfile.mkdtemp(prefix=f".{digest[:12]}-", dir=self.trees)
+            try:
+                with zipfile.ZipFile(wheel_path) as wheel:
+                    for info in wheel.infolist():
+                        path = wheel.extract(info, staging)
+                        if (info.external_attr >> 16) & 0o111:
+                            os.chmod(path, 0o755)
+                _make_read_only(staging)
+                os.rename(staging, tree)
+            except OSError as e:
+                shutil.rmtree(staging, ignore_errors=True)
+                # Another process unpacked the same wheel first; its tree is identical.
+                if not os.path.isdir(tree):
+                    raise e
+        stored = os.path.join(self.wheelhouse, os.path.basename(wheel_path))
+        if not os.path.exists(stored):
+            os.replace(wheel_path, stored)
+
+    def _targets(self, digest, venv_path):
+        """Yield (store file, venv path, is_script) for every file of a stored wheel."""
+        site_packages, scripts, _ = venv_paths(venv_path)
+        tree = self.tree(digest)
+        for root, dirs, files in os.walk(tree):
+            rel_root = os.path.relpath(root, tree)
+            top = rel_root.split(os.sep)[0]
+            if top.endswith(".data"):
+                target_root = self._data_target(rel_root, venv_path, site_packages, scripts)
+                if target_root is None:
+                    continue
+            else:
+                target_root = os.path.normpath(os.path.join(site_packages, rel_root))
+            for name in files:
+                yield os.path.join(root, name), os.path.join(target_root, name), target_root == scripts
+
+    def _dist_infos(self, digest):
+        tree = self.tree(digest)
+        return [os.path.join(tree, name) for name in os.listdir(tree) if name.endswith(".dist-info")]
+
+    def install(self, digest, venv_path, report):
+        """Link one stored wheel into a venv."""
+        site_packages, scripts, python = venv_paths(venv_path)
+        for src, dst, is_script in self._targets(digest, venv_path):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if is_script:
+                _install_script(src, dst, python)
+                report.add("copy", os.path.getsize(dst))
+                continue
+            if os.path.lexists(dst):
+                if os.path.samefile(src, dst):
+                    continue
+                os.remove(dst)
+            report.add(link_file(src, dst), os.path.getsize(src))
+        for dist_info in self._dist_infos(digest):
+            self._finish_dist_info(dist_info, site_packages, scripts, python)
+
+    def uninstall(self, digest, venv_path):
+        """Remove the files one stored wheel put into a venv; returns how many were removed."""
+        site_packages, scripts, _ = venv_paths(venv_path)
+        removed = []
+        for _, dst, _ in self._targets(digest, venv_path):
+            removed.append(dst)
+        for dist_info in self._dist_infos(digest):
+            removed.append(os.path.join(site_packages, os.path.basename(dist_info), "INSTALLER"))
+            removed.extend(os.path.join(scripts, name) for name, _, _ in _console_scripts(dist_info))
+        count = 0
+        for path in removed:
+            if os.path.lexists(path):
+                os.remove(path)
+                count += 1
+                _prune_empty_dirs(os.path.dirname(path), site_packages)
+        return count
+
+    @staticmethod
+    def _data_target(rel_root, venv_path, site_packages, scripts):
+        """Map a <dist>.data/<scheme>/... directory to where pip would install it."""
+        parts = rel_root.split(os.sep)
+        if len(parts) < 2:
+            return None
+        scheme, rest = parts[1], parts[2:]
+        base = {"purelib": site_packages, "platlib": site_packages, "scripts": scripts,
+                "data": venv_path, "headers": os.path.join(venv_path, "include")}.get(scheme)
+        return os.path.join(base, *rest) if base else None
+
+    @staticmethod
+    def _finish_dist_info(dist_info, site_packages, scripts, python):
+        """Write the per-venv bits pip normally generates: INSTALLER and console scripts."""
+        target = os.path.join(site_packages, os.path.basename(dist_info))
+        installer = os.path.join(target, "INSTALLER")
+        if os.path.lexists(installer):
+            os.remove(installer)
+        with open(installer, "w") as f:
+            f.write(INSTALLER + "\n")
+        for name, module, attr in _console_scripts(dist_info):
+            os.makedirs(scripts, exist_ok=True)
+            path = os.path.join(scripts, name)
+            with open(path, "w") as script:
+                script.write(SCRIPT_TEMPLATE.format(python=python, module=module,
+                                                    attr_head=attr.split(".")[0], attr=attr))
+            os.chmod(path, 0o755)
+
+
+def _console_scripts(dist_info):
+    """Yield (name, module, attribute) for the console/gui scripts a distribution declares."""
+    entry_points = os.path.join(dist_info, "entry_points.txt")
+    if not os.path.exists(entry_points):
+        return
+    section = None
+    with open(entry_points) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                section = line.strip("[]")
+                continue
+            if section not in ("console_scripts", "gui_scripts") or "=" not in line:
+                continue
+            name, target_spec = (part.strip() for part in line.split("=", 1))
+            module, _, attr = target_spec.partition(":")
+            yield name, module.strip(), attr.split("[")[0].strip() or "main"
+
+
+def _prune_empty_dirs(path, stop):
+    """Remove path and its parents while they are empty, never going above stop."""
+    stop = os.path.abspath(stop)
+    path = os.path.abspath(path)
+    while path.startswith(stop + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
+
+
+def _make_read_only(tree):
+    """Store files are shared by hardlink, so nothing may modify them in place."""
+    for root, dirs, files in os.walk(tree):
+        for name in files:
+            path = os.path.join(root, name)
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            os.chmod(path, (mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)) | READ_ONLY)
+
+
+def _install_script(src, dst, python):
+    """Copy a wheel script, rewriting a generic "#!python" shebang to the venv's interpreter."""
+    with open(src, "rb") as f:
+        content = f.read()
+    if content.startswith(b"#!python"):
+        content = b"#!" + python.encode() + content[len(b"#!python"):]
+    if os.path.lexists(dst):
+        os.remove(dst)
+    with open(dst, "wb") as f:
+        f.write(content)
+    os.chmod(dst, 0o755)
+
+
+def create_plugin_venv(venv_path):
+    """Create an empty plugin venv; packages come from the store, so it does not need pip."""
+    if not os.path.exists(venv_path):
+        venv.create(venv_path, with_pip=False)
+
+
+def interpreter_fingerprint():
+    """Identify the interpreter plugin venvs are created from."""
+    return f"{sys.implementation.name} {sys.version} {sys.base_prefix}"
+
+
+def requirements_fingerprint(requirements_file):
+    """SHA-256 of a requirements file, or None if the plugin has none."""
+    if not os.path.exists(requirements_file):
+        return None
+    with open(requirements_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_fingerprint(venv_path):
+    """Return the fingerprint recorded in a venv, or None."""
+    try:
+        with open(os.path.join(venv_path, FINGERPRINT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_fingerprint(venv_path, fingerprint):
+    """Record a venv's fingerprint; written last, and atomically, so it only exists for a complete venv."""
+    path = os.path.join(venv_path, FINGERPRINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(fingerprint, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def setup_plugin_venv(plugin_path, store):
+    """Create or update a plugin's venv from the shared store; returns a LinkReport.
+
+    Nothing is done when the venv's fingerprint (requirements file and
+    interpreter) is unchanged. When only the requirements drifted, the new set
+    is resolved and just the added and removed wheels are linked or unlinked.
+    """
+    plugin = os.path.basename(os.path.normpath(plugin_path))
+    report = LinkReport(plugin)
+    start = time.monotonic()
+    venv_path = os.path.join(plugin_path, "venv")
+    requirements = os.path.join(plugin_path, "requirements.txt")
+    fingerprint = {
+        "interpreter": interpreter_fingerprint(),
+        "requirements": requirements_fingerprint(requirements),
+    }
+    previous = read_fingerprint(venv_path)
+    if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+        report.skipped = True
+        report.seconds = time.monotonic() - start
+        logging.info(f"Plugin venv unchanged: {plugin}")
+        return report
+    if previous and previous.get("interpreter") != fingerprint["interpreter"]:
+        logging.info(f"Interpreter changed, rebuilding venv for {plugin}")
+        shutil.rmtree(venv_path)
+        previous = None
+    create_plugin_venv(venv_path)
+
+    wheels = {}
+    if fingerprint["requirements"]:
+        locks = store.cold_locks(requirement_names(requirements))
+        waited = time.monotonic()
+        for lock in locks:
+            lock.acquire()
+        report.wait_seconds = time.monotonic() - waited
+        try:
+            fetched = time.monotonic()
+            with tempfile.TemporaryDirectory(dir=store.root) as download_dir:
+                for wheel in store.fetch(requirements, download_dir):
+                    name = normalize_name(os.path.basename(wheel).split("-", 1)[0])
+                    wheels[name] = store.add(wheel)
+            report.fetch_seconds = time.monotonic() - fetched
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    installed = set(previous.get("wheels", {}).values()) if previous else set()
+    for digest in installed - set(wheels.values()):
+        if os.path.isdir(store.tree(digest)):
+            report.removed += store.uninstall(digest, venv_path)
+    for digest in set(wheels.values()) - installed:
+        store.install(digest, venv_path, report)
+    fingerprint["wheels"] = wheels
+    write_fingerprint(venv_path, fingerprint)
+    report.seconds = time.monotonic() - start
+    logging.info(f"Plugin venv ready: {report}")
+    return report
+
+
+def provision_plugins(plugin_paths, store, jobs=None):
+    """Set up several plugin venvs concurrently on at most `jobs` workers; returns their LinkReports."""
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="provision") as pool:
+        futures = {pool.submit(setup_plugin_venv, path, store): path for path in plugin_paths}
+        reports, failures = [], []
+        for future, path in futures.items():
+            try:
+                reports.append(future.result())
+            except Exception as e:
+                logging.error(f"Failed to set up plugin venv for {path}: {e}")
+                failures.append(path)
+    logging.info(f"Provisioned {len(reports)} plugin venvs with {jobs} jobs in {time.monotonic() - start:.2f}s")
+    if failures:
+        raise RuntimeError(f"Plugin venv setup failed for: {', '.join(failures)}")
+    return reports
@@ -0,0 +1,89 @@
+# plugin_worker.py - long-lived worker process running one plugin's code
+#
+# Started by plugin_pool.py with the plugin venv's own interpreter:
+#
+#   <plugin>/venv/bin/python -I src/plugin_worker.py <plugin dir> <module> <socket fd> <send ring fd> <recv ring fd>
+#
+# The fds are this worker's end of an ipc.py channel, inherited from the core
+# service. The worker imports the plugin module once, sends READY, and then
+# serves CALL messages ({"function", "args", "kwargs"}) with a RESULT or ERROR
+# reply for as long as the pool keeps it, exiting when the core closes the
+# channel. stdout is redirected to stderr so plugin output cannot end up
+# anywhere it is not expected.
+#
+# While serving a call, the plugin can ask the core for things through
+# plugin_api.py, which shares the channel.
+#
+# Only the standard library, ipc.py and plugin_api.py may be imported here:
+# the plugin venv does not contain fxetrx's own dependencies. -I keeps src/ (the
+# script's directory) off sys.path, so the service's own modules (config,
+# crypto, metrics, ...) cannot shadow same-named packages in the plugin venv;
+# ipc.py and plugin_api.py are loaded from next to this script by file instead.
+import importlib
+import importlib.util
+import os
+import sys
+import traceback
+
+
+def _load_sibling(name):
+    """Import name.py from this script's directory without putting the directory on sys.path."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                     f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module  # plugins import plugin_api by name; it imports ipc
+    spec.loader.exec_module(module)
+    return module
+
+
+ipc = _load_sibling("ipc")
+plugin_api = _load_sibling("plugin_api")
+
+
+def serve(module, channel):
+    """Answer calls until the core closes the channel."""
+    while True:
+        message = channel.recv()
+        if message is None:
+            return
+        kind, message_id, request = message
+        if kind != ipc.CALL:
+            channel.send(ipc.ERROR, message_id, {"error": f"unexpected message kind {kind}"})
+            continue
+        try:
+            function = getattr(module, request["function"])
+            result = function(*request.get("args", ()), **request.get("kwargs", {}))
+        except Exception as e:
+            channel.send(ipc.ERROR, message_id, {"error": f"{type(e).__name__}: {e}",
+                                                 "traceback": traceback.format_exc()})
+            continue
+        try:
+            channel.send(ipc.RESULT, message_id, result)
+        except ValueError as e:
+            # marshal only carries plain data
+            channel.send(ipc.ERROR, message_id, {"error": f"unserializable result: {e}"})
+
+
+def main():
+    plugin_path, module_name = sys.argv[1], sys.argv[2]
+    channel = ipc.child_channel(*(int(fd) for fd in sys.argv[3:6]))
+    plugin_api.install(channel)
+    sys.stdout = sys.stderr
+    sys.path.insert(0, plugin_path)
+    try:
+        module = importlib.import_module(module_name)
+        warm = getattr(module, "warm", None)
+        if callable(warm):
+            warm()
+    except Exception as e:
+        channel.send(ipc.READY, 0, {"ready": False, "error": f"{type(e).__name__}: {e}"})
+        sys.exit(1)
+    channel.send(ipc.READY, 0, {"ready": True, "pid": os.getpid()})
+    try:
+        serve(module, channel)
+    finally:
+        channel.close()
+
+
+if __name__ == "__main__":
+    main()
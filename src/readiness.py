@@ -0,0 +1,258 @@
+# readiness.py - tell systemd and local clients when the service is ready or stopping
+#
+# The service reports its lifecycle explicitly instead of being polled:
+# - under systemd (Type=notify) READY=1 and STOPPING=1 go to $NOTIFY_SOCKET,
+#   so `systemctl start` returns once the service really serves requests and
+#   `systemctl stop` while it shuts down
+# - everywhere, the PID goes to a pidfile and the state to a unix socket:
+#   a client that connects gets "<state> <pid>" and one more line on every
+#   change (starting, ready, stopping); the connection closes once every
+#   component has stopped
+#
+# wait_for_state() is the client side: it blocks on those lines, and on the
+# process exiting (pidfd) for "stopped", with a timeout, so callers never
+# sleep for a guessed startup time.
+import asyncio
+import errno
+import logging
+import os
+import select
+import socket
+import time
+
+from service.procfs import PIDFILE, is_service_process, read_pidfile
+
+STATE_SOCKET = "/run/fxetrx/state.sock"
+STATES = ("starting", "ready", "stopping", "stopped")
+DEFAULT_WAIT_TIMEOUT = 30.0  # seconds
+# Connecting before the service has created its socket cannot block on
+# anything, so those attempts back off between these bounds.
+RETRY_MIN = 0.005
+RETRY_MAX = 0.1
+
+
+def sd_notify(message, path=None, sock=None):
+    """Send a notification to systemd; returns False when not running under a notify unit."""
+    path = path or os.environ.get("NOTIFY_SOCKET")
+    if not path:
+        return False
+    if path.startswith("@"):
+        path = "\0" + path[1:]  # abstract namespace
+    try:
+        if sock is not None:
+            sock.sendto(message.encode(), path)
+        else:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as s:
+                s.sendto(message.encode(), path)
+        return True
+    except OSError as e:
+        logging.warning(f"sd_notify failed: {e}")
+        return False
+
+
+class ServiceNotifier:
+    """Publishes the service lifecycle; CrossPlatformService calls it around starting and stopping components."""
+
+    def __init__(self, pidfile=PIDFILE, state_socket=STATE_SOCKET):
+        self.pidfile = pidfile
+        self.state_socket = state_socket
+        self.state = "stopped"
+        self.pid = os.getpid()
+        self._server = None
+        self._clients = set()
+        self._notify_socket = None
+        self._notify_path = os.environ.pop("NOTIFY_SOCKET", None)  # plugin workers must not inherit it
+
+    async def starting(self):
+        if self._notify_path:
+            self._notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        self._write_pidfile()
+        try:
+            os.makedirs(os.path.dirname(self.state_socket), exist_ok=True)
+            if os.path.exists(self.state_socket):
+                os.unlink(self.state_socket)  # left behind by a crashed run
+            self._server = await asyncio.start_unix_server(self._on_client, self.state_socket)
+        except OSError as e:
+            logging.warning(f"Cannot serve service state on {self.state_socket}: {e}")
+        self._publish("starting")
+
+    async def ready(self):
+        self._publish("ready", f"READY=1\nSTATUS=Serving\nMAINPID={self.pid}")
+
+    async def stopping(self):
+        self._publish("stopping", "STOPPING=1\nSTATUS=Stopping")
+        if self._server is not None:
+            self._server.close()  # no new clients; connected ones wait for "stopped"
+
+    async def stopped(self):
+        self.state = "stopped"
+        for writer in self._clients:
+            writer.close()
+        for writer in self._clients:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        self._clients.clear()
+        for path in (self.state_socket, self.pidfile):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        if self._notify_socket is not None:
+            self._notify_socket.close()
+            self._notify_socket = None
+
+    def _publish(self, state, notification=None):
+        self.state = state
+        if notification and self._notify_path:
+            sd_notify(notification, self._notify_path, self._notify_socket)
+        line = f"{state} {self.pid}\n".encode()
+        for writer in list(self._clients):
+            if writer.is_closing():
+                self._clients.discard(writer)
+            else:
+                writer.write(line)
+
+    def _write_pidfile(self):
+        try:
+            os.makedirs(os.path.dirname(self.pidfile), exist_ok=True)
+            temp_file = f"{self.pidfile}.{self.pid}.tmp"
+            with open(temp_file, "w") as f:
+                f.write(f"{self.pid}\n")
+            os.replace(temp_file, self.pidfile)
+        except OSError as e:
+            logging.warning(f"Cannot write pidfile {self.pidfile}: {e}")
+
+    async def _on_client(self, reader, writer):
+        # Clients only listen, so nothing is read; the writer is kept until the next state change.
+        writer.write(f"{self.state} {self.pid}\n".encode())
+        self._clients.add(writer)
+
+
+def _connect(state_socket):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+    try:
+        sock.connect(state_socket)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _wait_exit(pid, timeout):
+    """Block until pid exits, up to timeout seconds; returns whether it did."""
+    pidfd_open = getattr(os, "pidfd_open", None)
+    if pidfd_open is not None:
+        try:
+            fd = pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            fd = None
+        if fd is not None:
+            try:
+                return bool(select.select([fd], [], [], max(0.0, timeout))[0])
+            finally:
+                os.close(fd)
+    deadline = time.monotonic() + timeout
+    delay = RETRY_MIN
+    while _process_alive(pid):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, RETRY_MAX)
+    return True
+
+
+def query_state(state_socket=STATE_SOCKET, pidfile=PIDFILE):
+    """Return the service's current state: starting, ready, stopping or stopped."""
+    try:
+        sock = _connect(state_socket)
+    except OSError:
+        pid = read_pidfile(pidfile)
+        return "starting" if pid is not None and is_service_process(pid) else "stopped"
+    with sock, sock.makefile("r") as lines:
+        line = lines.readline().split()
+    return line[0] if line else "stopped"
+
+
+def wait_for_state(target, timeout=DEFAULT_WAIT_TIMEOUT, state_socket=STATE_SOCKET, pidfile=PIDFILE):
+    """
+    Block until the service reaches target ("ready" or "stopped") or timeout
+    seconds pass; returns the state it was last seen in, so the caller can tell
+    a timeout (or a service that stopped while starting) from success.
+    """
+    if target not in ("ready", "stopped"):
+        raise ValueError(f"cannot wait for state {target!r}")
+    deadline = time.monotonic() + timeout
+    delay = RETRY_MIN
+    seen = "stopped"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return seen
+        try:
+            sock = _connect(state_socket)
+        except OSError as e:
+            pid = read_pidfile(pidfile)
+            if target == "stopped":
+                if pid is None or not _process_alive(pid):
+                    return "stopped"
+                seen = "stopping"
+                if _wait_exit(pid, remaining):
+                    return "stopped"
+                continue
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                logging.warning(f"Cannot connect to {state_socket}: {e}")
+            # not started far enough to have its socket yet
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, RETRY_MAX)
+            continue
+        with sock:
+            seen, pid = _follow(sock, target, deadline, seen)
+        if seen == target:
+            return seen
+        if target == "stopped" and seen == "gone":
+            # every component has stopped; the process exits next
+            return "stopped" if pid is None or _wait_exit(pid, deadline - time.monotonic()) else "stopping"
+        if target == "ready" and seen in ("stopping", "gone"):
+            return "stopped" if seen == "gone" else seen  # it went down instead of coming up
+
+
+def _follow(sock, target, deadline, seen):
+    """Read state lines until target, a hang-up ("gone") or the deadline; returns (state, pid)."""
+    pid = None
+    buffer = b""
+    while True:
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            fields = line.decode().split()
+            if fields:
+                seen = fields[0]
+                pid = int(fields[1]) if len(fields) > 1 else pid
+                if seen == target or (target == "ready" and seen == "stopping"):
+                    return seen, pid
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return seen, pid
+        sock.settimeout(remaining)
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            return seen, pid
+        except OSError:
+            data = b""
+        if not data:
+            return "gone", pid
+        buffer += data
@@ -1 +1,323 @@
 #scheduler.py - fxetrx scheduler
+#
+# Drives thousands of recurring plugin jobs (health probes every few seconds,
+# sweeps every few minutes) from the service event loop, with no thread or
+# sleep per job.
+#
+# Jobs live in a hierarchical timing wheel: LEVELS wheels of WHEEL_SIZE slots,
+# level 0 slots are one tick wide, each higher level's slots span a whole
+# revolution of the level below. Inserting or cancelling a job is O(1): pick
+# the level from the distance to its deadline and add it to (or discard it
+# from) that slot's set. As time passes, slots of higher levels are cascaded
+# down into finer ones.
+#
+# - everything due in the same tick fires in one batch from one timer callback,
+#   and the loop timer is armed only for the next non-empty slot, so an idle
+#   scheduler causes no wakeups
+# - recurring jobs are rescheduled from their nominal time, not from when they
+#   ran, so they do not drift; jitter is added per run on top of that
+# - time comes from CLOCK_BOOTTIME where available (it keeps counting during
+#   suspend) and time.monotonic otherwise; wall clock jumps never matter. A job
+#   that wakes up late by several intervals (suspend, a stalled loop) runs once
+#   and then continues on its schedule instead of firing every missed run; jobs
+#   with misfire_grace set skip runs that are later than that instead
+import asyncio
+import logging
+import math
+import random
+import time
+
+DEFAULT_TICK = 0.01  # seconds
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+LEVELS = 4  # 64**4 ticks: about 46 hours at the default tick; later deadlines cascade again
+
+
+def default_clock():
+    """A monotonic clock that, unlike time.monotonic on Linux, also counts time spent suspended."""
+    if hasattr(time, "CLOCK_BOOTTIME"):
+        try:
+            time.clock_gettime(time.CLOCK_BOOTTIME)
+            return lambda: time.clock_gettime(time.CLOCK_BOOTTIME)
+        except OSError:
+            pass
+    return time.monotonic
+
+
+class Job:
+    """A scheduled callback; returned by Scheduler.schedule()."""
+
+    __slots__ = ("scheduler", "callback", "args", "interval", "jitter", "misfire_grace", "name",
+                 "nominal", "deadline", "slot", "level", "runs", "misfires", "cancelled")
+
+    def __init__(self, scheduler, callback, args, interval, jitter, misfire_grace, name):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.name = name or getattr(callback, "__name__", "job")
+        self.nominal = 0.0  # when the job is due before jitter
+        self.deadline = 0.0
+        self.slot = None  # the wheel slot (a set) holding the job, None once it is no longer scheduled
+        self.level = 0
+        self.runs = 0
+        self.misfires = 0
+        self.cancelled = False
+
+    @property
+    def scheduled(self):
+        return self.slot is not None
+
+    def cancel(self):
+        """Remove the job from the scheduler; O(1)."""
+        self.scheduler.cancel(self)
+
+    def __repr__(self):
+        return f"<Job {self.name} deadline={self.deadline:.3f} interval={self.interval}>"
+
+
+class Scheduler:
+    """Hierarchical timing wheel scheduler that runs as a service component."""
+
+    def __init__(self, tick=DEFAULT_TICK, clock=None):
+        self.tick = tick
+        self.clock = clock or default_clock()
+        self._wheels = [[set() for _ in range(WHEEL_SIZE)] for _ in range(LEVELS)]
+        self._counts = [0] * LEVELS
+        self._current = self._tick_of(self.clock(), floor=True)  # next tick to be processed
+        self._loop = None
+        self._timer = None
+        self._armed_tick = None
+        self.jobs = 0
+        self.fired = 0
+        self.misfired = 0
+        self.max_lateness = 0.0
+        self.lateness_observers = []  # called with the lateness in seconds of every run
+
+    # Service component interface
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._current = min(self._current, self._tick_of(self.clock(), floor=True))
+        self._arm()
+
+    async def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self._armed_tick = None
+        self._loop = None
+
+    def register_metrics(self, registry):
+        lateness = registry.histogram("fxetrx_scheduler_lateness_seconds", "How late scheduled jobs ran")
+        self.lateness_observers.append(lateness.observe)
+        registry.gauge("fxetrx_scheduler_jobs", "Jobs currently scheduled", lambda: self.jobs)
+        registry.gauge("fxetrx_scheduler_runs_total", "Job runs", lambda: self.fired, kind="counter")
+        registry.gauge("fxetrx_scheduler_misfires_total", "Job runs skipped past their misfire grace",
+                       lambda: self.misfired, kind="counter")
+
+    # Public API
+
+    def schedule(self, callback, delay, *args, interval=None, jitter=0.0, misfire_grace=None, name=None):
+        """
+        Run callback(*args) after delay seconds, then every interval seconds if given.
+        Coroutine functions are run as tasks. jitter adds a random 0..jitter seconds
+        to every run. A run later than misfire_grace seconds is skipped.
+        """
+        if interval is not None and interval <= 0:
+            raise ValueError("interval must be positive")
+        job = Job(self, callback, args, interval, jitter, misfire_grace, name)
+        job.nominal = self.clock() + max(0.0, delay)
+        self._set_deadline(job)
+        self._insert(job)
+        self.jobs += 1
+        self._arm(job)
+        return job
+
+    def every(self, interval, callback, *args, **kwargs):
+        """Run callback every interval seconds, first after one interval."""
+        return self.schedule(callback, interval, *args, interval=interval, **kwargs)
+
+    def cancel(self, job):
+        """Unschedule a job; O(1), and safe to call more than once or from its own callback."""
+        if job.slot is not None:
+            job.slot.discard(job)
+            self._counts[job.level] -= 1
+            job.slot = None
+            self.jobs -= 1
+        # a job already taken off its slot by advance() may still be waiting to run in this batch
+        job.cancelled = True
+        job.interval = None
+
+    def advance(self, now=None):
+        """Fire everything due up to now; returns the number of jobs run."""
+        now = self.clock() if now is None else now
+        target = self._tick_of(now, floor=True)
+        due = []
+        while self._current <= target:
+            tick = self._current
+            if tick & WHEEL_MASK == 0:
+                self._cascade(tick)
+            slot = self._wheels[0][tick & WHEEL_MASK]
+            if slot:
+                self._counts[0] -= len(slot)
+                due.extend(slot)
+                slot.clear()
+            self._current += 1
+            if self._counts[0] == 0 and self._current & WHEEL_MASK:
+                # Nothing left at level 0: skip straight to the next cascade point.
+                self._current = min(target + 1, (self._current | WHEEL_MASK) + 1)
+        for job in due:
+            job.slot = None
+            self.jobs -= 1
+        due.sort(key=lambda job: job.deadline)
+        for job in due:
+            self._run(job, now)
+        return len(due)
+
+    def next_deadline(self):
+        """Clock time at which the scheduler next needs to run, or None if no job is scheduled."""
+        tick = self._next_tick()
+        return None if tick is None else tick * self.tick
+
+    # Wheel internals
+
+    def _tick_of(self, t, floor=False):
+        # Deadlines round up and "now" rounds down, so nothing ever fires early.
+        return int(math.floor(t / self.tick) if floor else math.ceil(t / self.tick))
+
+    def _set_deadline(self, job):
+        job.deadline = job.nominal + (random.uniform(0, job.jitter) if job.jitter else 0.0)
+
+    def _due_tick(self, job):
+        return max(self._tick_of(job.deadline), self._current)
+
+    def _place(self, job):
+        """Return (level, slot index) for a job relative to the current tick."""
+        due = self._due_tick(job)
+        delta = due - self._current
+        for level in range(LEVELS):
+            if delta < WHEEL_SIZE << (WHEEL_BITS * level):
+                return level, (due >> (WHEEL_BITS * level)) & WHEEL_MASK
+        # Beyond the top wheel: park in the top level's furthest slot and re-place on cascade.
+        level = LEVELS - 1
+        horizon = self._current + (WHEEL_SIZE << (WHEEL_BITS * level)) - 1
+        return level, (horizon >> (WHEEL_BITS * level)) & WHEEL_MASK
+
+    def _insert(self, job):
+        level, index = self._place(job)
+        slot = self._wheels[level][index]
+        slot.add(job)
+        job.slot = slot
+        job.level = level
+        self._counts[level] += 1
+
+    def _cascade(self, tick):
+        """At a level boundary, re-place the jobs of the higher-level slots that now come into range."""
+        for level in range(LEVELS - 1, 0, -1):
+            if tick & ((1 << (WHEEL_BITS * level)) - 1):
+                continue
+            slot = self._wheels[level][(tick >> (WHEEL_BITS * level)) & WHEEL_MASK]
+            if not slot:
+                continue
+            jobs = list(slot)
+            slot.clear()
+            self._counts[level] -= len(jobs)
+            for job in jobs:
+                self._insert(job)
+
+    def _next_tick(self):
+        """The first tick at which a non-empty slot needs processing."""
+        if self.jobs == 0:
+            return None
+        best = None
+        current = self._current
+        if self._counts[0]:
+            wheel = self._wheels[0]
+            start = current & WHEEL_MASK
+            for offset in range(WHEEL_SIZE):
+                if wheel[(start + offset) & WHEEL_MASK]:
+                    best = current + offset
+                    break
+        for level in range(1, LEVELS):
+            if not self._counts[level]:
+                continue
+            shift = WHEEL_BITS * level
+            block = current >> shift
+            for index, slot in enumerate(self._wheels[level]):
+                if not slot:
+                    continue
+                # Cascaded when the level-`level` block with this index next begins.
+                ahead = (index - block) & WHEEL_MASK
+                cascade_block = block + (ahead or WHEEL_SIZE)
+                if (block << shift) == current and ahead == 0:
+                    cascade_block = block
+                candidate = cascade_block << shift
+                if best is None or candidate < best:
+                    best = candidate
+        return best
+
+    # Firing
+
+    def _run(self, job, now):
+        if job.cancelled:
+            return  # cancelled by a job that ran before it in the same batch
+        lateness = max(0.0, now - job.deadline)
+        self.max_lateness = max(self.max_lateness, lateness)
+        skip = job.misfire_grace is not None and lateness > job.misfire_grace
+        if job.interval is not None:
+            # Coalesce missed runs: the next run is the first nominal time after now.
+            job.nominal += job.interval
+            if job.nominal <= now:
+                job.nominal += math.ceil((now - job.nominal) / job.interval) * job.interval
+                if job.nominal <= now:
+                    job.nominal += job.interval
+            self._set_deadline(job)
+            self._insert(job)
+            self.jobs += 1
+        if skip:
+            job.misfires += 1
+            self.misfired += 1
+            logging.debug(f"Skipping {job.name}: {lateness:.3f}s late")
+            return
+        job.runs += 1
+        self.fired += 1
+        for observer in self.lateness_observers:
+            observer(lateness)
+        try:
+            result = job.callback(*job.args)
+            if asyncio.iscoroutine(result):
+                task = asyncio.ensure_future(result)
+                task.add_done_callback(lambda t, name=job.name: _log_task_error(t, name))
+        except Exception as e:
+            logging.error(f"Scheduled job {job.name} failed: {e}")
+
+    def _arm(self, job=None):
+        """(Re)arm the loop timer for the next deadline, only if it moved earlier or nothing is armed."""
+        if self._loop is None:
+            return
+        if job is not None and self._armed_tick is not None and self._due_tick(job) >= self._armed_tick:
+            return
+        tick = self._next_tick()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._armed_tick = tick
+        if tick is None:
+            return
+        delay = max(0.0, tick * self.tick - self.clock())
+        self._timer = self._loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._armed_tick = None
+        self.advance()
+        self._arm()
+
+
+def _log_task_error(task, name):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Scheduled job {name} failed: {task.exception()}")
@@ -0,0 +1,192 @@
+# secret_cache.py - in-process cache in front of keyring lookups
+#
+# On Linux every keyring lookup is a D-Bus round trip to the Secret Service
+# that can take tens of milliseconds, or block on the session bus. Plugins
+# fetch secrets through the core (plugin_api.get_secret() in the worker, an
+# ipc.py SECRET message to the core) and the core answers from a SecretCache:
+# - entries live for at most `ttl` seconds, and at most `max_entries` are kept
+#   (least recently used evicted first)
+# - concurrent lookups of the same secret share one keyring call
+# - each cached value sits in its own page of locked (mlock), non-dumpable
+#   memory and is zeroed when it expires, is evicted or is invalidated; with a
+#   scheduler, a job at each entry's expiry zeroes it even if it is never
+#   looked up again (without one, an expired entry is zeroed at its next lookup)
+# - rotate() writes a new value to the keyring and drops the cached one;
+#   invalidate() drops it when the secret was rotated elsewhere
+# Missing secrets are not cached, so a secret created later is found at once.
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import time
+
+DEFAULT_TTL = 300.0  # seconds
+DEFAULT_MAX_ENTRIES = 256
+PLUGIN_SERVICE_PREFIX = "fxetrx/"  # plugin secrets live under service "fxetrx/<plugin>"
+
+_libc = None
+_mlock_warned = False
+
+
+def _mlock(buffer, size):
+    """Lock buffer's pages in RAM; best effort, since RLIMIT_MEMLOCK may be small."""
+    global _libc, _mlock_warned
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    pointer = ctypes.c_char.from_buffer(buffer)
+    try:
+        if _libc.mlock(ctypes.c_void_p(ctypes.addressof(pointer)), ctypes.c_size_t(size)) == 0:
+            return True
+    finally:
+        del pointer  # release the buffer export so the mapping can be closed later
+    if not _mlock_warned:
+        _mlock_warned = True
+        logging.warning(f"Cannot lock secret cache memory: {ctypes.get_errno()}; check RLIMIT_MEMLOCK")
+    return False
+
+
+class LockedSecret:
+    """One secret value in a locked, non-dumpable anonymous mapping."""
+
+    __slots__ = ("_map", "_length", "expires", "job")
+
+    def __init__(self, value, expires):
+        data = value.encode("utf-8")
+        size = -(-max(len(data), 1) // mmap.PAGESIZE) * mmap.PAGESIZE
+        self._map = mmap.mmap(-1, size)
+        if hasattr(mmap, "MADV_DONTDUMP"):
+            self._map.madvise(mmap.MADV_DONTDUMP)
+        try:
+            _mlock(self._map, size)
+        except (OSError, AttributeError):
+            pass  # no libc mlock on this platform
+        self._map[:len(data)] = data
+        self._length = len(data)
+        self.expires = expires
+        self.job = None  # the scheduler.Job that wipes it at expiry
+
+    def value(self):
+        return self._map[:self._length].decode("utf-8")
+
+    def wipe(self):
+        """Zero and unmap the value; unmapping also unlocks it."""
+        if not self._map.closed:
+            self._map[:] = bytes(len(self._map))
+            self._map.close()
+
+
+def keyring_lookup(service, username):
+    """Blocking keyring lookup; returns None when there is no such secret."""
+    import keyring
+    return keyring.get_password(service, username)
+
+
+def keyring_store(service, username, value):
+    import keyring
+    keyring.set_password(service, username, value)
+
+
+class SecretCache:
+    """TTL- and size-bounded cache of keyring secrets; a service component."""
+
+    def __init__(self, lookup=keyring_lookup, store=keyring_store, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 scheduler=None):
+        self.lookup = lookup
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.scheduler = scheduler  # scheduler.Scheduler that expires entries; None wipes them lazily
+        self._entries = collections.OrderedDict()  # (service, username) -> LockedSecret, LRU first
+        self._pending = {}  # (service, username) -> Future of the keyring call in flight
+        self._generation = collections.Counter()  # bumped by invalidate() to discard in-flight results
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.clear()
+
+    def register_metrics(self, registry):
+        registry.gauge("fxetrx_secret_cache_entries", "Secrets held in the cache", lambda: len(self._entries))
+        registry.gauge("fxetrx_secret_cache_pending", "Keyring lookups in flight", lambda: len(self._pending))
+        registry.gauge("fxetrx_secret_cache_hits_total", "Lookups answered from the cache", lambda: self.hits,
+                       kind="counter")
+        registry.gauge("fxetrx_secret_cache_misses_total", "Lookups that went to the keyring", lambda: self.misses,
+                       kind="counter")
+
+    async def get(self, service, username):
+        """The secret for (service, username), or None if the keyring has none."""
+        key = (service, username)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value()
+            self._drop(key)
+        pending = self._pending.get(key)
+        if pending is None:
+            self.misses += 1
+            pending = asyncio.ensure_future(self._fetch(key))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda done: self._pending.get(key) is done and self._pending.pop(key))
+        # shield: one caller giving up must not cancel the lookup for the others
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, key):
+        generation = self._generation[key]
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(None, self.lookup, *key)
+        if value is not None and self.ttl > 0 and self._generation[key] == generation:
+            self._put(key, value)
+        return value
+
+    def _put(self, key, value):
+        self._drop(key)
+        entry = self._entries[key] = LockedSecret(value, time.monotonic() + self.ttl)
+        if self.scheduler is not None:
+            entry.job = self.scheduler.schedule(self._expire, self.ttl, key, entry, name="secret-expiry")
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _expire(self, key, entry):
+        if self._entries.get(key) is entry:
+            self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            if entry.job is not None:
+                entry.job.cancel()
+            entry.wipe()
+
+    def invalidate(self, service, username=None):
+        """Forget a cached secret, or every secret of service when username is None."""
+        keys = [key for key in list(self._entries) + list(self._pending)
+                if key[0] == service and (username is None or key[1] == username)]
+        for key in keys:
+            # a lookup already in flight may return the old value: let it finish, but neither
+            # cache its result nor hand it to callers arriving from now on
+            self._generation[key] += 1
+            self._pending.pop(key, None)
+            self._drop(key)
+
+    async def rotate(self, service, username, value):
+        """Store a new value for a secret in the keyring and stop serving the old one."""
+        self.invalidate(service, username)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.store, service, username, value)
+        self.invalidate(service, username)
+
+    def clear(self):
+        """Wipe every cached secret."""
+        for key in list(self._entries):
+            self._drop(key)
+
+    async def get_plugin_secret(self, plugin, name):
+        """A plugin's secret: plugins only see entries under their own keyring service."""
+        return await self.get(PLUGIN_SERVICE_PREFIX + plugin, name)
@@ -1,76 +1,153 @@
 # service_template.py - A template for creating a cross-platform service in Python
 # created for fxetrx
+#
+# The service is a single asyncio event loop hosting a set of components (the
+# network server, the scheduler, plugin I/O, ...). A component is any object
+# with async start() and stop() methods. Nothing polls: the loop sleeps until a
+# component has work, and shutdown is an event set directly from a signal
+# handler or from stop(), so stopping takes as long as the components need to
+# close and no longer.
 import sys
-import time
+import asyncio
 import logging
 import threading
 import platform
 import os
+import signal
 
-# Configure logging to write to a file, overwriting existing logs on each run
-logging.basicConfig(
-    filename="service.log",
-    filemode='w',  # Overwrite log file on each run
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+STOP_SIGNALS = ("SIGTERM", "SIGINT", "SIGHUP")
 
-def service_task(service):
-    """
-    Main service loop that runs in a separate thread.
-    Continuously logs that the service is running until stopped.
-    """
-    while service.running:
-        logging.info("Service is running...")
-        time.sleep(10)  # Simulate background processing with a delay
 
 class CrossPlatformService:
     """
     A simple cross-platform service implementation that can be started and stopped.
-    Uses a background thread to run the service task.
+    Runs its components on one asyncio event loop, either in the calling thread
+    (run_forever) or in a background thread (start/stop).
     """
-    def __init__(self):
+    def __init__(self, components=None, notifier=None):
+        self.components = list(components or [])  # Started in order, stopped in reverse
+        self.notifier = notifier  # e.g. readiness.ServiceNotifier, told when the service is ready and stopping
         self.running = False  # Flag to indicate if the service is active
-        self.thread = None  # Thread reference for running the service
+        self.thread = None  # Thread reference when running in the background
+        self.loop = None
+        self._stop_event = None
+        self._started = threading.Event()
+        self._error = None
 
-    def start(self):
+    def add_component(self, component):
+        """Add an object with async start() and stop() methods to the service."""
+        self.components.append(component)
+
+    async def run(self):
         """
-        Start the service if it's not already running.
-        Spawns a new thread to run the service task.
+        Start every component on the running loop, wait for a stop request,
+        then stop the components that were started, in reverse order.
         """
-        if not self.running:
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        notifier = self.notifier
+        started = []
+        try:
+            if notifier is not None:
+                await notifier.starting()
+            for component in self.components:
+                await component.start()
+                started.append(component)
             self.running = True
-            self.thread = threading.Thread(target=service_task, args=(self,), daemon=True)
-            self.thread.start()
             logging.info("Service started")
+            if notifier is not None:
+                await notifier.ready()
+            self._started.set()
+            await self._stop_event.wait()
+        except Exception as e:
+            self._error = e
+            raise
+        finally:
+            self.running = False
+            self._started.set()  # Never leave start() waiting if startup failed
+            if notifier is not None:
+                await notifier.stopping()
+            for component in reversed(started):
+                try:
+                    await component.stop()
+                except Exception as e:
+                    logging.error(f"Error stopping {type(component).__name__}: {e}")
+            logging.info("Service stopped")
+            if notifier is not None:
+                await notifier.stopped()
+
+    def request_stop(self):
+        """Ask the service to stop; safe to call from any thread or a signal handler."""
+        if self.loop is not None and self._stop_event is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # the loop has closed: the service has already stopped
+
+    def start(self):
+        """
+        Start the service in a background thread if it's not already running.
+        Returns once every component has started.
+        """
+        if not self.running and self.thread is None:
+            self._started.clear()
+            self._error = None
+            self.thread = threading.Thread(target=self._run_in_thread, daemon=True)
+            self.thread.start()
+            self._started.wait()
+            if self._error is not None:
+                self.thread.join()
+                self.thread = None
+                raise self._error
+
+    def _run_in_thread(self):
+        try:
+            asyncio.run(self.run())
+        except Exception:
+            if self._error is None:
+                raise
+            # a failed startup; start() raises it in the caller
 
     def stop(self):
         """
-        Stop the service and ensure the background thread terminates.
+        Stop the service and wait for its components to shut down.
         """
-        if self.running:
-            self.running = False
-            if self.thread:
-                self.thread.join()  # Ensure the thread is properly stopped
-            logging.info("Service stopped")
+        self.request_stop()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+            self.thread = None
+
+    def run_forever(self):
+        """Run the service in the calling thread until a stop signal or stop request arrives."""
+        asyncio.run(self._run_with_signals())
+
+    async def _run_with_signals(self):
+        loop = asyncio.get_running_loop()
+        for name in STOP_SIGNALS:
+            sig = getattr(signal, name, None)
+            if sig is None:
+                continue
+            try:
+                loop.add_signal_handler(sig, self._on_signal, name)
+            except NotImplementedError:
+                # Windows event loops have no add_signal_handler
+                signal.signal(sig, lambda signum, frame, name=name: self._on_signal(name))
+        await self.run()
+
+    def _on_signal(self, name):
+        logging.info(f"Service is exiting due to {name}")
+        self.request_stop()
+
 
 if __name__ == "__main__":
+    # Run from the fxetrx root with `python -m src.service_template`. Logs go
+    # through the non-blocking pipeline and are appended and rotated, not
+    # truncated on each run.
+    from src.log_pipeline import setup_logging
+    setup_logging()
     service = CrossPlatformService()
-    if len(sys.argv) > 1:
-        # Command-line interface to start or stop the service
-        if sys.argv[1] == "start":
-            service.start()
-        elif sys.argv[1] == "stop":
-            service.stop()
-        else:
-            print("Usage: python service.py [start|stop]")
+    if len(sys.argv) > 1 and sys.argv[1] != "start":
+        print("Usage: python service.py [start]")
     else:
-        # If no arguments provided, start the service manually
-        service.start()
-        while service.running:
-            try:
-                time.sleep(1)  # Keep the main thread alive while the service runs
-            except KeyboardInterrupt:
-                logging.info("Service is exiting due to keyboard interrupt")
-                service.stop()
-                sys.exit(0)
+        # Run until SIGTERM/SIGINT (Ctrl+C)
+        service.run_forever()
@@ -0,0 +1,116 @@
+# bench_batch.py - inventory sweeps: one request per item vs /batch and streamed lists
+#
+# Serves --plugins synthetic plugins (directory listing, no workers started)
+# and the status snapshot over plain HTTP on localhost, then fetches every
+# plugin's /plugins/<name> plus /status:
+# - requests: one keep-alive GET per item, a round trip each
+# - batch: one POST /batch, results streamed as NDJSON as they complete
+# - buffered batch: the same with ?stream=none, one JSON document at the end
+# and reports total time, plus time to the first result byte for the two
+# batch modes.
+#
+#   python tests/bench_batch.py --plugins 500 --rounds 5
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.api import Api, StatusSnapshot  # noqa: E402
+from src.net import RequestServer  # noqa: E402
+from src.plugin_pool import PluginPools  # noqa: E402
+
+
+class FixedStatus:
+    """A StatusCache stand-in that always has the same snapshot."""
+
+    def __init__(self):
+        self.snapshot = StatusSnapshot(1, {"status": "running", "uptime": 10, "config_version": "1.0"})
+
+
+async def read_response(reader):
+    """Read one response; returns (seconds until the first body byte arrived, body)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    headers = head.decode("latin-1").lower()
+    if "transfer-encoding: chunked" not in headers:
+        length = int(headers.split("content-length:")[1].split("\r\n")[0])
+        return time.perf_counter(), await reader.readexactly(length)
+    first, body = None, []
+    while True:
+        size = int((await reader.readuntil(b"\r\n"))[:-2], 16)
+        chunk = await reader.readexactly(size + 2)
+        if first is None:
+            first = time.perf_counter()
+        if not size:
+            return first, b"".join(body)
+        body.append(chunk[:-2])
+
+
+async def one_by_one(port, paths):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    start = time.perf_counter()
+    for path in paths:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        await read_response(reader)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed, None
+
+
+async def batch(port, paths, mode):
+    body = json.dumps(paths).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    start = time.perf_counter()
+    writer.write(b"POST /batch?stream=%s HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s"
+                 % (mode.encode(), len(body), body))
+    first, data = await read_response(reader)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    results = len(data.splitlines()) if mode == "ndjson" else len(json.loads(data)["results"])
+    assert results == len(paths), results
+    return elapsed, first - start
+
+
+async def run(directory, plugins, rounds):
+    for i in range(plugins):
+        os.makedirs(os.path.join(directory, f"plugin{i:04d}"))
+    pools = PluginPools(directory, index_file=os.path.join(directory, "missing.json"))
+    await pools.start()
+    server = RequestServer(Api(FixedStatus(), None, pools).handle, port=0)
+    await server.start()
+    paths = ["/status"] + [f"/plugins/{name}" for name in pools.available]
+    results = {}
+    for name, run_once in (("requests", lambda: one_by_one(server.port, paths)),
+                           ("batch", lambda: batch(server.port, paths, "ndjson")),
+                           ("buffered_batch", lambda: batch(server.port, paths, "none"))):
+        samples = sorted([await run_once() for _ in range(rounds)])
+        results[name] = samples[len(samples) // 2]
+    await server.stop()
+    await pools.stop()
+    return results
+
+
+def benchmark(plugins=500, rounds=5):
+    with tempfile.TemporaryDirectory() as directory:
+        return asyncio.run(run(directory, plugins, rounds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-item requests against batched, streamed ones")
+    parser.add_argument("--plugins", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    r = benchmark(args.plugins, args.rounds)
+    for name, (elapsed, first) in r.items():
+        first_text = f", first result after {first * 1000:.2f} ms" if first is not None else ""
+        print(f"{name:15}: {elapsed * 1000:8.1f} ms for {args.plugins + 1} items{first_text}")
+
+
+if __name__ == "__main__":
+    main()
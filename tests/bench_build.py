@@ -0,0 +1,58 @@
+# bench_build.py - build time with and without the build cache
+#
+# Copies src/ and service/ to a scratch tree and runs build.compile_all()
+# over it:
+# - cold: empty cache, every module compiled
+# - warm: nothing changed, every module restored from the cache
+# - one change: one module edited, the rest restored
+#
+#   python tests/bench_build.py --jobs 0
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from build.build import BuildCache, COMPILE_DIRS, compile_all, load_build_config  # noqa: E402
+
+
+def timed_build(config, directory, jobs):
+    start = time.perf_counter()
+    cache = compile_all(config, jobs, BuildCache(os.path.join(directory, "cache")),
+                        os.path.join(directory, "deployment"), os.path.join(directory, "tree"),
+                        os.path.join(directory, "hash.cache"))
+    return (time.perf_counter() - start) * 1000, cache.hits, cache.misses
+
+
+def benchmark(jobs=None):
+    config = load_build_config()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in COMPILE_DIRS:
+            shutil.copytree(os.path.join(ROOT, name), os.path.join(directory, "tree", name),
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        results["cold"] = timed_build(config, directory, jobs)
+        results["warm"] = timed_build(config, directory, jobs)
+        with open(os.path.join(directory, "tree", "src", "api.py"), "a") as f:
+            f.write("\n# edited\n")
+        results["one_change"] = timed_build(config, directory, jobs)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold and cached builds")
+    parser.add_argument("--jobs", type=int, default=0, help="parallel compile jobs, 0 for one per CPU")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for name, (ms, hits, misses) in benchmark(args.jobs or None).items():
+        print(f"{name:10}: {ms:8.1f} ms, {hits} cache hits, {misses} compiled")
+
+
+if __name__ == "__main__":
+    main()
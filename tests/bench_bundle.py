@@ -0,0 +1,75 @@
+# bench_bundle.py - interpreted-mode cold start, loose files vs the module bundle
+#
+# Builds a bundle of everything src.main imports (as the build does with
+# BUNDLE=1), then starts --runs fresh interpreters that import src.main:
+# - loose: the normal import system, .py/.pyc files found by probing sys.path
+# - bundle: src.bundle's finder first on sys.meta_path
+# and reports the median and best wall time per start, and how many stat-like
+# filesystem calls each start made when strace is available.
+#
+#   python tests/bench_bundle.py --runs 20
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from build.build import build_bundle, load_build_config  # noqa: E402
+
+LOOSE = "import src.main"
+BUNDLED = "from src import bundle; bundle.install({path!r}); import src.main"
+
+
+def start_ms(code, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def stat_calls(code):
+    """Filesystem lookups (stat/open family) made by one start, or None without strace."""
+    if not shutil.which("strace"):
+        return None
+    result = subprocess.run(["strace", "-f", "-c", "-e", "trace=%stat,openat,getdents64",
+                             sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    for line in result.stderr.splitlines():
+        if line.strip().endswith("total"):
+            return int(line.split()[2])
+    return None
+
+
+def benchmark(runs=20):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fxetrx.bundle")
+        build_bundle(load_build_config(), path, os.path.join(directory, "import_profile.txt"))
+        for name, code in (("loose", LOOSE), ("bundle", BUNDLED.format(path=path))):
+            median, best = start_ms(code, runs)
+            results[name] = {"median_ms": median, "best_ms": best, "fs_calls": stat_calls(code)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interpreted-mode startup with and without the bundle")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for name, r in benchmark(args.runs).items():
+        fs_calls = "n/a" if r["fs_calls"] is None else r["fs_calls"]
+        print(f"{name:6}: median {r['median_ms']:6.1f} ms, best {r['best_ms']:6.1f} ms, "
+              f"{fs_calls} filesystem lookups")
+
+
+if __name__ == "__main__":
+    main()
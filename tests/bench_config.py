@@ -0,0 +1,84 @@
+# bench_config.py - reading config.json per status call vs the in-memory ConfigStore
+#
+# - read: microseconds per config version lookup, opening and parsing the file
+#   each time (service/status.py's get_config_version()) vs ConfigStore.current
+# - reload: milliseconds from an atomic rename of a new config.json until the
+#   store has swapped it in (inotify, or polling where unavailable)
+#
+#   python tests/bench_config.py --reads 100000 --reloads 20
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from service import status  # noqa: E402
+from src.config import ConfigStore  # noqa: E402
+
+
+def write(path, version):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": version, "log_level": "INFO", "plugins": {f"p{i}": {"enabled": True} for i in range(50)}},
+                  f)
+    os.replace(path + ".tmp", path)
+
+
+def per_read_us(function, reads):
+    start = time.perf_counter()
+    for _ in range(reads):
+        function()
+    return (time.perf_counter() - start) * 1e6 / reads
+
+
+async def reload_ms(store, path, reloads):
+    samples = []
+    for i in range(reloads):
+        version = f"reload-{i}"
+        start = time.perf_counter()
+        write(path, version)
+        while store.current.version != version:
+            await asyncio.sleep(0.0005)
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+
+async def run(directory, reads, reloads):
+    path = os.path.join(directory, "config.json")
+    write(path, "1.0")
+    status.CONFIG_FILE = path
+    store = ConfigStore(path)
+    await store.start()
+    results = {
+        "disk_us": per_read_us(status.get_config_version, reads),
+        "memory_us": per_read_us(lambda: store.current.version, reads),
+        "inotify": store._inotify is not None,
+        "reload_ms": await reload_ms(store, path, reloads),
+    }
+    await store.stop()
+    return results
+
+
+def benchmark(reads=100000, reloads=20):
+    with tempfile.TemporaryDirectory() as directory:
+        return asyncio.run(run(directory, reads, reloads))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-call config reads vs the in-memory store")
+    parser.add_argument("--reads", type=int, default=100000)
+    parser.add_argument("--reloads", type=int, default=20)
+    args = parser.parse_args()
+
+    r = benchmark(args.reads, args.reloads)
+    print(f"version lookup: {r['disk_us']:.2f} us reading config.json, {r['memory_us']:.3f} us in memory")
+    print(f"reload: median {r['reload_ms']:.1f} ms from rename to swap "
+          f"({'inotify' if r['inotify'] else 'polling'})")
+
+
+if __name__ == "__main__":
+    main()
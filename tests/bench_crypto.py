@@ -0,0 +1,96 @@
+# bench_crypto.py - signs and verifies per second with src/crypto.py
+#
+# - key load: parsing the signing key from PEM vs load_private_key() once cached
+# - sign: Signer.sign() one digest at a time vs Signer.sign_batch() on all cores
+# - verify: Verifier.verify_batch() with an empty cache, then again once every
+#   (key id, digest) pair is cached, as at the next service start
+# - files: verify_files() over --files signed files, cold and with a warm cache
+#
+#   python tests/bench_crypto.py --digests 50000 --files 500
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+
+from src.crypto import (Signer, VerificationCache, Verifier, generate_signing_key, load_private_key,  # noqa: E402
+                        load_public_key, sign_files, verify_files)
+
+
+def rate(count, function):
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def _benchmark(digests, files, jobs):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        key_path = os.path.join(directory, "signing.key")
+        public_path = os.path.join(directory, "signing.pub")
+        generate_signing_key(key_path, public_path)
+        with open(key_path, "rb") as f:
+            pem = f.read()
+        loads = 2000
+        results["key_parses_per_sec"] = rate(loads, lambda: [serialization.load_pem_private_key(pem, None)
+                                                             for _ in range(loads)])
+        load_private_key(key_path)
+        results["key_cached_loads_per_sec"] = rate(loads, lambda: [load_private_key(key_path) for _ in range(loads)])
+
+        batch = [os.urandom(32) for _ in range(digests)]
+        signer = Signer.from_file(key_path, jobs)
+        results["signs_per_sec"] = rate(digests, lambda: [signer.sign(digest) for digest in batch])
+        signatures = []
+        results["batch_signs_per_sec"] = rate(digests, lambda: signatures.extend(signer.sign_batch(batch)))
+
+        verifier = Verifier(VerificationCache(), jobs)
+        kid = verifier.add_key(load_public_key(public_path))
+        items = [(kid, digest, signature) for digest, signature in zip(batch, signatures)]
+        results["verifies_per_sec"] = rate(digests, lambda: verifier.verify_batch(items))
+        results["cached_verifies_per_sec"] = rate(digests, lambda: verifier.verify_batch(items))
+
+        paths = []
+        for i in range(files):
+            path = os.path.join(directory, f"plugin_{i}.py")
+            with open(path, "wb") as f:
+                f.write(os.urandom(16 * 1024))
+            paths.append(path)
+        sign_files(signer, paths)
+        cache_path = os.path.join(directory, "verified.json")
+        for run in ("cold", "warm"):
+            cache = VerificationCache(cache_path)
+            verifier = Verifier(cache, jobs)
+            verifier.add_key_file(public_path)
+            start = time.perf_counter()
+            failed = verify_files(verifier, kid, paths)
+            results[f"files_{run}_ms"] = (time.perf_counter() - start) * 1000
+            assert not failed, failed
+            cache.save()
+    return results
+
+
+def benchmark(digests=50000, files=500, jobs=None):
+    return _benchmark(digests, files, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark signing and verification")
+    parser.add_argument("--digests", type=int, default=50000)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes for batches (default: cores)")
+    args = parser.parse_args()
+
+    r = benchmark(args.digests, args.files, args.jobs)
+    print(f"key load:   {r['key_parses_per_sec']:10.0f} parses/s, {r['key_cached_loads_per_sec']:10.0f} cached loads/s")
+    print(f"sign:       {r['signs_per_sec']:10.0f} /s one at a time, {r['batch_signs_per_sec']:10.0f} /s batched")
+    print(f"verify:     {r['verifies_per_sec']:10.0f} /s uncached, {r['cached_verifies_per_sec']:10.0f} /s cached")
+    print(f"{args.files} files: {r['files_cold_ms']:.1f} ms cold, {r['files_warm_ms']:.1f} ms with a warm cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# bench_ipc.py - core <-> plugin worker message throughput, JSON lines vs ipc.py
+#
+# Starts an echo worker as a child process and sends it --messages round trips
+# of each payload, once over JSON lines on pipes (how plugin_pool.py used to talk
+# to its workers) and once over an ipc.py channel:
+# - small: a short call request ({"function", "args", "kwargs"})
+# - files: a plugin file list of --files paths (a few MB of str)
+# - blob:  --blob-mb MB of raw bytes, as a scan output would be
+#
+# and reports messages per second and MB/s of payload moved in each direction.
+#
+#   python tests/bench_ipc.py --messages 20000 --files 200000 --blob-mb 32
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import ipc  # noqa: E402
+
+
+def serve_json():
+    """Echo worker for the JSON lines baseline."""
+    for line in sys.stdin:
+        message = json.loads(line)
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+
+
+def serve_ipc(fds):
+    """Echo worker for the ipc.py channel."""
+    channel = ipc.child_channel(*fds)
+    while True:
+        message = channel.recv()
+        if message is None:
+            break
+        kind, message_id, payload = message
+        channel.send(ipc.RESULT, message_id, payload)
+    channel.close()
+
+
+def payloads(files, blob_mb):
+    """(name, payload, JSON-safe payload, payload size in bytes) for each benchmark."""
+    small = {"function": "scan", "args": ["/srv/data"], "kwargs": {"depth": 3}}
+    paths = [f"/srv/plugins/example/data/{i // 1000:04d}/file_{i:07d}.dat" for i in range(files)]
+    blob = os.urandom(blob_mb * 1024 * 1024)
+    return [
+        ("small", small, small, len(json.dumps(small))),
+        ("files", paths, paths, sum(len(p) for p in paths)),
+        # JSON cannot carry bytes; the baseline has to ship them as latin-1 text
+        ("blob", blob, blob.decode("latin-1"), len(blob)),
+    ]
+
+
+async def bench_json(payload, messages):
+    """Seconds for `messages` round trips over JSON lines."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--serve-json",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=1024 * 1024 * 1024)
+    start = time.perf_counter()
+    for i in range(messages):
+        process.stdin.write(json.dumps({"id": i, "result": payload}).encode() + b"\n")
+        await process.stdin.drain()
+        json.loads(await process.stdout.readline())
+    elapsed = time.perf_counter() - start
+    process.stdin.close()
+    await process.wait()
+    return elapsed
+
+
+async def bench_ipc(payload, messages):
+    """Seconds for `messages` round trips over an ipc.py channel."""
+    sock, send_ring, recv_ring, child_fds = ipc.channel_pair()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--serve-ipc", *(str(fd) for fd in child_fds), pass_fds=child_fds)
+    for fd in child_fds:
+        os.close(fd)
+    channel = await ipc.AsyncChannel.connect(sock, send_ring, recv_ring)
+    start = time.perf_counter()
+    for i in range(messages):
+        await channel.send(ipc.CALL, i, payload)
+        await channel.recv()
+    elapsed = time.perf_counter() - start
+    await channel.close()
+    await process.wait()
+    return elapsed
+
+
+async def _benchmark(messages, files, blob_mb):
+    results = {}
+    for name, payload, json_payload, size in payloads(files, blob_mb):
+        count = messages if name == "small" else max(1, messages // 1000)
+        for transport, elapsed in (("json", await bench_json(json_payload, count)),
+                                   ("ipc", await bench_ipc(payload, count))):
+            results[f"{name}_{transport}"] = {
+                "messages_per_sec": count / elapsed,
+                "mb_per_sec": 2 * count * size / elapsed / (1024 * 1024),
+            }
+    return results
+
+
+def benchmark(messages=20000, files=200000, blob_mb=32):
+    return asyncio.run(_benchmark(messages, files, blob_mb))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve-json":
+        return serve_json()
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve-ipc":
+        return serve_ipc([int(fd) for fd in sys.argv[2:5]])
+
+    parser = argparse.ArgumentParser(description="Benchmark JSON lines vs the ipc.py channel")
+    parser.add_argument("--messages", type=int, default=20000,
+                        help="round trips of the small payload (large payloads use 1/1000 of this)")
+    parser.add_argument("--files", type=int, default=200000, help="paths in the file list payload")
+    parser.add_argument("--blob-mb", type=int, default=32, help="size of the raw bytes payload")
+    args = parser.parse_args()
+
+    results = benchmark(args.messages, args.files, args.blob_mb)
+    for name in ("small", "files", "blob"):
+        for transport in ("json", "ipc"):
+            r = results[f"{name}_{transport}"]
+            print(f"{name:5} {transport:4}: {r['messages_per_sec']:10.1f} msg/s {r['mb_per_sec']:9.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
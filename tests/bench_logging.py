@@ -0,0 +1,136 @@
+# bench_logging.py - logging throughput and enqueue latency, FileHandler vs log_pipeline
+#
+# Logs --records INFO records from --threads threads, once through a plain
+# logging.FileHandler (synchronous writes from every thread) and once through
+# the log_pipeline queue and writer, and reports:
+# - records/s sustained until everything is on disk
+# - p50/p99/worst latency of one logging call, as seen by the calling thread
+# --disk-latency-ms adds a delay to every write, standing in for a slow or
+# contended disk; that delay lands in the caller with FileHandler and in the
+# writer thread with the pipeline.
+#
+#   python tests/bench_logging.py --records 200000 --threads 4 --disk-latency-ms 5
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import log_pipeline  # noqa: E402
+
+
+class SlowFile:
+    """Wraps a file object, adding `latency` seconds to every flush."""
+
+    def __init__(self, file, latency):
+        self.file = file
+        self.latency = latency
+
+    def write(self, text):
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def produce(logger, records, threads):
+    """Log records across threads; returns per-call latencies in microseconds."""
+    per_thread = records // threads
+    latencies = [[] for _ in range(threads)]
+
+    def work(samples):
+        clock = time.perf_counter_ns
+        for i in range(per_thread):
+            start = clock()
+            logger.info("request %d served in %.3f ms", i, 0.25)
+            samples.append((clock() - start) / 1000)
+
+    workers = [threading.Thread(target=work, args=(samples,)) for samples in latencies]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sorted(sample for samples in latencies for sample in samples)
+
+
+def run_file_handler(directory, records, threads, latency):
+    handler = logging.FileHandler(os.path.join(directory, "plain.log"))
+    handler.stream = SlowFile(handler.stream, latency)
+    handler.setFormatter(logging.Formatter(log_pipeline.TEXT_FORMAT))
+    logger = _logger("bench.plain", handler)
+    start = time.perf_counter()
+    latencies = produce(logger, records, threads)
+    elapsed = time.perf_counter() - start
+    handler.close()
+    return latencies, elapsed, 0
+
+
+def run_pipeline(directory, records, threads, latency, fmt):
+    handler = log_pipeline.QueueingHandler(queue_size=max(records, log_pipeline.DEFAULT_QUEUE_SIZE))
+    output = log_pipeline.RotatingLogFile(os.path.join(directory, "pipeline.log"))
+    output.file = SlowFile(output.file, latency)
+    formatter = log_pipeline.JsonFormatter() if fmt == "json" else log_pipeline.TextFormatter()
+    writer = log_pipeline.LogWriter(handler, output, formatter)
+    writer.start()
+    logger = _logger("bench.pipeline", handler)
+    start = time.perf_counter()
+    latencies = produce(logger, records, threads)
+    writer.stop()  # waits until every queued record is written
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, handler.dropped
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def benchmark(records=200000, threads=4, latency_ms=0.0, fmt="text"):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (latencies, elapsed, dropped) in (
+                ("file_handler", run_file_handler(directory, records, threads, latency_ms / 1000)),
+                ("pipeline", run_pipeline(directory, records, threads, latency_ms / 1000, fmt))):
+            results[name] = {
+                "records_per_sec": len(latencies) / elapsed,
+                "p50_us": percentile(latencies, 0.5),
+                "p99_us": percentile(latencies, 0.99),
+                "max_us": latencies[-1],
+                "dropped": dropped,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FileHandler vs the non-blocking log pipeline")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--disk-latency-ms", type=float, default=0.0, help="delay added to every flush")
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    args = parser.parse_args()
+
+    results = benchmark(args.records, args.threads, args.disk_latency_ms, args.format)
+    for name, r in results.items():
+        print(f"{name:12}: {r['records_per_sec']:10.0f} records/s, enqueue p50 {r['p50_us']:.1f} us, "
+              f"p99 {r['p99_us']:.1f} us, worst {r['max_us']:.1f} us, {r['dropped']} dropped")
+
+
+if __name__ == "__main__":
+    main()
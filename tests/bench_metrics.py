@@ -0,0 +1,103 @@
+# bench_metrics.py - cost of leaving the metrics.py instrumentation on
+#
+# - record: nanoseconds per Counter.inc(), Histogram.observe() and labelled
+#   observe, from one thread and from --threads threads at once
+# - request: microseconds per Api.handle() call with and without a registry
+# - scrape: milliseconds to render /metrics with --plugins labelled series
+#
+#   python tests/bench_metrics.py --ops 1000000 --threads 4 --plugins 200
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.api import Api, StatusSnapshot  # noqa: E402
+from src.metrics import Registry  # noqa: E402
+from src.net import Request  # noqa: E402
+
+
+def per_op_ns(function, ops, threads=1):
+    """Nanoseconds of wall time per call of function, spread over threads."""
+    per_thread = ops // threads
+
+    def work():
+        for _ in range(per_thread):
+            function()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter_ns()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter_ns() - start) / (per_thread * threads)
+
+
+class FixedStatus:
+    """A StatusCache stand-in that always has the same snapshot."""
+
+    def __init__(self):
+        self.snapshot = StatusSnapshot(1, {"status": "running", "uptime": 10, "config_version": "1.0"})
+
+
+async def request_us(registry, requests):
+    api = Api(FixedStatus(), registry)
+    request = Request("GET", "/uptime", "HTTP/1.1", {})
+    start = time.perf_counter()
+    for _ in range(requests):
+        await api.handle(request)
+    return (time.perf_counter() - start) * 1e6 / requests
+
+
+def benchmark(ops=1000000, threads=4, plugins=200):
+    registry = Registry()
+    counter = registry.counter("bench_total", "bench")
+    histogram = registry.histogram("bench_seconds", "bench")
+    labelled = registry.histogram("bench_plugin_seconds", "bench", ("plugin",))
+    results = {
+        "counter_ns": per_op_ns(counter.inc, ops),
+        "histogram_ns": per_op_ns(lambda: histogram.observe(0.003), ops),
+        "labelled_ns": per_op_ns(lambda: labelled.labels("plugin").observe(0.003), ops),
+        "histogram_threads_ns": per_op_ns(lambda: histogram.observe(0.003), ops, threads),
+    }
+    requests = max(1, ops // 20)
+    results["request_plain_us"] = asyncio.run(request_us(None, requests))
+    results["request_metrics_us"] = asyncio.run(request_us(Registry(), requests))
+
+    for i in range(plugins):
+        labelled.labels(f"plugin{i}").observe(0.01)
+    registry.gauge("bench_plugin_calls_total", "bench", lambda: {(f"plugin{i}",): i for i in range(plugins)},
+                   ("plugin",), "counter")
+    start = time.perf_counter()
+    body = registry.render()
+    results["scrape_ms"] = (time.perf_counter() - start) * 1000
+    results["scrape_lines"] = body.count("\n")
+    # every observation from every thread is accounted for
+    results["histogram_count"] = histogram.snapshot()[2]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark metrics instrumentation overhead")
+    parser.add_argument("--ops", type=int, default=1000000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--plugins", type=int, default=200)
+    args = parser.parse_args()
+
+    r = benchmark(args.ops, args.threads, args.plugins)
+    print(f"Counter.inc:         {r['counter_ns']:7.1f} ns")
+    print(f"Histogram.observe:   {r['histogram_ns']:7.1f} ns ({r['histogram_threads_ns']:.1f} ns "
+          f"with {args.threads} threads)")
+    print(f"labelled observe:    {r['labelled_ns']:7.1f} ns")
+    print(f"Api.handle:          {r['request_plain_us']:7.2f} us without metrics, "
+          f"{r['request_metrics_us']:.2f} us with")
+    print(f"scrape:              {r['scrape_ms']:7.2f} ms for {r['scrape_lines']} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# bench_net.py - local load generator for the fxetrx network server (src/net.py)
+#
+# Starts a RequestServer in a child process (or targets an already running
+# daemon with --target) and drives it with keep-alive, optionally pipelined,
+# connections. Reports requests/sec and p50/p99 latency.
+#
+#   python tests/bench_net.py --connections 50 --requests 20000 --pipeline 4 --tls
+import argparse
+import asyncio
+import multiprocessing
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.net import RequestServer, Response, create_ssl_context  # noqa: E402
+
+
+async def _ok(request):
+    return Response(200, b'{"status": "running"}')
+
+
+def _run_server(port_queue, certfile, keyfile, max_connections, backlog):
+    ssl_context = create_ssl_context(certfile, keyfile) if certfile else None
+
+    async def serve():
+        server = RequestServer(_ok, port=0, ssl_context=ssl_context,
+                               max_connections=max_connections, backlog=backlog)
+        await server.start()
+        port_queue.put(server.port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def make_self_signed_cert(directory):
+    """Create a throwaway certificate with the openssl CLI."""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", keyfile, "-out", certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line[:15].lower() == b"content-length:":
+            length = int(line[15:])
+    if length:
+        await reader.readexactly(length)
+
+
+async def _client(host, port, ssl_context, count, pipeline, latencies):
+    reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context,
+                                                   server_hostname=host if ssl_context else None)
+    request = f"GET /status HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("ascii")
+    sent = 0
+    while sent < count:
+        batch = min(pipeline, count - sent)
+        start = time.perf_counter()
+        writer.write(request * batch)
+        for _ in range(batch):
+            await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+        sent += batch
+    writer.close()
+
+
+async def run_load(host, port, connections, requests, pipeline, use_tls):
+    """Drive the server and return (elapsed seconds, latencies)."""
+    ssl_context = None
+    if use_tls:
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    latencies = []
+    per_connection = max(1, requests // connections)
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, ssl_context, per_connection, pipeline, latencies)
+                           for _ in range(connections)))
+    return time.perf_counter() - start, latencies
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def benchmark(connections=50, requests=20000, pipeline=1, use_tls=False, target=None,
+              max_connections=1024, backlog=512):
+    """Run one load test and return a dict of results."""
+    server = None
+    tempdir = tempfile.TemporaryDirectory()
+    try:
+        if target:
+            host, port = target.rsplit(":", 1)
+            port = int(port)
+        else:
+            host = "127.0.0.1"
+            certfile = keyfile = None
+            if use_tls:
+                certfile, keyfile = make_self_signed_cert(tempdir.name)
+            port_queue = multiprocessing.Queue()
+            server = multiprocessing.Process(target=_run_server,
+                                             args=(port_queue, certfile, keyfile, max_connections, backlog),
+                                             daemon=True)
+            server.start()
+            port = port_queue.get(timeout=10)
+        elapsed, latencies = asyncio.run(run_load(host, port, connections, requests, pipeline, use_tls))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+        tempdir.cleanup()
+    return {
+        "requests": len(latencies),
+        "connections": connections,
+        "pipeline": pipeline,
+        "tls": use_tls,
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fxetrx request server")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--pipeline", type=int, default=1, help="requests sent back-to-back per connection")
+    parser.add_argument("--tls", action="store_true", help="serve over TLS with a throwaway certificate")
+    parser.add_argument("--target", help="host:port of a running server instead of starting one")
+    parser.add_argument("--max-connections", type=int, default=1024)
+    parser.add_argument("--backlog", type=int, default=512)
+    args = parser.parse_args()
+
+    result = benchmark(args.connections, args.requests, args.pipeline, args.tls, args.target,
+                       args.max_connections, args.backlog)
+    print(f"{result['requests']} requests over {result['connections']} connections "
+          f"(pipeline {result['pipeline']}, {'https' if result['tls'] else 'http'})")
+    print(f"  {result['requests_per_sec']:.0f} requests/sec")
+    print(f"  p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench_plugins.py - plugin call latency and throughput, cold process vs warm pool
+#
+# Builds a throwaway plugin (its own venv and a module with some stdlib imports)
+# and measures:
+# - cold: spawn a worker under the venv interpreter for every call, as if each
+#   plugin call started a fresh process
+# - warm: the same call on a WorkerPool that keeps its workers running
+# - throughput: CPU-bound calls with one worker vs one worker per core
+#
+#   python tests/bench_plugins.py --calls 500 --cold-calls 10
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import venv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.plugin_pool import Worker, WorkerPool, plugin_python  # noqa: E402
+
+PLUGIN_SOURCE = """
+import asyncio, decimal, email.parser, http.client, json, xml.dom.minidom
+
+
+def echo(value):
+    return value
+
+
+def spin(n):
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+"""
+
+
+def make_plugin(directory):
+    """Create a plugin with its own venv under directory; returns its path."""
+    path = os.path.join(directory, "bench")
+    os.makedirs(path)
+    with open(os.path.join(path, "plugin.py"), "w") as f:
+        f.write(PLUGIN_SOURCE)
+    venv.create(os.path.join(path, "venv"), with_pip=False)
+    return path
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def cold_calls(plugin_path, calls):
+    """Milliseconds per call when every call spawns its own worker."""
+    samples = []
+    python = plugin_python(plugin_path)
+    for i in range(calls):
+        start = time.perf_counter()
+        worker = await Worker.spawn(python, plugin_path, "plugin")
+        await worker.call("echo", (i,), {})
+        await worker.close()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def warm_calls(plugin_path, calls):
+    """Milliseconds per call on a warm single-worker pool."""
+    pool = WorkerPool(plugin_path, min_workers=1, max_workers=1)
+    await pool.start()
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        await pool.call("echo", i)
+        samples.append((time.perf_counter() - start) * 1000)
+    await pool.stop()
+    return samples
+
+
+async def throughput(plugin_path, workers, calls, work):
+    """CPU-bound calls per second with `workers` warm workers."""
+    pool = WorkerPool(plugin_path, min_workers=workers, max_workers=workers)
+    await pool.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.call("spin", work) for _ in range(calls)))
+    rate = calls / (time.perf_counter() - start)
+    await pool.stop()
+    return rate
+
+
+async def _benchmark(calls, cold, work):
+    with tempfile.TemporaryDirectory() as directory:
+        plugin_path = make_plugin(directory)
+        cold_samples = await cold_calls(plugin_path, cold)
+        warm_samples = await warm_calls(plugin_path, calls)
+        cores = os.cpu_count() or 1
+        results = {
+            "cold_p50_ms": percentile(cold_samples, 0.5),
+            "warm_p50_ms": percentile(warm_samples, 0.5),
+            "warm_p99_ms": percentile(warm_samples, 0.99),
+            "cores": cores,
+            "calls_per_sec_1_worker": await throughput(plugin_path, 1, calls // 5 or 1, work),
+            "calls_per_sec_all_cores": await throughput(plugin_path, cores, calls // 5 or 1, work),
+        }
+    return results
+
+
+def benchmark(calls=500, cold=10, work=200000):
+    return asyncio.run(_benchmark(calls, cold, work))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold vs warm plugin calls")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--cold-calls", type=int, default=10)
+    parser.add_argument("--work", type=int, default=200000, help="loop iterations per CPU-bound call")
+    args = parser.parse_args()
+
+    results = benchmark(args.calls, args.cold_calls, args.work)
+    print(f"cold (spawn per call): p50 {results['cold_p50_ms']:.1f} ms")
+    print(f"warm pool:             p50 {results['warm_p50_ms']:.3f} ms, p99 {results['warm_p99_ms']:.3f} ms")
+    print(f"CPU-bound calls/s: {results['calls_per_sec_1_worker']:.1f} with 1 worker, "
+          f"{results['calls_per_sec_all_cores']:.1f} with {results['cores']} workers")
+
+
+if __name__ == "__main__":
+    main()
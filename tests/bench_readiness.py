@@ -0,0 +1,104 @@
+# bench_readiness.py - how long start -> ready -> stop -> stopped takes to observe
+#
+# Runs a stand-in service (CrossPlatformService with one component that takes
+# --startup-ms to start, plus readiness.ServiceNotifier on temp paths) through
+# --cycles start/stop cycles, and reports per cycle:
+# - event: readiness.wait_for_state("ready"), SIGTERM, wait_for_state("stopped")
+# - sleep: what install.py used to do, time.sleep(2) after starting and then a
+#   status check, once per start
+# plus whether systemd's READY=1 / STOPPING=1 arrived on a stand-in NOTIFY_SOCKET.
+#
+#   python tests/bench_readiness.py --cycles 10 --startup-ms 200
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import readiness  # noqa: E402
+
+OLD_START_SLEEP = 2.0  # install.py's fixed wait after starting
+
+SERVICE = """
+import asyncio, sys
+sys.path.insert(0, {root!r})
+from src.readiness import ServiceNotifier
+from src.service_template import CrossPlatformService
+
+class SlowStart:
+    async def start(self):
+        await asyncio.sleep({startup})
+    async def stop(self):
+        pass
+
+CrossPlatformService([SlowStart()], ServiceNotifier({pidfile!r}, {state_socket!r})).run_forever()
+"""
+
+
+def cycle(code, pidfile, state_socket):
+    """Seconds from spawning the service until it is seen ready, and from SIGTERM until it is seen stopped."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code])
+    state = readiness.wait_for_state("ready", 30, state_socket, pidfile)
+    ready = time.perf_counter() - start
+    assert state == "ready", state
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    state = readiness.wait_for_state("stopped", 30, state_socket, pidfile)
+    stopped = time.perf_counter() - start
+    assert state == "stopped", state
+    process.wait()
+    return ready, stopped
+
+
+def benchmark(cycles=10, startup_ms=200):
+    results = {"ready": [], "stopped": []}
+    with tempfile.TemporaryDirectory() as directory:
+        pidfile = os.path.join(directory, "fxetrx.pid")
+        state_socket = os.path.join(directory, "state.sock")
+        notify_path = os.path.join(directory, "notify")
+        notify = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        notify.bind(notify_path)
+        notify.setblocking(False)
+        os.environ["NOTIFY_SOCKET"] = notify_path
+        code = SERVICE.format(root=ROOT, startup=startup_ms / 1000, pidfile=pidfile, state_socket=state_socket)
+        for _ in range(cycles):
+            ready, stopped = cycle(code, pidfile, state_socket)
+            results["ready"].append(ready)
+            results["stopped"].append(stopped)
+        del os.environ["NOTIFY_SOCKET"]
+        messages = []
+        while True:
+            try:
+                messages.append(notify.recv(4096).decode())
+            except BlockingIOError:
+                break
+        notify.close()
+    results["sd_notify_ready"] = sum("READY=1" in m for m in messages)
+    results["sd_notify_stopping"] = sum("STOPPING=1" in m for m in messages)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark readiness notification against sleep-and-poll")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--startup-ms", type=float, default=200, help="time the stand-in service takes to start")
+    args = parser.parse_args()
+
+    r = benchmark(args.cycles, args.startup_ms)
+    ready = sum(r["ready"]) / args.cycles * 1000
+    stopped = sum(r["stopped"]) / args.cycles * 1000
+    print(f"event: ready after {ready:.0f} ms, stopped after {stopped:.0f} ms, cycle {ready + stopped:.0f} ms")
+    print(f"sleep: ready after {OLD_START_SLEEP * 1000:.0f} ms (+ a status subprocess), per start")
+    print(f"sd_notify: {r['sd_notify_ready']} READY=1, {r['sd_notify_stopping']} STOPPING=1 "
+          f"for {args.cycles} cycles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# bench_scheduler.py - scheduling overhead and firing lateness of the fxetrx scheduler
+#
+# - insert/cancel: time Scheduler.schedule() and Job.cancel() for --jobs jobs
+# - firing: run --jobs recurring jobs (intervals spread over --min/--max-interval
+#   seconds, with jitter) on a real event loop for --seconds, and report how late
+#   they fired and how much CPU the scheduler used per fired job
+#
+#   python tests/bench_scheduler.py --jobs 100000 --seconds 10
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.scheduler import Scheduler  # noqa: E402
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def insert_cancel(jobs):
+    """Microseconds per schedule() and per cancel() with `jobs` jobs in the wheel."""
+    scheduler = Scheduler()
+    delays = [random.uniform(0, 3600) for _ in range(jobs)]
+    start = time.perf_counter()
+    handles = [scheduler.schedule(_noop, delay) for delay in delays]
+    insert_us = (time.perf_counter() - start) * 1e6 / jobs
+    start = time.perf_counter()
+    for job in handles:
+        job.cancel()
+    cancel_us = (time.perf_counter() - start) * 1e6 / jobs
+    return insert_us, cancel_us
+
+
+def _noop():
+    pass
+
+
+async def _fire(jobs, seconds, min_interval, max_interval, jitter):
+    scheduler = Scheduler()
+    lateness = []
+    scheduler.lateness_observers.append(lateness.append)
+    # First runs start after a second, so filling the wheel does not count as lateness.
+    origin = scheduler.clock() + 1.0
+    for _ in range(jobs):
+        interval = random.uniform(min_interval, max_interval)
+        delay = origin - scheduler.clock() + random.uniform(0, interval)
+        scheduler.schedule(_noop, delay, interval=interval, jitter=jitter)
+    await scheduler.start()
+    await asyncio.sleep(max(0.0, origin - scheduler.clock()))
+    cpu = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu
+    await scheduler.stop()
+    lateness.sort()
+    return {
+        "fired": scheduler.fired,
+        "cpu_us_per_fire": cpu * 1e6 / max(1, scheduler.fired),
+        "cpu_percent": cpu * 100 / seconds,
+        "late_p50_ms": percentile(lateness, 0.50) * 1000,
+        "late_p99_ms": percentile(lateness, 0.99) * 1000,
+        "late_max_ms": scheduler.max_lateness * 1000,
+    }
+
+
+def benchmark(jobs=100000, seconds=10.0, min_interval=1.0, max_interval=60.0, jitter=0.5):
+    results = {}
+    results["insert_us"], results["cancel_us"] = insert_cancel(jobs)
+    results.update(asyncio.run(_fire(jobs, seconds, min_interval, max_interval, jitter)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fxetrx timer-wheel scheduler")
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--min-interval", type=float, default=1.0)
+    parser.add_argument("--max-interval", type=float, default=60.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = benchmark(args.jobs, args.seconds, args.min_interval, args.max_interval, args.jitter)
+    print(f"{args.jobs} jobs: schedule {results['insert_us']:.2f} us, cancel {results['cancel_us']:.2f} us")
+    print(f"fired {results['fired']} runs in {args.seconds:.0f}s: "
+          f"{results['cpu_us_per_fire']:.2f} us CPU per run ({results['cpu_percent']:.1f}% of one core)")
+    print(f"lateness: p50 {results['late_p50_ms']:.2f} ms, p99 {results['late_p99_ms']:.2f} ms, "
+          f"max {results['late_max_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_secrets.py - secret lookups per second, straight keyring vs SecretCache
+#
+# The keyring is simulated by a lookup that sleeps --latency-ms, roughly what a
+# Secret Service round trip over D-Bus costs, so the numbers do not depend on
+# the desktop session of the machine running the benchmark.
+# - direct: every lookup goes to the (simulated) keyring
+# - cached: lookups of --secrets distinct secrets through a warm SecretCache
+# - coalesced: --concurrency simultaneous lookups of one cold secret, and how
+#   many keyring calls they caused
+#
+#   python tests/bench_secrets.py --lookups 100000 --latency-ms 20
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.secret_cache import SecretCache  # noqa: E402
+
+
+class SlowKeyring:
+    """Stands in for keyring.get_password with a fixed latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def lookup(self, service, username):
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"secret-{service}-{username}"
+
+
+async def _benchmark(lookups, secrets, latency, concurrency):
+    keyring = SlowKeyring(latency)
+    loop = asyncio.get_running_loop()
+    direct = max(1, min(lookups, int(2 / latency) if latency else lookups))
+    start = time.perf_counter()
+    for i in range(direct):
+        await loop.run_in_executor(None, keyring.lookup, "bench", f"user{i % secrets}")
+    direct_rate = direct / (time.perf_counter() - start)
+
+    cache = SecretCache(lookup=keyring.lookup, max_entries=secrets)
+    for i in range(secrets):
+        await cache.get("bench", f"user{i}")
+    start = time.perf_counter()
+    for i in range(lookups):
+        await cache.get("bench", f"user{i % secrets}")
+    cached_rate = lookups / (time.perf_counter() - start)
+
+    keyring.calls = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(cache.get("bench", "cold") for _ in range(concurrency)))
+    coalesced_ms = (time.perf_counter() - start) * 1000
+    await cache.stop()
+    return {
+        "direct_per_sec": direct_rate,
+        "cached_per_sec": cached_rate,
+        "coalesced_ms": coalesced_ms,
+        "coalesced_keyring_calls": keyring.calls,
+    }
+
+
+def benchmark(lookups=100000, secrets=100, latency_ms=20.0, concurrency=100):
+    return asyncio.run(_benchmark(lookups, secrets, latency_ms / 1000, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark keyring lookups with and without SecretCache")
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--secrets", type=int, default=100, help="distinct secrets looked up")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated keyring latency")
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    r = benchmark(args.lookups, args.secrets, args.latency_ms, args.concurrency)
+    print(f"direct keyring: {r['direct_per_sec']:12.1f} lookups/s")
+    print(f"SecretCache:    {r['cached_per_sec']:12.1f} lookups/s")
+    print(f"{args.concurrency} concurrent cold lookups: {r['coalesced_ms']:.1f} ms, "
+          f"{r['coalesced_keyring_calls']} keyring call(s)")
+
+
+if __name__ == "__main__":
+    main()
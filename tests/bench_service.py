@@ -0,0 +1,98 @@
+# bench_service.py - stop latency and idle wakeups of the fxetrx service core
+#
+# - stop latency: start a CrossPlatformService hosting a RequestServer in a
+#   background thread and time stop() until every component has shut down;
+#   also time SIGTERM-to-exit of a real `python -m src.main` process
+# - idle wakeups: let that process sit idle and count its voluntary context
+#   switches (Linux /proc/<pid>/status), scaled to a per-minute rate
+#
+#   python tests/bench_service.py --cycles 50 --idle-seconds 20
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.net import RequestServer  # noqa: E402
+from src.service_template import CrossPlatformService  # noqa: E402
+
+
+def stop_latency(cycles):
+    """Median and worst stop() time in milliseconds over start/stop cycles."""
+    samples = []
+    for _ in range(cycles):
+        service = CrossPlatformService([RequestServer(port=0)])
+        service.start()
+        start = time.perf_counter()
+        service.stop()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def context_switches(pid):
+    """Voluntary plus involuntary context switches of every thread of pid."""
+    total = 0
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{tid}/status") as f:
+                for line in f:
+                    if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+def idle_process(idle_seconds):
+    """Run the real service idle; returns (wakeups per minute, SIGTERM-to-exit ms)."""
+    command = [sys.executable, "-m", "src.main", "--insecure-http", "--port", "0", "--verify", "off",
+               "--status-interval", "3600"]
+    process = subprocess.Popen(command, cwd=ROOT, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stderr:
+            if "Service started" in line:
+                break
+        time.sleep(1)  # let startup work settle
+        before = context_switches(process.pid)
+        time.sleep(idle_seconds)
+        wakeups = context_switches(process.pid) - before
+        start = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+        exit_ms = (time.perf_counter() - start) * 1000
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return wakeups * 60.0 / idle_seconds, exit_ms
+
+
+def benchmark(cycles=50, idle_seconds=20):
+    median, worst = stop_latency(cycles)
+    results = {"stop_median_ms": median, "stop_max_ms": worst}
+    if os.path.isdir("/proc/self/task"):
+        results["idle_wakeups_per_min"], results["sigterm_exit_ms"] = idle_process(idle_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fxetrx service stop latency and idle wakeups")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--idle-seconds", type=float, default=20)
+    args = parser.parse_args()
+
+    results = benchmark(args.cycles, args.idle_seconds)
+    print(f"stop(): median {results['stop_median_ms']:.2f} ms, worst {results['stop_max_ms']:.2f} ms "
+          f"over {args.cycles} cycles (previous template: up to 10000 ms)")
+    if "idle_wakeups_per_min" in results:
+        print(f"idle wakeups: {results['idle_wakeups_per_min']:.1f}/min")
+        print(f"SIGTERM to process exit: {results['sigterm_exit_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
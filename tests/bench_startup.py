@@ -0,0 +1,118 @@
+# bench_startup.py - service time-to-first-request with many installed plugins
+#
+# Creates --plugins synthetic plugins (manifest.json and a module with some
+# stdlib imports, no venv) and measures:
+# - index: build.build_plugin_index() over all of them, as the build does
+# - time to first request: PluginPools.start() plus a RequestServer answering
+#   one HTTP request, with the plugin index and with the directory-listing
+#   fallback, for 5 plugins and for all of them
+# - first call: the first call to one plugin, which starts its pool
+# - eager: starting pools for --eager-plugins plugins up front, which is what
+#   the service did before plugins were started on first use
+#
+#   python tests/bench_startup.py --plugins 500 --eager-plugins 20
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from build.build import build_plugin_index  # noqa: E402
+from src.net import RequestServer, Response  # noqa: E402
+from src.plugin_pool import PluginPools  # noqa: E402
+
+PLUGIN_SOURCE = """
+import decimal, email.parser, json, xml.dom.minidom
+
+
+def echo(value):
+    return value
+"""
+
+
+def make_plugins(directory, count):
+    for i in range(count):
+        path = os.path.join(directory, f"plugin{i:04d}")
+        os.makedirs(path)
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump({"module": "plugin", "entry_points": ["echo"], "capabilities": ["bench"]}, f)
+        with open(os.path.join(path, "plugin.py"), "w") as f:
+            f.write(PLUGIN_SOURCE)
+
+
+async def first_request(plugins_dir, index_file):
+    """Milliseconds from starting the plugin component and server to the first answered request."""
+    start = time.perf_counter()
+    plugins = PluginPools(plugins_dir, index_file=index_file, min_workers=1, max_workers=1)
+    await plugins.start()
+    server = RequestServer(lambda request: _ok(), port=0)
+    await server.start()
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(b"GET /status HTTP/1.1\r\nHost: x\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    elapsed = (time.perf_counter() - start) * 1000
+    writer.close()
+    first_call_start = time.perf_counter()
+    await plugins.call(plugins.available[0], "echo", 1)
+    first_call = (time.perf_counter() - first_call_start) * 1000
+    await server.stop()
+    await plugins.stop()
+    return elapsed, first_call
+
+
+async def _ok():
+    return Response(200, b"{}")
+
+
+async def eager(plugins_dir, count):
+    """Milliseconds to start pools for the first `count` plugins up front."""
+    plugins = PluginPools(plugins_dir, index_file=os.devnull, min_workers=1, max_workers=1)
+    await plugins.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(plugins.pool(name) for name in plugins.available[:count]))
+    elapsed = (time.perf_counter() - start) * 1000
+    await plugins.stop()
+    return elapsed
+
+
+def benchmark(plugins=500, eager_plugins=20):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (5, plugins):
+            plugins_dir = os.path.join(directory, f"plugins{count}")
+            make_plugins(plugins_dir, count)
+            index_file = os.path.join(directory, f"index{count}.json")
+            start = time.perf_counter()
+            build_plugin_index(plugins_dir, index_file, cache_file=os.path.join(directory, "hash.cache"))
+            results[f"index_build_ms_{count}"] = (time.perf_counter() - start) * 1000
+            for mode, index in (("index", index_file), ("listing", os.path.join(directory, "missing.json"))):
+                ttfr, first_call = asyncio.run(first_request(plugins_dir, index))
+                results[f"ttfr_ms_{mode}_{count}"] = ttfr
+                results[f"first_call_ms_{mode}_{count}"] = first_call
+        results["eager_ms"] = asyncio.run(eager(os.path.join(directory, f"plugins{plugins}"), eager_plugins))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup with many installed plugins")
+    parser.add_argument("--plugins", type=int, default=500)
+    parser.add_argument("--eager-plugins", type=int, default=20,
+                        help="plugins started up front for the eager comparison")
+    args = parser.parse_args()
+
+    r = benchmark(args.plugins, args.eager_plugins)
+    for count in (5, args.plugins):
+        print(f"{count:4} plugins: index built in {r[f'index_build_ms_{count}']:.0f} ms; first request after "
+              f"{r[f'ttfr_ms_index_{count}']:.1f} ms with the index, {r[f'ttfr_ms_listing_{count}']:.1f} ms "
+              f"listing plugins/; first plugin call {r[f'first_call_ms_index_{count}']:.0f} ms")
+    print(f"eager start of {args.eager_plugins} pools: {r['eager_ms']:.0f} ms "
+          f"(~{r['eager_ms'] / args.eager_plugins * args.plugins / 1000:.1f} s for {args.plugins})")
+
+
+if __name__ == "__main__":
+    main()
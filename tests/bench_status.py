@@ -0,0 +1,120 @@
+# bench_status.py - compare the old ps/systemctl status path with the /proc readers in service/procfs.py
+#
+# Builds a synthetic /proc tree with many processes (plus a cgroup and pidfile
+# for the service) and times:
+# - "scan":  what the old path made `ps -eo etimes,command` do, reading every
+#            process' stat and cmdline and searching for "fxetrx"
+# - "fork":  the old path as it ran, two subprocesses per query (real host)
+# - "procfs": the new pidfile/cgroup + /proc/<pid>/stat path
+#
+#   python tests/bench_status.py --processes 20000 --iterations 200
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service import procfs  # noqa: E402
+
+
+def build_fake_tree(root, processes, service_pid):
+    """Create proc/, cgroup/ and a pidfile under root; returns their paths."""
+    proc_root = os.path.join(root, "proc")
+    cgroup_root = os.path.join(root, "cgroup")
+    os.makedirs(proc_root)
+    with open(os.path.join(proc_root, "uptime"), "w") as f:
+        f.write("100000.00 90000.00\n")
+    for pid in range(1, processes + 1):
+        name = "fxetrx" if pid == service_pid else f"worker{pid}"
+        os.mkdir(os.path.join(proc_root, str(pid)))
+        with open(os.path.join(proc_root, str(pid), "stat"), "w") as f:
+            f.write(f"{pid} ({name}) S 1 {pid} {pid} 0 -1 4194560 " + "0 " * 12 + f"{pid * 100} 0 0\n")
+        with open(os.path.join(proc_root, str(pid), "cmdline"), "wb") as f:
+            f.write(f"/opt/{name}/bin/{name}\0--daemon\0".encode())
+    unit_dir = os.path.join(cgroup_root, "system.slice", procfs.SYSTEMD_UNIT)
+    os.makedirs(unit_dir)
+    with open(os.path.join(unit_dir, "cgroup.procs"), "w") as f:
+        f.write(f"{service_pid}\n")
+    pidfile = os.path.join(root, "fxetrx.pid")
+    with open(pidfile, "w") as f:
+        f.write(f"{service_pid}\n")
+    return proc_root, cgroup_root, pidfile
+
+
+def scan_status(proc_root):
+    """The old algorithm: walk every process looking for "fxetrx"."""
+    uptime = None
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_root, entry, "stat"), "rb") as f:
+                f.read()
+            with open(os.path.join(proc_root, entry, "cmdline"), "rb") as f:
+                command = f.read().replace(b"\0", b" ").decode()
+        except OSError:
+            continue
+        if "fxetrx" in command and uptime is None:
+            match = re.search(r"(\d+)", command)
+            uptime = int(match.group(1)) if match else 0
+    return uptime
+
+
+def fork_status():
+    """The old path as shipped: ps plus systemctl on the real host."""
+    subprocess.run(["ps", "-eo", "etimes,command"], capture_output=True, text=True)
+    subprocess.run(["systemctl", "is-active", "fxetrx"], capture_output=True, text=True)
+
+
+def time_per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def benchmark(processes=20000, iterations=200, include_fork=True):
+    """Return per-call timings in milliseconds for each status path."""
+    with tempfile.TemporaryDirectory() as root:
+        service_pid = processes // 2
+        proc_root, cgroup_root, pidfile = build_fake_tree(root, processes, service_pid)
+        unit_dirs = (root,)
+
+        def new_path():
+            procfs.service_uptime(pidfile, procfs.SYSTEMD_UNIT, proc_root, cgroup_root)
+            procfs.service_state(pidfile, procfs.SYSTEMD_UNIT, proc_root, cgroup_root, unit_dirs)
+
+        results = {
+            "processes": processes,
+            "scan_ms": time_per_call(lambda: scan_status(proc_root), max(1, iterations // 20)) * 1000,
+            "procfs_ms": time_per_call(new_path, iterations) * 1000,
+        }
+    if include_fork:
+        try:
+            results["fork_ms"] = time_per_call(fork_status, max(1, iterations // 20)) * 1000
+        except FileNotFoundError:
+            pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fxetrx status collection")
+    parser.add_argument("--processes", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--no-fork", action="store_true", help="skip timing the real ps/systemctl subprocesses")
+    args = parser.parse_args()
+
+    results = benchmark(args.processes, args.iterations, not args.no_fork)
+    print(f"synthetic /proc with {results['processes']} processes")
+    print(f"  old scan of every process: {results['scan_ms']:.3f} ms/query")
+    if "fork_ms" in results:
+        print(f"  old ps + systemctl (host): {results['fork_ms']:.3f} ms/query")
+    print(f"  procfs (pidfile/cgroup):   {results['procfs_ms']:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+# run_benchmarks.py - the reproducible benchmark suite and its regression gate
+#
+# Times the hot paths of the service and its build entirely on this machine,
+# with stand-ins for what a build host does not have:
+# - manifest:  calculate_sha256() and update_manifest() over a synthetic tree
+#              (fixed seed, so every run hashes the same bytes)
+# - status:    check_service_status() over a fake /proc, cgroup hierarchy,
+#              unit directory and pidfile, which stand in for systemd
+# - provision: check_dependencies() setting up plugin venvs from a local wheel
+#              index (pip runs with --no-index) and a stand-in fxetrx venv
+# - api:       requests/sec and latency of the API served by net.RequestServer,
+#              its status cache fed by the systemd stand-in
+# - secrets:   SecretCache in front of a stand-in keyring
+#
+# Results are written to --output as JSON. Only macro metrics, whole operations
+# that take a good part of a second or more, are gated; the microbenchmarks
+# vary too much between runs of a shared machine and are only recorded.
+#
+# The baseline is recorded over --baseline-repeat runs and stores each metric's
+# noise band, the best and worst value seen. A gated metric regresses when the
+# best of this run's --repeat runs is more than its threshold percent outside
+# that band. A scenario that looks regressed runs --repeat more times, up to
+# --confirm rounds, so a burst of other load does not fail the gate.
+#
+#   python tests/run_benchmarks.py --repeat 3
+#   python tests/run_benchmarks.py --only manifest provision --update-baseline
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, TESTS)
+
+import bench_net  # noqa: E402
+import bench_secrets  # noqa: E402
+import bench_status  # noqa: E402
+from build import build  # noqa: E402
+from service import procfs, status  # noqa: E402
+from src.api import Api, StatusCache  # noqa: E402
+from src.config import Config  # noqa: E402
+from src.dependency_manager import CORE_REQUIREMENTS, check_dependencies  # noqa: E402
+from src.metrics import Registry  # noqa: E402
+from src.net import RequestServer  # noqa: E402
+from src.plugin_venv_setup import interpreter_fingerprint, requirements_fingerprint, write_fingerprint  # noqa: E402
+
+BASELINE_FILE = os.path.join(TESTS, "benchmark_baseline.json")
+RESULTS_FILE = os.path.join(TESTS, "benchmark_results.json")
+DEFAULT_REPEAT = 3
+BASELINE_REPEAT = 5
+DEFAULT_CONFIRM = 2  # rounds of re-runs for scenarios that look regressed
+SEED = 20260101
+FORMAT_VERSION = 2
+
+
+def summarize(runs, gated):
+    """
+    One value per metric over several runs: gated metrics keep their best value
+    (like timeit, since a busy machine only ever makes a run slower), the
+    others their median.
+    """
+    best = {"lower": min, "higher": max}
+    return {key: best.get(gated[key][0] if key in gated else None, statistics.median)([run[key] for run in runs])
+            for key in runs[0]}
+
+
+def band(runs):
+    """The noise band of every metric over several runs: what the baseline stores."""
+    return {key: {"low": min(run[key] for run in runs), "median": statistics.median(run[key] for run in runs),
+                  "high": max(run[key] for run in runs)} for key in runs[0]}
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def environment(**variables):
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+# manifest
+
+def make_tree(root, files, large_files, seed=SEED):
+    """Write a seeded tree of small files plus a few above build.MMAP_THRESHOLD; returns their paths."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files + large_files):
+        directory = os.path.join(root, "src", f"d{i % 16:02d}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"f{i:05d}.bin")
+        size = build.MMAP_THRESHOLD + rng.randrange(1 << 20) if i >= files else rng.randrange(256, 64 << 10)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(size))
+        # older than the hash cache's racy window, so a warm run can reuse every digest
+        past = time.time_ns() - 2 * build.RACY_WINDOW_NS
+        os.utime(path, ns=(past, past))
+        paths.append(os.path.relpath(path, root))
+    return paths
+
+
+def bench_manifest(files=2000, large_files=4, jobs=None):
+    with tempfile.TemporaryDirectory() as root, working_directory(root):
+        paths = make_tree(root, files, large_files)
+        total = sum(os.path.getsize(path) for path in paths)
+        os.makedirs(os.path.dirname(build.MANIFEST_FILE))
+        with open(build.MANIFEST_FILE, "w") as f:
+            f.write("file_name,sha256_hash,description\n")
+            f.writelines(f"{path},,bench\n" for path in paths)
+
+        start = time.perf_counter()
+        for path in paths:
+            build.calculate_sha256(path)
+        sha256_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        build.update_manifest(jobs)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        build.update_manifest(jobs)
+        warm = time.perf_counter() - start
+    return {
+        "sha256_mib_per_sec": total / 1048576 / sha256_seconds,
+        "update_cold_ms": cold * 1000,
+        "update_warm_ms": warm * 1000,
+    }
+
+
+# status
+
+@contextlib.contextmanager
+def systemd_stand_in(root, processes=2000):
+    """
+    A fake /proc, cgroup hierarchy, unit directory and pidfile under root, with
+    service/procfs.py pointed at them: the service runs as a systemd unit.
+    """
+    service_pid = processes // 2
+    proc_root, cgroup_root, pidfile = bench_status.build_fake_tree(root, processes, service_pid)
+    with open(os.path.join(root, procfs.SYSTEMD_UNIT), "w") as f:
+        f.write("[Service]\nType=notify\n")
+    state = functools.partial(procfs.service_state, pidfile, procfs.SYSTEMD_UNIT, proc_root, cgroup_root, (root,))
+    uptime = functools.partial(procfs.service_uptime, pidfile, procfs.SYSTEMD_UNIT, proc_root, cgroup_root)
+    with mock.patch.object(procfs, "service_state", state), mock.patch.object(procfs, "service_uptime", uptime):
+        yield
+
+
+def bench_status_collection(processes=2000, iterations=500):
+    config = Config(1, {"version": "bench"})
+    with tempfile.TemporaryDirectory() as root, systemd_stand_in(root, processes):
+        result = status.check_service_status(config)
+        if result["status"] != "running":
+            raise RuntimeError(f"status stand-in not running: {result}")
+        start = time.perf_counter()
+        for _ in range(iterations):
+            status.check_service_status(config)
+        elapsed = time.perf_counter() - start
+    return {"check_service_status_us": elapsed / iterations * 1e6}
+
+
+# provision
+
+def make_wheel(directory, name, version="1.0", modules=8):
+    """Write a small pure-Python wheel to directory; returns its path."""
+    dist_info = f"{name}-{version}.dist-info"
+    files = {f"{name}/__init__.py": f"VERSION = {version!r}\n"}
+    for i in range(modules):
+        files[f"{name}/mod{i}.py"] = f"def f{i}(x):\n    return x + {i}\n" * 20
+    files[f"{dist_info}/METADATA"] = f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+    files[f"{dist_info}/WHEEL"] = "Wheel-Version: 1.0\nGenerator: fxetrx-bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n"
+    files[f"{dist_info}/RECORD"] = "".join(f"{path},,\n" for path in files) + f"{dist_info}/RECORD,,\n"
+    path = os.path.join(directory, f"{name}-{version}-py3-none-any.whl")
+    with zipfile.ZipFile(path, "w") as wheel:
+        for member, content in sorted(files.items()):
+            wheel.writestr(zipfile.ZipInfo(member, date_time=(2026, 1, 1, 0, 0, 0)), content)
+    return path
+
+
+def make_provision_tree(root, plugins, packages, per_plugin):
+    """A working directory for check_dependencies(): stand-in fxetrx venv, plugins and a wheel index."""
+    index = os.path.join(root, "index")
+    os.makedirs(index)
+    names = [f"fxbench_pkg{i:02d}" for i in range(packages)]
+    for name in names:
+        make_wheel(index, name)
+
+    work = os.path.join(root, "work")
+    venv_path = os.path.join(work, "fxetrx_venv")
+    os.makedirs(os.path.join(venv_path, "bin"))
+    os.symlink(sys.executable, os.path.join(venv_path, "bin", "python"))
+    core = os.path.join(work, CORE_REQUIREMENTS)
+    open(core, "w").close()
+    # the core requirements count as installed, so no pip install runs for them
+    write_fingerprint(venv_path, {"interpreter": interpreter_fingerprint(),
+                                  "requirements": requirements_fingerprint(core)})
+
+    rng = random.Random(SEED)
+    for i in range(plugins):
+        plugin = os.path.join(work, "plugins", f"plugin{i:02d}")
+        os.makedirs(plugin)
+        with open(os.path.join(plugin, "requirements.txt"), "w") as f:
+            f.writelines(f"{name}==1.0\n" for name in sorted(rng.sample(names, per_plugin)))
+    return work, index
+
+
+def bench_provision(plugins=6, packages=8, per_plugin=3, jobs=None):
+    if platform.system() == "Windows":
+        raise RuntimeError("the stand-in fxetrx venv links bin/python")
+    with tempfile.TemporaryDirectory() as root:
+        work, index = make_provision_tree(root, plugins, packages, per_plugin)
+        pip_settings = {"PIP_NO_INDEX": "1", "PIP_FIND_LINKS": index,
+                        "PIP_DISABLE_PIP_VERSION_CHECK": "1", "PIP_NO_INPUT": "1"}
+        with working_directory(work), environment(**pip_settings):
+            start = time.perf_counter()
+            check_dependencies(jobs)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            check_dependencies(jobs)
+            warm = time.perf_counter() - start
+    return {"cold_ms": cold * 1000, "warm_ms": warm * 1000}
+
+
+# api
+
+def _run_api_server(port_queue, root, processes):
+    async def serve():
+        status_cache = StatusCache(lambda: status.check_service_status(Config(1, {"version": "bench"})))
+        await status_cache.start()
+        server = RequestServer(Api(status_cache, Registry()).handle, port=0)
+        await server.start()
+        port_queue.put(server.port)
+        await server.serve_forever()
+
+    with systemd_stand_in(root, processes):
+        asyncio.run(serve())
+
+
+def bench_api(connections=20, requests=20000, processes=2000):
+    with tempfile.TemporaryDirectory() as root:
+        port_queue = multiprocessing.Queue()
+        server = multiprocessing.Process(target=_run_api_server, args=(port_queue, root, processes), daemon=True)
+        server.start()
+        try:
+            port = port_queue.get(timeout=30)
+            elapsed, latencies = asyncio.run(bench_net.run_load("127.0.0.1", port, connections, requests, 1, False))
+        finally:
+            server.terminate()
+            server.join()
+    return {
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": bench_net.percentile(latencies, 50) * 1000,
+        "p99_ms": bench_net.percentile(latencies, 99) * 1000,
+    }
+
+
+# secrets
+
+def bench_secret_cache(lookups=200000, secrets=100, latency_ms=1.0, concurrency=100):
+    r = bench_secrets.benchmark(lookups, secrets, latency_ms, concurrency)
+    return {"cached_per_sec": r["cached_per_sec"], "coalesced_keyring_calls": r["coalesced_keyring_calls"]}
+
+
+# name: (function, {metric: ("lower" or "higher" is better, threshold percent)}).
+# Metrics not listed are recorded but not gated.
+SCENARIOS = {
+    "manifest": (bench_manifest, {"update_cold_ms": ("lower", 30.0)}),
+    "status": (bench_status_collection, {}),
+    "provision": (bench_provision, {"cold_ms": ("lower", 30.0)}),
+    "api": (bench_api, {"requests_per_sec": ("higher", 30.0)}),
+    "secrets": (bench_secret_cache, {}),
+}
+
+
+def machine():
+    """What the numbers depend on besides the code; a baseline only compares well on the same machine."""
+    return {
+        "python": platform.python_version(),
+        "implementation": sys.implementation.name,
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(names, repeat, runs=None):
+    """Run the named scenarios `repeat` times each, adding to runs; returns {scenario: [metrics of each run]}."""
+    runs = runs if runs is not None else {}
+    for name in names:
+        function = SCENARIOS[name][0]
+        start = time.perf_counter()
+        runs.setdefault(name, []).extend(function() for _ in range(max(1, repeat)))
+        logging.info(f"{name}: {time.perf_counter() - start:.1f}s")
+    return runs
+
+
+def summarize_all(runs):
+    return {name: summarize(scenario_runs, SCENARIOS[name][1]) for name, scenario_runs in runs.items()}
+
+
+def compare(results, baseline, threshold=None):
+    """
+    Gated metrics more than their threshold percent (or `threshold` for all of
+    them) outside the baseline's noise band; returns a list of dicts.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, (better, limit) in SCENARIOS[name][1].items():
+            stored = baseline.get(name, {}).get(metric)
+            now = metrics.get(metric)
+            if not stored or now is None:
+                continue
+            limit = limit if threshold is None else threshold
+            if better == "lower":
+                edge = stored["high"]
+                change = (now - edge) / edge * 100 if edge else 0.0
+            else:
+                edge = stored["low"]
+                change = (edge - now) / edge * 100 if edge else 0.0
+            if change > limit:
+                regressions.append({"scenario": name, "metric": metric, "baseline": edge, "value": now,
+                                    "worse_percent": round(change, 1), "threshold": limit})
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return None
+    if baseline.get("format") != FORMAT_VERSION:
+        print(f"warning: ignoring {path}, written by another version of this script; record it again")
+        return None
+    return baseline
+
+
+def write_json(path, document):
+    temp_file = path + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(temp_file, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fxetrx benchmark suite and fail on performance regressions")
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per scenario; the best is kept")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="percent every gated metric may be outside the baseline's band "
+                             "(default: each metric's own threshold)")
+    parser.add_argument("--confirm", type=int, default=DEFAULT_CONFIRM,
+                        help="times a scenario that looks regressed is run again before the regression counts")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--baseline-repeat", type=int, default=BASELINE_REPEAT,
+                        help="runs per scenario when recording the baseline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    names = args.only or list(SCENARIOS)
+    repeat = args.baseline_repeat if args.update_baseline else args.repeat
+    runs = run(names, repeat)
+    results = summarize_all(runs)
+    document = {"format": FORMAT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "machine": machine(), "repeat": repeat, "results": results}
+
+    if args.update_baseline:
+        stored = load_baseline(args.baseline) or {}
+        bands = stored.get("results", {}) if stored.get("machine") == document["machine"] else {}
+        # scenarios left out with --only keep their previous baseline
+        bands.update((name, band(scenario_runs)) for name, scenario_runs in runs.items())
+        write_json(args.output, document)
+        write_json(args.baseline, dict(document, results=bands))
+        for name in names:
+            for metric, value in sorted(bands[name].items()):
+                print(f"{name:10} {metric:26} {value['low']:14.3f} .. {value['high']:.3f}")
+        print(f"baseline written to {args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    regressions = []
+    if baseline is not None:
+        if baseline.get("machine") != document["machine"]:
+            print(f"warning: the baseline was recorded on {baseline.get('machine')}, "
+                  f"this run is on {document['machine']}")
+        regressions = compare(results, baseline.get("results", {}), args.threshold)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            # a real regression survives more runs; a burst of other load on the machine does not
+            suspects = sorted({r["scenario"] for r in regressions})
+            logging.warning(f"Confirming regressions in {', '.join(suspects)}")
+            run(suspects, args.repeat, runs)
+            results = summarize_all(runs)
+            regressions = compare(results, baseline.get("results", {}), args.threshold)
+        document.update(results=results, baseline_file=args.baseline, regressions=regressions)
+    write_json(args.output, document)
+
+    for name in names:
+        gated = SCENARIOS[name][1]
+        bands = (baseline or {}).get("results", {}).get(name, {})
+        for metric, value in sorted(results[name].items()):
+            stored = bands.get(metric)
+            reference = f"  (baseline {stored['low']:.3f} .. {stored['high']:.3f})" if stored else ""
+            print(f"{name:10} {metric:26} {value:14.3f}{'' if metric in gated else '  (not gated)'}{reference}")
+
+    if baseline is None:
+        print(f"no baseline at {args.baseline}; run with --update-baseline to record one")
+        return
+    for r in regressions:
+        print(f"REGRESSION {r['scenario']}.{r['metric']}: {r['value']:.3f} against {r['baseline']:.3f}, the edge "
+              f"of the baseline's band ({r['worse_percent']}% worse, threshold {r['threshold']}%)")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions (results in {args.output})")
+
+
+if __name__ == "__main__":
+    main()
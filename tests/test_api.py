@@ -0,0 +1,72 @@
+# test_api.py - streamed /batch responses: calls start with the stream, latency covers sending it;
+# long-poll arguments
+#
+#   python -m pytest tests/test_api.py
+import gc
+import json
+import os
+import sys
+import unittest
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import metrics  # noqa: E402
+from src.api import Api, StatusSnapshot  # noqa: E402
+from src.net import Request, StreamingResponse  # noqa: E402
+
+CALLS = [{"id": i, "path": "/status"} for i in range(3)]
+
+
+class _FixedStatus:
+    def __init__(self):
+        self.snapshot = StatusSnapshot(1, {"status": "running", "uptime": 10, "config_version": "1.0"})
+
+
+def _batch_request():
+    return Request("POST", "/batch", "HTTP/1.1", {"accept": "application/x-ndjson"}, json.dumps(CALLS).encode())
+
+
+class BatchStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = Api(_FixedStatus())
+
+    async def test_streamed_results(self):
+        response = await self.api.handle(_batch_request())
+        self.assertIsInstance(response, StreamingResponse)
+        body = b"".join([chunk async for chunk in response.chunks])
+        results = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(result["id"] for result in results), [0, 1, 2])
+        self.assertTrue(all(result["status"] == 200 for result in results))
+
+    async def test_unsent_stream_leaves_no_coroutines(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            response = await self.api.handle(_batch_request())
+            await response.chunks.aclose()  # the connection went away before the stream started
+            del response
+            gc.collect()
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, RuntimeWarning)], [])
+
+    async def test_stream_latency_is_observed_once_sent(self):
+        registry = metrics.Registry()
+        api = Api(_FixedStatus(), registry)
+        latency = api._latency.labels("/batch")
+        response = await api.handle(_batch_request())
+        self.assertEqual(latency.snapshot()[2], 0)
+        [chunk async for chunk in response.chunks]
+        response.on_done()
+        self.assertEqual(latency.snapshot()[2], 1)
+
+
+class LongPollTest(unittest.IsolatedAsyncioTestCase):
+    async def test_bad_wait_is_rejected(self):
+        api = Api(_FixedStatus())
+        for wait in ("nan", "inf", "-1", "soon"):
+            with self.subTest(wait=wait):
+                response = await api.handle(Request("GET", f"/status?since=1&wait={wait}", "HTTP/1.1", {}))
+                self.assertEqual(response.status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
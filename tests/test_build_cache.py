@@ -0,0 +1,103 @@
+# test_build_cache.py - build cache keys, hits for unchanged modules and least-recently-used pruning
+#
+#   python -m pytest tests/test_build_cache.py
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build import build  # noqa: E402
+from build.build import BuildCache  # noqa: E402
+
+
+class CacheKeyTest(unittest.TestCase):
+    def test_key_covers_every_input(self):
+        key = BuildCache.key("src/a.py", "d1", {"OPTIMIZE": "1"}, "t1")
+        self.assertEqual(key, BuildCache.key("src/a.py", "d1", {"OPTIMIZE": "1"}, "t1"))
+        for changed in (("src/b.py", "d1", {"OPTIMIZE": "1"}, "t1"),
+                        ("src/a.py", "d2", {"OPTIMIZE": "1"}, "t1"),
+                        ("src/a.py", "d1", {"OPTIMIZE": "0"}, "t1"),
+                        ("src/a.py", "d1", {"OPTIMIZE": "1"}, "t2")):
+            self.assertNotEqual(BuildCache.key(*changed), key)
+
+
+class CompileAllTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        os.makedirs(os.path.join(self.root, "src"))
+        for name in ("a", "b"):
+            self.write(name, f"VALUE = {name!r}\n")
+        self.deploy_dir = os.path.join(self.root, "deployment")
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def write(self, name, text):
+        with open(os.path.join(self.root, "src", name + ".py"), "w") as f:
+            f.write(text)
+
+    def compile(self, config=None, max_entries=100):
+        cache = BuildCache(os.path.join(self.root, "cache"), max_entries)
+        return build.compile_all(config or {}, jobs=1, cache=cache, deploy_dir=self.deploy_dir, root=self.root,
+                                 cache_file=os.path.join(self.root, "hash_cache.json"))
+
+    def test_unchanged_modules_are_hits(self):
+        first = self.compile()
+        self.assertEqual((first.hits, first.misses), (0, 2))
+        second = self.compile()
+        self.assertEqual((second.hits, second.misses), (2, 0))
+        self.assertTrue(os.path.isfile(os.path.join(self.deploy_dir, "src", "a.pyc")))
+
+    def test_edited_module_is_recompiled_alone(self):
+        self.compile()
+        self.write("a", "VALUE = 'edited'\n")
+        cache = self.compile()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        namespace = {}
+        with open(os.path.join(self.deploy_dir, "src", "a.pyc"), "rb") as f:
+            exec(marshal.loads(f.read()[16:]), namespace)  # after the magic number, flags and hash
+        self.assertEqual(namespace["VALUE"], "edited")
+
+    def test_changed_setting_misses(self):
+        self.compile()
+        cache = self.compile({"OPTIMIZE": "1"})
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_other_settings_still_hit(self):
+        self.compile()
+        cache = self.compile({"VERBOSE": "1", "JOBS": "4"})
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_going_back_hits_again(self):
+        self.compile()
+        self.write("a", "VALUE = 'edited'\n")
+        self.compile()
+        self.write("a", "VALUE = 'a'\n")
+        cache = self.compile()
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+
+class PruneTest(unittest.TestCase):
+    def test_least_recently_used_entries_go(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = BuildCache(root, max_entries=2)
+            keys = [BuildCache.key(f"src/{i}.py", "d", {}, "t") for i in range(3)]
+            now = time.time()
+            for age, key in zip((30, 20, 10), keys):
+                os.makedirs(cache.path(key))
+                os.utime(cache.path(key), (now - age, now - age))
+            cache.lookup(keys[0])  # a hit makes the oldest entry the newest
+            self.assertEqual(cache.prune(), 1)
+            self.assertIsNotNone(cache.lookup(keys[0]))
+            self.assertIsNone(cache.lookup(keys[1]))
+            self.assertIsNotNone(cache.lookup(keys[2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# test_bundle.py - the module bundle never runs code older than its source or built by another interpreter
+#
+#   python -m pytest tests/test_bundle.py
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import bundle  # noqa: E402
+
+MODULE = "fxetrx_bundle_test_module"
+
+
+class BundleFinderTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        self.source = os.path.join(self.root, MODULE + ".py")
+        with open(self.source, "w") as f:
+            f.write("ORIGIN = 'source'\n")
+        code = compile("ORIGIN = 'bundle'\n", self.source, "exec")
+        self.path = os.path.join(self.root, "fxetrx.bundle")
+        bundle.write_bundle(self.path, {MODULE: (code, False, MODULE + ".py")}, self.root)
+
+    def test_unchanged_module_comes_from_the_bundle(self):
+        finder = bundle.BundleFinder(self.path, self.root)
+        spec = finder.find_spec(MODULE)
+        self.assertIs(spec.loader, finder)
+        namespace = {}
+        exec(finder.get_code(MODULE), namespace)
+        self.assertEqual(namespace["ORIGIN"], "bundle")
+
+    def test_edited_module_falls_through(self):
+        with open(self.source, "a") as f:
+            f.write("EDITED = True\n")
+        self.assertIsNone(bundle.BundleFinder(self.path, self.root).find_spec(MODULE))
+
+    def test_other_interpreter_build_is_rejected(self):
+        with mock.patch.object(sys, "version", sys.version + " (other build)"):
+            with self.assertRaises(ImportError):
+                bundle.BundleFinder(self.path, self.root)
+            with mock.patch.object(sys, "stderr"):
+                self.assertIsNone(bundle.install(self.path, self.root))
+
+    def test_absolute_origins_are_not_stamped(self):
+        code = compile("", "/usr/lib/python3/example.py", "exec")
+        bundle.write_bundle(self.path, {"example": (code, False, "/usr/lib/python3/example.py")}, self.root)
+        self.assertIsNotNone(bundle.BundleFinder(self.path, self.root).find_spec("example"))
+
+
+if __name__ == "__main__":
+    unittest.main()
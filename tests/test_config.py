@@ -0,0 +1,121 @@
+# test_config.py - ConfigStore reloads, rejected edits and coalesced reloads; watching a
+# configuration directory that does not exist yet
+#
+#   python -m pytest tests/test_config.py
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import ConfigStore  # noqa: E402
+
+
+class ConfigStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tempdir.name, "config.json")
+        self.write({"version": "1.0", "log_level": "INFO"})
+        self.store = ConfigStore(self.path, poll_interval=0.05)
+        self.changes = []
+        self.store.subscribe(lambda old, new: self.changes.append((old.generation, new.generation)))
+        logging.disable(logging.ERROR)
+        await self.store.start()
+
+    async def asyncTearDown(self):
+        await self.store.stop()
+        logging.disable(logging.NOTSET)
+        self._tempdir.cleanup()
+
+    def write(self, data):
+        # replaced in one rename, as editors and config management do
+        with open(self.path + ".new", "w") as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        os.replace(self.path + ".new", self.path)
+
+    async def test_reload_swaps_in_the_new_config(self):
+        self.write({"version": "2.0", "log_level": "DEBUG"})
+        await self.store.reload()
+        self.assertEqual(self.store.current.version, "2.0")
+        self.assertEqual(self.store.current["log_level"], "DEBUG")
+        self.assertEqual(self.changes, [(0, 1), (1, 2)])
+
+    async def test_unchanged_file_is_not_swapped(self):
+        await self.store.reload()
+        self.assertEqual(self.store.current.generation, 1)
+        self.assertEqual(self.changes, [(0, 1)])
+
+    async def test_invalid_json_is_rejected(self):
+        self.write('{"version": ')
+        await self.store.reload()
+        self.assertEqual(self.store.current.version, "1.0")
+        self.assertGreaterEqual(self.store.failures, 1)  # the watcher may have tried it as well
+
+    async def test_invalid_setting_is_rejected(self):
+        self.write({"version": "2.0", "log_level": "LOUD"})
+        await self.store.reload()
+        self.assertEqual(self.store.current.version, "1.0")
+        self.assertGreaterEqual(self.store.failures, 1)  # the watcher may have tried it as well
+
+    async def test_reloads_during_a_reload_are_coalesced(self):
+        self.write({"version": "2.0"})
+        first = self.store.reload()
+        self.write({"version": "3.0"})
+        for _ in range(5):
+            self.assertIs(self.store.reload(), first)
+        await first
+        self.assertEqual(self.store.current.version, "3.0")
+        self.assertLessEqual(self.store.reloads, 3)  # the start, and at most one per pass
+
+    async def test_config_is_read_only(self):
+        with self.assertRaises(TypeError):
+            self.store.current.data["version"] = "2.0"
+
+    async def test_edit_is_picked_up_by_the_watcher(self):
+        self.write({"version": "2.0"})
+        for _ in range(100):
+            if self.store.current.version == "2.0":
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(self.store.current.version, "2.0")
+
+
+class MissingDirectoryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self._tempdir.name, "etc", "fxetrx")
+        self.store = ConfigStore(os.path.join(self.directory, "config.json"))
+        logging.disable(logging.ERROR)
+        await self.store.start()
+
+    async def asyncTearDown(self):
+        await self.store.stop()
+        logging.disable(logging.NOTSET)
+        self._tempdir.cleanup()
+
+    async def wait_for_version(self, version):
+        for _ in range(100):
+            if self.store.current.version == version:
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(self.store.current.version, version)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify")
+    async def test_created_directory_is_watched_without_polling(self):
+        self.assertIsNone(self.store._poll_task)
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, "config.json"), "w") as f:
+            json.dump({"version": "2.0"}, f)
+        await self.wait_for_version("2.0")
+        # the directory is watched itself now, so later edits are seen too
+        with open(os.path.join(self.directory, "config.json"), "w") as f:
+            json.dump({"version": "3.0"}, f)
+        await self.wait_for_version("3.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
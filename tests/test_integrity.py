@@ -0,0 +1,121 @@
+# test_integrity.py - the build's manifest signature and the service's check of it; the
+# startup check of a copied deployment, and of one without a manifest
+#
+#   python -m pytest tests/test_integrity.py
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build import build  # noqa: E402
+from src import crypto, integrity, main  # noqa: E402
+
+
+class ManifestSignatureTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        directory = self._tempdir.name
+        self.key = os.path.join(directory, "manifest_signing.key")
+        self.public_key = os.path.join(directory, "manifest_signing.pub")
+        crypto.generate_signing_key(self.key, self.public_key)
+        self.manifest = os.path.join(directory, "manifest.csv")
+        with open(self.manifest, "w") as f:
+            f.write("file_name,sha256_hash,description,size,mtime_ns\nsrc/main.py,00,service,1,1\n")
+
+    def test_signed_by_the_build_verifies(self):
+        self.assertTrue(build.sign_manifest(self.key, self.manifest))
+        self.assertTrue(integrity.verify_manifest_signature(self.manifest, self.public_key))
+
+    def test_sign_files_verifies(self):
+        crypto.sign_files(crypto.Signer.from_file(self.key, jobs=1), [self.manifest])
+        self.assertTrue(integrity.verify_manifest_signature(self.manifest, self.public_key))
+
+    def test_modified_manifest_is_rejected(self):
+        build.sign_manifest(self.key, self.manifest)
+        with open(self.manifest, "a") as f:
+            f.write("src/evil.py,00,added,1,1\n")
+        with self.assertRaises(integrity.IntegrityError):
+            integrity.verify_manifest_signature(self.manifest, self.public_key)
+
+    def test_other_key_is_rejected(self):
+        build.sign_manifest(self.key, self.manifest)
+        crypto.generate_signing_key(self.key, self.public_key)
+        with self.assertRaises(integrity.IntegrityError):
+            integrity.verify_manifest_signature(self.manifest, self.public_key)
+
+    def test_missing_signature_is_rejected_once_a_key_is_installed(self):
+        with self.assertRaises(integrity.IntegrityError):
+            integrity.verify_manifest_signature(self.manifest, self.public_key)
+
+    def test_no_key_means_unsigned(self):
+        self.assertFalse(integrity.verify_manifest_signature(self.manifest, self.public_key + ".missing"))
+
+    def test_signing_a_missing_file_names_it(self):
+        missing = self.manifest + ".missing"
+        with self.assertRaisesRegex(crypto.CryptoError, "manifest.csv.missing"):
+            crypto.sign_files(crypto.Signer.from_file(self.key, jobs=1), [self.manifest, missing])
+
+    def test_build_without_key_removes_stale_signature(self):
+        build.sign_manifest(self.key, self.manifest)
+        self.assertFalse(build.sign_manifest(self.key + ".missing", self.manifest))
+        self.assertFalse(os.path.exists(self.manifest + ".sig"))
+
+
+class StartupCheckTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.build_root = os.path.join(self._tempdir.name, "build-tree")
+        os.makedirs(os.path.join(self.build_root, "build"))
+        self.file = os.path.join(self.build_root, "service.py")
+        with open(self.file, "w") as f:
+            f.write("print('fxetrx')\n")
+        st = os.stat(self.file)
+        with open(self.file, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with open(os.path.join(self.build_root, integrity.MANIFEST_FILE), "w") as f:
+            f.write(f"file_name,sha256_hash,description,size,mtime_ns\n"
+                    f"service.py,{digest},service,{st.st_size},{st.st_mtime_ns}\n")
+        # deployed by a plain copy, so every mtime differs from the build's
+        self.root = os.path.join(self._tempdir.name, "deployed")
+        shutil.copytree(self.build_root, self.root, copy_function=shutil.copyfile)
+        os.utime(os.path.join(self.root, "service.py"), ns=(st.st_mtime_ns + 10**9, st.st_mtime_ns + 10**9))
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def check(self, *argv):
+        return main.check_integrity(main.parse_args(["--root", self.root, *argv]))
+
+    def verify(self):
+        return integrity.verify("fast", os.path.join(self.root, integrity.MANIFEST_FILE), self.root,
+                                public_key_path=os.path.join(self._tempdir.name, "missing.pub"))
+
+    def test_copied_deployment_is_rehashed_not_reported(self):
+        report = self.verify()
+        self.assertEqual(report.problems, [])
+        self.assertEqual(report.hashed, 1)
+
+    def test_same_size_edit_is_caught(self):
+        with open(os.path.join(self.root, "service.py"), "w") as f:
+            f.write("print('evil!')\n")
+        self.assertEqual(len(self.verify().problems), 1)
+
+    def test_manifest_is_found_under_root(self):
+        args = main.parse_args(["--root", self.root])
+        self.assertEqual(os.path.normpath(args.manifest), os.path.join(self.root, "build", "manifest.csv"))
+
+    def test_missing_manifest_only_stops_an_explicit_check(self):
+        os.remove(os.path.join(self.root, integrity.MANIFEST_FILE))
+        self.assertTrue(self.check())
+        self.assertFalse(self.check("--verify", "fast"))
+        self.assertTrue(self.check("--verify", "fast", "--verify-action", "warn"))
+
+
+if __name__ == "__main__":
+    unittest.main()
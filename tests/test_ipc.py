@@ -0,0 +1,118 @@
+# test_ipc.py - the shared-memory ring: wrap-around, and inline frames when it is full; a
+# channel between the core's asyncio end and a worker's blocking end
+#
+#   python -m pytest tests/test_ipc.py
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import ipc  # noqa: E402
+
+RING_SIZE = 4 * ipc.SHM_THRESHOLD + ipc.RING_DATA  # room for four threshold-sized payloads
+
+
+class RingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = ipc.Ring(ipc.create_ring_fd(RING_SIZE))
+        self.addCleanup(os.close, self.ring.fd)
+        self.addCleanup(self.ring.close)
+
+    def roundtrip(self, payload):
+        """Send payload through the ring, as sender and receiver of one direction."""
+        header, body = ipc.encode(ipc.CALL, 1, payload, self.ring)
+        _, flags, _, length = ipc.decode_header(header)
+        self.assertEqual(length, len(body))
+        return flags, ipc.decode_body(flags, body, self.ring)
+
+    def test_large_payload_goes_through_the_ring(self):
+        payload = os.urandom(ipc.SHM_THRESHOLD)
+        flags, received = self.roundtrip(payload)
+        self.assertTrue(flags & ipc.FLAG_SHM)
+        self.assertEqual(received, payload)
+
+    def test_small_payload_is_inline(self):
+        flags, received = self.roundtrip({"args": [1, 2]})
+        self.assertFalse(flags & ipc.FLAG_SHM)
+        self.assertEqual(received, {"args": [1, 2]})
+
+    def test_wraps_around_without_splitting_messages(self):
+        # 1.5 thresholds each: the third one does not fit before the end and starts over at 0
+        payloads = [bytes([i]) * (ipc.SHM_THRESHOLD * 3 // 2) for i in range(12)]
+        positions = []
+        for payload in payloads:
+            header, body = ipc.encode(ipc.RESULT, 1, payload, self.ring)
+            flags = ipc.decode_header(header)[1]
+            self.assertTrue(flags & ipc.FLAG_SHM)
+            positions.append(ipc.SHM_REF.unpack(body)[0])
+            self.assertEqual(ipc.decode_body(flags, body, self.ring), payload)
+        self.assertIn(0, positions[1:])
+        self.assertGreater(self.ring.head, self.ring.size * 2)
+
+    def test_full_ring_falls_back_to_inline_frames(self):
+        payload = os.urandom(ipc.SHM_THRESHOLD)
+        frames = [ipc.encode(ipc.RESULT, i, payload, self.ring) for i in range(5)]
+        flags = [ipc.decode_header(header)[1] for header, _ in frames]
+        # four fit; the receiver has consumed none of them, so the fifth goes inline
+        self.assertEqual([bool(f & ipc.FLAG_SHM) for f in flags], [True] * 4 + [False])
+        for f, (_, body) in zip(flags, frames):
+            self.assertEqual(ipc.decode_body(f, body, self.ring), payload)
+        # everything is consumed now, so the ring takes payloads again
+        header, _ = ipc.encode(ipc.RESULT, 6, payload, self.ring)
+        self.assertTrue(ipc.decode_header(header)[1] & ipc.FLAG_SHM)
+
+    def test_shm_frame_without_ring_is_rejected(self):
+        _, body = ipc.encode(ipc.RESULT, 1, os.urandom(ipc.SHM_THRESHOLD), self.ring)
+        with self.assertRaises(ipc.ChannelError):
+            ipc.decode_body(ipc.FLAG_SHM | ipc.FLAG_RAW, body)
+
+    def test_out_of_bounds_reference_is_rejected(self):
+        with self.assertRaises(ipc.ChannelError):
+            self.ring.get(ipc.SHM_REF.pack(self.ring.size - 10, 20, 0))
+
+
+class ChannelTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sock, send_ring, recv_ring, child_fds = ipc.channel_pair(RING_SIZE)
+        self.worker = ipc.child_channel(*child_fds)
+        self.channel = await ipc.AsyncChannel.connect(sock, send_ring, recv_ring)
+
+    async def asyncTearDown(self):
+        await self.channel.close()
+        self.worker.close()
+
+    def echo(self, count):
+        """The worker's side: answer count calls with their payloads, in its own thread."""
+        def serve():
+            for _ in range(count):
+                _, message_id, payload = self.worker.recv()
+                self.worker.send(ipc.RESULT, message_id, payload)
+        thread = threading.Thread(target=serve)
+        thread.start()
+        return thread
+
+    async def test_calls_round_trip_inline_and_through_the_rings(self):
+        payloads = [{"args": [1, "two"]}, os.urandom(ipc.SHM_THRESHOLD * 2), b"", os.urandom(100)]
+        thread = self.echo(len(payloads))
+        for message_id, payload in enumerate(payloads):
+            await self.channel.send(ipc.CALL, message_id, payload)
+            self.assertEqual(await self.channel.recv(), (ipc.RESULT, message_id, payload))
+        await asyncio.to_thread(thread.join)
+
+    async def test_closed_worker_ends_the_channel(self):
+        self.worker.sock.close()
+        self.assertIsNone(await self.channel.recv())
+
+    async def test_worker_dying_mid_frame_is_an_error(self):
+        header, body = ipc.encode(ipc.RESULT, 1, os.urandom(100))
+        self.worker.sock.sendall(header + body[:10])
+        self.worker.sock.close()
+        with self.assertRaises(ipc.ChannelError):
+            await self.channel.recv()
+
+
+if __name__ == "__main__":
+    unittest.main()
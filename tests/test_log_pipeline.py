@@ -0,0 +1,94 @@
+# test_log_pipeline.py - the log writer and the lag monitor stay asleep while the service is idle
+#
+#   python -m pytest tests/test_log_pipeline.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import log_pipeline, metrics  # noqa: E402
+
+
+class _CountingEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.timed_waits = 0
+
+    def wait(self, timeout=None):
+        if timeout is not None:
+            self.timed_waits += 1
+        return super().wait(timeout)
+
+
+class _Output:
+    def __init__(self):
+        self.lines = []
+        self.written = threading.Event()
+
+    def write(self, text):
+        self.lines.extend(text.splitlines())
+        self.written.set()
+
+    def close(self):
+        pass
+
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = log_pipeline.QueueingHandler()
+        self.handler.wake = _CountingEvent()
+        self.output = _Output()
+        self.writer = log_pipeline.LogWriter(self.handler, self.output, log_pipeline.TextFormatter())
+        self.writer.start()
+        self.addCleanup(self.writer.stop)
+
+    def log(self, message):
+        self.handler.handle(logging.LogRecord("test", logging.INFO, __file__, 0, message, (), None))
+
+    def test_idle_writer_runs_no_timer(self):
+        time.sleep(log_pipeline.FLUSH_INTERVAL * 3)
+        self.assertEqual(self.handler.wake.timed_waits, 0)
+
+    def test_record_is_written_after_the_flush_interval(self):
+        time.sleep(0.05)  # let the writer go to sleep
+        self.log("first")
+        self.assertTrue(self.output.written.wait(log_pipeline.FLUSH_INTERVAL * 10))
+        self.assertTrue(self.output.lines[0].endswith("first"))
+        time.sleep(log_pipeline.FLUSH_INTERVAL * 3)
+        self.assertEqual(self.handler.wake.timed_waits, 1)  # asleep again once the queue is empty
+
+    def test_stop_writes_out_the_queue(self):
+        self.log("last")
+        self.writer.stop()
+        self.assertTrue(self.output.lines[-1].endswith("last"))
+
+
+class LoopLagMonitorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.monitor = metrics.LoopLagMonitor(metrics.Registry().histogram("lag", "lag"), interval=0.01)
+        await self.monitor.start()
+
+    async def asyncTearDown(self):
+        await self.monitor.stop()
+
+    async def test_idle_monitor_has_no_timer(self):
+        await asyncio.sleep(0.05)
+        self.assertIsNone(self.monitor._handle)
+        self.assertEqual(self.monitor.histogram.snapshot()[2], 0)
+
+    async def test_probes_while_requests_come_in(self):
+        for _ in range(5):
+            self.monitor.activity()
+            await asyncio.sleep(0.01)
+        self.assertGreater(self.monitor.histogram.snapshot()[2], 0)
+        await asyncio.sleep(0.05)
+        self.assertIsNone(self.monitor._handle)  # an interval without requests disarms it
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# test_metrics.py - Prometheus text rendering, per-thread counter shards, and process gauges
+# where the resource module is missing
+#
+#   python -m pytest tests/test_metrics.py
+import math
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import metrics  # noqa: E402
+
+
+class ShardTest(unittest.TestCase):
+    def test_counts_from_many_threads_add_up(self):
+        counter = metrics.Counter()
+
+        def work():
+            for _ in range(10000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value, 80000)  # the shards of finished threads still count
+
+    def test_histogram_snapshot_is_cumulative(self):
+        histogram = metrics.Histogram(buckets=(1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), ([2, 3, 4], 11.5, 4))
+
+
+class RenderTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def lines(self):
+        return self.registry.render().splitlines()
+
+    def test_counter_with_labels(self):
+        requests = self.registry.counter("fxetrx_requests_total", "Requests", labels=("path",))
+        requests.labels("/status").inc(3)
+        requests.labels('/a"b\\c').inc()
+        self.assertEqual(self.lines(), [
+            "# HELP fxetrx_requests_total Requests",
+            "# TYPE fxetrx_requests_total counter",
+            'fxetrx_requests_total{path="/status"} 3',
+            'fxetrx_requests_total{path="/a\\"b\\\\c"} 1',
+        ])
+
+    def test_unlabelled_family_stands_for_its_child(self):
+        errors = self.registry.counter("fxetrx_errors_total", "Errors")
+        errors.inc()
+        errors.inc()
+        self.assertIn("fxetrx_errors_total 2", self.lines())
+
+    def test_histogram(self):
+        latency = self.registry.histogram("fxetrx_latency_seconds", "Latency", buckets=(0.1, 1))
+        latency.observe(0.05)
+        latency.observe(2)
+        self.assertEqual(self.lines()[2:], [
+            'fxetrx_latency_seconds_bucket{le="0.1"} 1',
+            'fxetrx_latency_seconds_bucket{le="1"} 1',
+            'fxetrx_latency_seconds_bucket{le="+Inf"} 2',
+            "fxetrx_latency_seconds_sum 2.05",
+            "fxetrx_latency_seconds_count 2",
+        ])
+
+    def test_gauges_are_read_at_scrape_time(self):
+        depth = [1]
+        self.registry.gauge("fxetrx_queue_depth", "Queued", lambda: depth[0])
+        self.registry.gauge("fxetrx_plugin_rss_bytes", "RSS", lambda: {("a",): 10, ("b",): None},
+                            labels=("plugin",))
+        depth[0] = 4
+        lines = self.lines()
+        self.assertIn("fxetrx_queue_depth 4", lines)
+        self.assertIn('fxetrx_plugin_rss_bytes{plugin="a"} 10', lines)
+        self.assertIn('fxetrx_plugin_rss_bytes{plugin="b"} NaN', lines)
+
+    def test_failing_gauge_is_skipped(self):
+        self.registry.gauge("fxetrx_broken", "Broken", lambda: 1 / 0)
+        self.registry.gauge("fxetrx_fine", "Fine", lambda: math.inf)
+        self.assertEqual(self.lines(), ["# fxetrx_broken unavailable: ZeroDivisionError",
+                                        "# HELP fxetrx_fine Fine", "# TYPE fxetrx_fine gauge", "fxetrx_fine +Inf"])
+
+
+class ProcessMetricsTest(unittest.TestCase):
+    def names(self, registry):
+        return [name for name, *_ in registry.gauges]
+
+    def test_cpu_and_memory_where_resource_is_available(self):
+        registry = metrics.Registry()
+        metrics.process_metrics(registry)
+        self.assertIn("fxetrx_process_cpu_seconds_total", self.names(registry))
+        self.assertIn("fxetrx_process_cpu_seconds_total ", registry.render())
+
+    def test_without_resource_only_threads_are_reported(self):
+        registry = metrics.Registry()
+        with mock.patch.object(metrics, "resource", None):
+            metrics.process_metrics(registry)
+        self.assertEqual(self.names(registry), ["fxetrx_process_threads"])
+        self.assertNotIn("unavailable", registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# test_net.py - responses to HEAD requests on keep-alive and pipelined connections; end of streams
+#
+#   python -m pytest tests/test_net.py
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.net import RequestServer, Response, StreamingResponse  # noqa: E402
+
+BODY = b'{"status": "running"}'
+
+
+async def _chunks():
+    yield b'{"a": 1}\n'
+    yield b'{"b": 2}\n'
+
+
+done = []  # paths of the streams whose on_done was called
+
+
+async def _handler(request):
+    if request.path == "/stream":
+        response = StreamingResponse(200, _chunks(), "application/x-ndjson")
+        response.on_done = lambda: done.append(request.path)
+        return response
+    return Response(200, BODY)
+
+
+async def _read_response(reader, head_only=False):
+    """(status line, headers, body) of one response; a HEAD reply has headers only."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head[:-4].decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, value in (line.split(":", 1) for line in lines[1:])}
+    if head_only:
+        return lines[0], headers, b""
+    if headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                return lines[0], headers, body
+            body += chunk[:-2]
+    return lines[0], headers, await reader.readexactly(int(headers["content-length"]))
+
+
+class _ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = RequestServer(_handler, port=0)
+        await self.server.start()
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.server.stop()
+
+    async def _pipeline(self, *requests):
+        self.writer.write(b"".join(f"{method} {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode()
+                                   for method, path in requests))
+        return [await asyncio.wait_for(_read_response(self.reader, method == "HEAD"), 5)
+                for method, path in requests]
+
+
+class HeadTest(_ServerTest):
+    async def test_head_keeps_content_length_without_body(self):
+        (head_status, head_headers, _), (status, headers, body) = await self._pipeline(("HEAD", "/"), ("GET", "/"))
+        self.assertEqual(head_status, "HTTP/1.1 200 OK")
+        self.assertEqual(head_headers["content-length"], str(len(BODY)))
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(body, BODY)
+
+    async def test_head_of_stream_sends_no_chunks(self):
+        (head_status, _, _), (_, _, body) = await self._pipeline(("HEAD", "/stream"), ("GET", "/"))
+        self.assertEqual(head_status, "HTTP/1.1 200 OK")
+        self.assertEqual(body, BODY)
+
+    async def test_stream_after_head(self):
+        _, (_, headers, body) = await self._pipeline(("HEAD", "/"), ("GET", "/stream"))
+        self.assertEqual(headers["transfer-encoding"], "chunked")
+        self.assertEqual(body, b'{"a": 1}\n{"b": 2}\n')
+
+
+class StreamDoneTest(_ServerTest):
+    async def test_on_done_after_the_last_chunk(self):
+        done.clear()
+        (_, _, body), = await self._pipeline(("GET", "/stream"))
+        self.assertEqual(body, b'{"a": 1}\n{"b": 2}\n')
+        self.assertEqual(done, ["/stream"])
+
+    async def test_on_done_for_head(self):
+        done.clear()
+        await self._pipeline(("HEAD", "/stream"), ("GET", "/"))
+        self.assertEqual(done, ["/stream"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# test_plugin_index.py - the build's plugin index, and plugins started on first use from it
+#
+#   python -m pytest tests/test_plugin_index.py
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build import build  # noqa: E402
+from src import plugin_pool  # noqa: E402
+from src.plugin_index import PLUGIN_INDEX_VERSION, load_plugin_index  # noqa: E402
+from src.plugin_pool import PluginError, PluginPools  # noqa: E402
+
+
+class _FakePool:
+    """Stands in for WorkerPool: records starts instead of spawning interpreters."""
+
+    started = []
+    fail = False
+
+    def __init__(self, path, module=None, python=None, **options):
+        self.path, self.module, self.python = path, module, python
+        self.name = os.path.basename(path)
+
+    async def start(self):
+        await asyncio.sleep(0.01)
+        if _FakePool.fail:
+            raise OSError("no interpreter")
+        _FakePool.started.append(self.name)
+
+    async def stop(self):
+        pass
+
+
+class PluginIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        self.plugins = os.path.join(self.root, "plugins")
+        self.index_file = os.path.join(self.root, "plugin_index.json")
+        self.add_plugin("reports", {"module": "main", "entry_points": ["render"], "capabilities": ["pdf"]})
+        self.add_plugin("plain", None)
+        os.makedirs(os.path.join(self.plugins, ".hidden"))
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def add_plugin(self, name, manifest, source="def render():\n    return 1\n"):
+        path = os.path.join(self.plugins, name)
+        os.makedirs(path)
+        if manifest is not None:
+            with open(os.path.join(path, "manifest.json"), "w") as f:
+                f.write(manifest if isinstance(manifest, str) else json.dumps(manifest))
+        with open(os.path.join(path, "plugin.py"), "w") as f:
+            f.write(source)
+        return path
+
+    def build_index(self):
+        return build.build_plugin_index(self.plugins, self.index_file, jobs=1,
+                                        cache_file=os.path.join(self.root, "hash_cache.json"))
+
+    def test_index_records_every_plugin(self):
+        self.add_plugin("broken", "{not json")
+        self.build_index()
+        index = load_plugin_index(self.index_file)
+        self.assertEqual(sorted(index), ["plain", "reports"])
+        self.assertEqual(index["reports"]["module"], "main")
+        self.assertEqual(index["reports"]["capabilities"], ["pdf"])
+        self.assertEqual(index["plain"]["module"], "plugin")
+        self.assertIsNone(index["plain"]["venv_python"])
+
+    def test_tree_digest_follows_the_sources(self):
+        before = self.build_index()["plugins"]["reports"]["tree_sha256"]
+        with open(os.path.join(self.plugins, "reports", "plugin.py"), "a") as f:
+            f.write("# edited\n")
+        self.assertNotEqual(self.build_index()["plugins"]["reports"]["tree_sha256"], before)
+
+    def test_missing_or_other_version_is_no_index(self):
+        self.assertIsNone(load_plugin_index(self.index_file))
+        with open(self.index_file, "w") as f:
+            json.dump({"version": PLUGIN_INDEX_VERSION + 1, "plugins": {}}, f)
+        self.assertIsNone(load_plugin_index(self.index_file))
+
+
+class LazyStartTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.root = self._tempdir.name
+        self.plugins = os.path.join(self.root, "plugins")
+        os.makedirs(os.path.join(self.plugins, "reports"))
+        self.index_file = os.path.join(self.root, "plugin_index.json")
+        with open(self.index_file, "w") as f:
+            json.dump({"version": PLUGIN_INDEX_VERSION, "plugins": {
+                "reports": {"module": "main", "venv_python": "venv/bin/python"}}}, f)
+        _FakePool.started, _FakePool.fail = [], False
+        patcher = mock.patch.object(plugin_pool, "WorkerPool", _FakePool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logging.disable(logging.ERROR)
+        self.pools = PluginPools(self.plugins, index_file=self.index_file)
+        await self.pools.start()
+
+    async def asyncTearDown(self):
+        await self.pools.stop()
+        logging.disable(logging.NOTSET)
+        self._tempdir.cleanup()
+
+    async def test_nothing_starts_until_called(self):
+        self.assertEqual(self.pools.available, ["reports"])
+        self.assertEqual(_FakePool.started, [])
+        self.assertFalse(self.pools.describe("reports")["started"])
+
+    async def test_concurrent_first_calls_share_one_start(self):
+        pools = await asyncio.gather(*(self.pools.pool("reports") for _ in range(5)))
+        self.assertEqual(_FakePool.started, ["reports"])
+        self.assertTrue(all(pool is pools[0] for pool in pools))
+        self.assertEqual(pools[0].module, "main")
+        self.assertEqual(pools[0].python, os.path.join(self.plugins, "reports", "venv/bin/python"))
+
+    async def test_failed_start_is_retried_on_the_next_call(self):
+        _FakePool.fail = True
+        with self.assertRaises(PluginError):
+            await self.pools.pool("reports")
+        _FakePool.fail = False
+        await self.pools.pool("reports")
+        self.assertEqual(_FakePool.started, ["reports"])
+
+    async def test_unknown_plugin_is_rejected(self):
+        for name in ("missing", "../reports", ".hidden"):
+            with self.subTest(name=name):
+                with self.assertRaises(PluginError):
+                    await self.pools.pool(name)
+
+    async def test_plugin_installed_after_the_index_is_accepted(self):
+        os.makedirs(os.path.join(self.plugins, "late"))
+        await self.pools.pool("late")
+        self.assertEqual(_FakePool.started, ["late"])
+
+    async def test_without_an_index_the_directory_is_listed(self):
+        os.remove(self.index_file)
+        pools = PluginPools(self.plugins, index_file=self.index_file)
+        await pools.start()
+        self.assertEqual(pools.available, ["reports"])
+        await pools.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# test_plugin_pool.py - what plugin workers can import, and replacing workers that fail
+#
+#   python -m pytest tests/test_plugin_pool.py
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+import venv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.plugin_pool import PluginError, WorkerPool  # noqa: E402
+from src.plugin_venv_setup import venv_paths  # noqa: E402
+
+PLUGIN_SOURCE = """
+import importlib.util
+import sys
+
+import metrics
+import plugin_api
+
+
+def metrics_source():
+    return metrics.SOURCE
+
+
+def service_modules(names):
+    return [name for name in names if importlib.util.find_spec(name) is not None]
+
+
+def has_plugin_api():
+    return callable(plugin_api.get_secret)
+"""
+
+# modules of the service that plugin code must not see
+SERVICE_MODULES = ["config", "crypto", "scheduler", "api", "net", "bundle", "main", "secret_cache"]
+
+
+class WorkerImportTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tempdir = tempfile.TemporaryDirectory()
+        cls.plugin = os.path.join(cls._tempdir.name, "shadowing")
+        os.makedirs(cls.plugin)
+        with open(os.path.join(cls.plugin, "manifest.json"), "w") as f:
+            json.dump({"module": "plugin"}, f)
+        with open(os.path.join(cls.plugin, "plugin.py"), "w") as f:
+            f.write(PLUGIN_SOURCE)
+        # the plugin depends on a PyPI package with the same name as one of the service's modules
+        venv_path = os.path.join(cls.plugin, "venv")
+        venv.create(venv_path, with_pip=False)
+        with open(os.path.join(venv_paths(venv_path)[0], "metrics.py"), "w") as f:
+            f.write('SOURCE = "plugin venv"\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tempdir.cleanup()
+
+    async def asyncSetUp(self):
+        self.pool = WorkerPool(self.plugin, min_workers=1, max_workers=1)
+        await self.pool.start()
+
+    async def asyncTearDown(self):
+        await self.pool.stop()
+
+    async def test_venv_package_wins_over_service_module(self):
+        self.assertEqual(await self.pool.call("metrics_source"), "plugin venv")
+
+    async def test_service_modules_are_not_importable(self):
+        self.assertEqual(await self.pool.call("service_modules", SERVICE_MODULES), [])
+
+    async def test_plugin_api_is_importable(self):
+        self.assertTrue(await self.pool.call("has_plugin_api"))
+
+
+class _DeadWorker:
+    pid = 0
+
+    def __init__(self):
+        self.closed = False
+
+    def cpu(self):
+        return 0.0
+
+    async def close(self):
+        await asyncio.sleep(0)
+        self.closed = True
+
+
+class RetireTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_replacement_fails_waiters(self):
+        pool = WorkerPool("/nonexistent/plugin", min_workers=1, max_workers=1, module="plugin",
+                          python=sys.executable)
+
+        async def spawn():
+            raise OSError("no such interpreter")
+
+        pool._spawn = spawn
+        pool._size = 1
+        waiter = asyncio.get_running_loop().create_future()
+        pool._waiters.append(waiter)
+        logging.disable(logging.ERROR)
+        try:
+            await pool._retire(_DeadWorker())
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(pool.size, 0)
+        with self.assertRaisesRegex(PluginError, "no such interpreter"):
+            await waiter
+
+    async def test_failed_start_closes_the_workers_that_started(self):
+        pool = WorkerPool("/nonexistent/plugin", min_workers=3, max_workers=3, module="plugin",
+                          python=sys.executable)
+        started, calls = [], []
+
+        async def spawn():
+            calls.append(None)
+            if len(calls) == 2:
+                raise OSError("no such interpreter")
+            worker = _DeadWorker()
+            started.append(worker)
+            return worker
+
+        pool._spawn = spawn
+        with self.assertRaisesRegex(OSError, "no such interpreter"):
+            await pool.start()
+        self.assertEqual(len(started), 2)
+        self.assertTrue(all(worker.closed for worker in started))
+
+    async def test_background_retires_are_kept_until_done(self):
+        pool = WorkerPool("/nonexistent/plugin", min_workers=0, max_workers=1, module="plugin",
+                          python=sys.executable)
+        worker = _DeadWorker()
+        pool._workers.add(worker)
+        pool._size = 1
+        pool._closed = True
+        pool._release(worker)  # a closed pool retires the worker in the background
+        self.assertEqual(len(pool._tasks), 1)
+        await pool.stop()
+        self.assertTrue(worker.closed)
+        self.assertEqual(len(pool._tasks), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# test_plugin_venv_setup.py - storing the same wheel from several plugins at once; skipping
+# venvs whose requirements fingerprint is unchanged
+#
+#   python -m pytest tests/test_plugin_venv_setup.py
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import plugin_venv_setup  # noqa: E402
+from src.plugin_venv_setup import WheelStore, requirement_names  # noqa: E402
+
+WHEEL = "shared_dep-1.0-py3-none-any.whl"
+PLUGINS = 8
+
+
+class _SlowStore(WheelStore):
+    """Records how many threads unpack the same digest at once."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.unpacking = 0
+        self.most_at_once = 0
+
+    def _add(self, wheel_path, digest):
+        self.unpacking += 1
+        self.most_at_once = max(self.most_at_once, self.unpacking)
+        time.sleep(0.01)
+        try:
+            super()._add(wheel_path, digest)
+        finally:
+            self.unpacking -= 1
+
+
+class WheelStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        self.wheel = os.path.join(self.root, WHEEL)
+        with zipfile.ZipFile(self.wheel, "w") as wheel:
+            wheel.writestr("shared_dep/__init__.py", "VALUE = 1\n")
+            wheel.writestr("shared_dep-1.0.dist-info/RECORD", "")
+
+    def download(self, plugin):
+        """A copy of the wheel in the plugin's own download directory, as pip leaves it."""
+        directory = os.path.join(self.root, "downloads", str(plugin))
+        os.makedirs(directory)
+        return shutil.copy(self.wheel, directory)
+
+    def test_concurrent_adds_unpack_one_at_a_time(self):
+        store = _SlowStore(os.path.join(self.root, "store"))
+        wheels = [self.download(plugin) for plugin in range(PLUGINS)]
+        digests = []
+        threads = [threading.Thread(target=lambda path=path: digests.append(store.add(path))) for path in wheels]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.most_at_once, 1)
+        self.assertEqual(len(set(digests)), 1)
+        self.assertTrue(os.path.isfile(os.path.join(store.tree(digests[0]), "shared_dep", "__init__.py")))
+        self.assertEqual(os.listdir(store.wheelhouse), [WHEEL])
+
+    def test_one_lock_per_digest(self):
+        store = WheelStore(os.path.join(self.root, "store"))
+        self.assertIs(store.wheel_lock("a" * 64), store.wheel_lock("a" * 64))
+        self.assertIsNot(store.wheel_lock("a" * 64), store.wheel_lock("b" * 64))
+
+
+def _make_wheel(directory, name):
+    path = os.path.join(directory, f"{name}-1.0-py3-none-any.whl")
+    with zipfile.ZipFile(path, "w") as wheel:
+        wheel.writestr(f"{name}/__init__.py", f"NAME = {name!r}\n")
+        wheel.writestr(f"{name}-1.0.dist-info/RECORD", "")
+    return path
+
+
+class _LocalStore(WheelStore):
+    """Fetches from a directory of prebuilt wheels instead of running pip, and counts the fetches."""
+
+    def __init__(self, root, index):
+        super().__init__(root)
+        self.index = index
+        self.fetches = 0
+
+    def fetch(self, requirements_file, dest):
+        self.fetches += 1
+        return [shutil.copy(self.index[name], dest) for name in sorted(requirement_names(requirements_file))]
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        wheels = os.path.join(self.root, "index")
+        os.makedirs(wheels)
+        self.store = _LocalStore(os.path.join(self.root, "store"),
+                                 {name: _make_wheel(wheels, name) for name in ("alpha", "beta")})
+        self.plugin = os.path.join(self.root, "plugins", "example")
+        os.makedirs(self.plugin)
+        self.site_packages = plugin_venv_setup.venv_paths(os.path.join(self.plugin, "venv"))[0]
+
+    def require(self, *names):
+        with open(os.path.join(self.plugin, "requirements.txt"), "w") as f:
+            f.write("".join(f"{name}\n" for name in names))
+
+    def setup_venv(self):
+        return plugin_venv_setup.setup_plugin_venv(self.plugin, self.store)
+
+    def installed(self, name):
+        return os.path.exists(os.path.join(self.site_packages, name, "__init__.py"))
+
+    def test_unchanged_requirements_are_skipped(self):
+        self.require("alpha")
+        self.assertFalse(self.setup_venv().skipped)
+        self.assertTrue(self.setup_venv().skipped)
+        self.assertEqual(self.store.fetches, 1)
+        self.assertTrue(self.installed("alpha"))
+
+    def test_changed_requirements_link_only_the_difference(self):
+        self.require("alpha")
+        self.setup_venv()
+        self.require("beta")
+        report = self.setup_venv()
+        self.assertFalse(report.skipped)
+        self.assertEqual(self.store.fetches, 2)
+        self.assertFalse(self.installed("alpha"))
+        self.assertTrue(self.installed("beta"))
+        self.assertEqual(report.removed, 3)  # its module, RECORD and INSTALLER
+
+    def test_interpreter_change_rebuilds_the_venv(self):
+        self.require("alpha")
+        self.setup_venv()
+        marker = os.path.join(self.plugin, "venv", "left-over")
+        open(marker, "w").close()
+        with mock.patch.object(plugin_venv_setup, "interpreter_fingerprint", return_value="other python"):
+            self.assertFalse(self.setup_venv().skipped)
+        self.assertFalse(os.path.exists(marker))
+        self.assertTrue(self.installed("alpha"))
+
+    def test_incomplete_venv_is_not_skipped(self):
+        self.require("alpha")
+        with mock.patch.object(plugin_venv_setup, "write_fingerprint", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.setup_venv()
+        self.assertFalse(self.setup_venv().skipped)
+
+    def test_no_requirements_file(self):
+        self.assertFalse(self.setup_venv().skipped)
+        self.assertTrue(self.setup_venv().skipped)
+        self.assertEqual(self.store.fetches, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
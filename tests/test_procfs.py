@@ -0,0 +1,158 @@
+# test_procfs.py - service state from a fake /proc, cgroup hierarchy and unit directory;
+# the unit's ActiveState from a fake system bus
+#
+#   python -m pytest tests/test_procfs.py
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+sys.path.insert(0, TESTS)
+
+from bench_status import build_fake_tree  # noqa: E402
+from service import procfs  # noqa: E402
+
+SERVICE_PID = 5
+
+
+class ServiceStateTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        self.proc_root, self.cgroup_root, self.pidfile = build_fake_tree(self.root, 10, SERVICE_PID)
+        self.unit_dir = os.path.join(self.root, "units")
+        os.makedirs(self.unit_dir)
+        self.asked = []
+
+    def install_unit(self):
+        open(os.path.join(self.unit_dir, procfs.SYSTEMD_UNIT), "w").close()
+
+    def stop_service(self):
+        with open(os.path.join(self.cgroup_root, "system.slice", procfs.SYSTEMD_UNIT, "cgroup.procs"), "w"):
+            pass
+        os.remove(self.pidfile)
+
+    def state(self, systemd_says=None):
+        def active_state(unit):
+            self.asked.append(unit)
+            return systemd_says
+        return procfs.service_state(self.pidfile, procfs.SYSTEMD_UNIT, self.proc_root, self.cgroup_root,
+                                    (self.unit_dir,), active_state)
+
+    def test_running_does_not_ask_systemd(self):
+        self.install_unit()
+        self.assertEqual(self.state("failed"), "running")
+        self.assertEqual(self.asked, [])
+
+    def test_failed_unit_is_reported(self):
+        self.install_unit()
+        self.stop_service()
+        self.assertEqual(self.state("failed"), "failed")
+
+    def test_inactive_unit_is_stopped(self):
+        self.install_unit()
+        self.stop_service()
+        self.assertEqual(self.state("inactive"), "stopped")
+
+    def test_without_systemctl_is_stopped(self):
+        self.install_unit()
+        self.stop_service()
+        self.assertEqual(self.state(None), "stopped")
+
+    def test_not_installed(self):
+        self.stop_service()
+        self.assertEqual(self.state("failed"), "not installed")
+        self.assertEqual(self.asked, [])
+
+
+def _variant_string(value):
+    body = bytearray()
+    procfs._put_string(body, "g", "s")
+    procfs._put_string(body, "s", value)
+    return bytes(body)
+
+
+class FakeSystemBus:
+    """Answers Hello and Properties.Get(ActiveState) the way dbus-daemon and systemd do."""
+
+    def __init__(self, path, states):
+        self.states, self.asked = states, []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        with self.server.accept()[0] as sock:
+            data = b""
+            while b"BEGIN\r\n" not in data:
+                data += sock.recv(256)
+                if data.startswith(b"\0AUTH EXTERNAL ") and data.endswith(b"\r\n"):
+                    sock.sendall(b"OK 0123456789abcdef0123456789abcdef\r\n")
+            # what followed BEGIN in the same read is the start of the first message
+            buffered = _Buffered(sock, data[data.index(b"BEGIN\r\n") + 7:])
+            for _ in range(2):
+                _, serial, fields, body = procfs.read_dbus_message(buffered)
+                if fields[3] == "Hello":
+                    reply = bytearray()
+                    procfs._put_string(reply, "s", ":1.42")
+                    sock.sendall(procfs.dbus_message(2, 1, [(5, "u", serial), (8, "g", "s")], bytes(reply)))
+                    continue
+                self.asked.append((fields[1], body.string("s"), body.string("s")))
+                unit_path = fields[1].rsplit("/", 1)[1]
+                if unit_path in self.states:
+                    sock.sendall(procfs.dbus_message(2, 2, [(5, "u", serial), (8, "g", "v")],
+                                                     _variant_string(self.states[unit_path])))
+                else:
+                    sock.sendall(procfs.dbus_message(3, 2, [(4, "s", "org.freedesktop.DBus.Error.AccessDenied"),
+                                                            (5, "u", serial)]))
+
+    def close(self):
+        self.server.close()
+        self.thread.join(1)
+
+
+class _Buffered:
+    def __init__(self, sock, data):
+        self.sock, self.data = sock, data
+
+    def recv(self, size):
+        if self.data:
+            chunk, self.data = self.data[:size], self.data[size:]
+            return chunk
+        return self.sock.recv(size)
+
+
+class ActiveStateTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.bus_path = os.path.join(self._tempdir.name, "system_bus_socket")
+
+    def serve(self, states):
+        bus = FakeSystemBus(self.bus_path, states)
+        self.addCleanup(bus.close)
+        return bus
+
+    def test_active_state_comes_from_systemd(self):
+        bus = self.serve({"fxetrx_2eservice": "failed"})
+        self.assertEqual(procfs.unit_active_state("fxetrx.service", self.bus_path), "failed")
+        self.assertEqual(bus.asked, [("/org/freedesktop/systemd1/unit/fxetrx_2eservice",
+                                      "org.freedesktop.systemd1.Unit", "ActiveState")])
+
+    def test_error_reply_is_unknown(self):
+        self.serve({})
+        self.assertIsNone(procfs.unit_active_state("fxetrx.service", self.bus_path))
+
+    def test_without_a_system_bus_is_unknown(self):
+        self.assertIsNone(procfs.unit_active_state("fxetrx.service", self.bus_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
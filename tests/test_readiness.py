@@ -0,0 +1,127 @@
+# test_readiness.py - sd_notify datagrams, the state socket and waiting for a state
+#
+#   python -m pytest tests/test_readiness.py
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import readiness  # noqa: E402
+
+# a service whose one component takes 0.2s to start, run until SIGTERM
+SERVICE_SCRIPT = """
+import asyncio, sys
+from src.readiness import ServiceNotifier
+from src.service_template import CrossPlatformService
+
+class SlowStart:
+    async def start(self):
+        await asyncio.sleep(0.2)
+
+    async def stop(self):
+        pass
+
+CrossPlatformService([SlowStart()], ServiceNotifier(sys.argv[1], sys.argv[2])).run_forever()
+"""
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "unix sockets")
+class ReadinessTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.root = self._tempdir.name
+        self.pidfile = os.path.join(self.root, "run", "fxetrx.pid")
+        self.state_socket = os.path.join(self.root, "run", "state.sock")
+        self.notify_path = os.path.join(self.root, "notify")
+        self.systemd = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.systemd.bind(self.notify_path)
+        self.systemd.settimeout(1)
+        self.addCleanup(self.systemd.close)
+
+    def notifications(self):
+        messages = []
+        self.systemd.setblocking(False)
+        try:
+            while True:
+                messages.append(self.systemd.recv(4096).decode())
+        except BlockingIOError:
+            return messages
+
+    def test_sd_notify_without_systemd(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertFalse(readiness.sd_notify("READY=1"))
+
+    def test_sd_notify_sends_one_datagram(self):
+        with mock.patch.dict(os.environ, {"NOTIFY_SOCKET": self.notify_path}):
+            self.assertTrue(readiness.sd_notify("READY=1"))
+        self.assertEqual(self.systemd.recv(4096), b"READY=1")
+
+    def test_lifecycle_is_published(self):
+        with mock.patch.dict(os.environ, {"NOTIFY_SOCKET": self.notify_path}):
+            notifier = readiness.ServiceNotifier(self.pidfile, self.state_socket)
+            self.assertNotIn("NOTIFY_SOCKET", os.environ)  # not passed on to plugin workers
+        lines = []
+
+        async def lifecycle():
+            await notifier.starting()
+            with open(self.pidfile) as f:
+                self.assertEqual(int(f.read()), os.getpid())
+            reader, writer = await asyncio.open_unix_connection(self.state_socket)
+            lines.append(await reader.readline())
+            await notifier.ready()
+            lines.append(await reader.readline())
+            await notifier.stopping()
+            lines.append(await reader.readline())
+            await notifier.stopped()
+            lines.append(await reader.read())  # closed once everything has stopped
+            writer.close()
+
+        asyncio.run(lifecycle())
+        pid = os.getpid()
+        self.assertEqual(lines, [f"starting {pid}\n".encode(), f"ready {pid}\n".encode(),
+                                 f"stopping {pid}\n".encode(), b""])
+        self.assertEqual(self.notifications(), [f"READY=1\nSTATUS=Serving\nMAINPID={pid}",
+                                                "STOPPING=1\nSTATUS=Stopping"])
+        self.assertFalse(os.path.exists(self.pidfile))
+        self.assertFalse(os.path.exists(self.state_socket))
+
+    @unittest.skipUnless(hasattr(signal, "SIGTERM") and os.name == "posix", "POSIX signals")
+    def test_wait_for_ready_and_stopped(self):
+        service = subprocess.Popen([sys.executable, "-c", SERVICE_SCRIPT, self.pidfile, self.state_socket],
+                                   cwd=ROOT, env={k: v for k, v in os.environ.items() if k != "NOTIFY_SOCKET"})
+        self.addCleanup(service.wait)
+        self.addCleanup(service.kill)
+        start = time.monotonic()
+        self.assertEqual(readiness.wait_for_state("ready", 10, self.state_socket, self.pidfile), "ready")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(readiness.query_state(self.state_socket, self.pidfile), "ready")
+        service.terminate()
+        self.assertEqual(readiness.wait_for_state("stopped", 10, self.state_socket, self.pidfile), "stopped")
+        self.assertIsNotNone(service.poll())
+
+    def test_waiting_for_a_service_that_never_starts_times_out(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        start = time.monotonic()
+        self.assertEqual(readiness.wait_for_state("ready", 0.2, self.state_socket, self.pidfile), "stopped")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(readiness.query_state(self.state_socket, self.pidfile), "stopped")
+
+    def test_only_ready_or_stopped_can_be_waited_for(self):
+        with self.assertRaises(ValueError):
+            readiness.wait_for_state("stopping", 1, self.state_socket, self.pidfile)
+
+
+if __name__ == "__main__":
+    unittest.main()
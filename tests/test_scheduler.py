@@ -0,0 +1,124 @@
+# test_scheduler.py - timing wheel placement, cascading, cancellation and recurring jobs
+#
+#   python -m pytest tests/test_scheduler.py
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.scheduler import LEVELS, WHEEL_SIZE, Scheduler  # noqa: E402
+
+HORIZON = WHEEL_SIZE ** LEVELS  # ticks the wheels cover
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        # one tick per clock unit; not started, so advance() drives it
+        self.scheduler = Scheduler(tick=1.0, clock=lambda: self.now)
+        self.fired = []
+
+    def record(self, name):
+        self.fired.append((name, self.now))
+
+    def advance_to(self, t):
+        self.now = t
+        return self.scheduler.advance()
+
+    def test_fires_on_its_tick_not_before(self):
+        self.scheduler.schedule(self.record, 10, "a")
+        self.assertEqual(self.advance_to(9), 0)
+        self.assertEqual(self.advance_to(10), 1)
+        self.assertEqual(self.fired, [("a", 10)])
+        self.assertEqual(self.scheduler.jobs, 0)
+        self.assertIsNone(self.scheduler.next_deadline())
+
+    def test_random_jobs_cascade_down_and_fire_on_time(self):
+        rng = random.Random(1)
+        deadlines = {}
+        for i in range(2000):
+            # spread over every level: up to three revolutions of the third wheel
+            delay = rng.choice((rng.randrange(WHEEL_SIZE), rng.randrange(WHEEL_SIZE ** 2),
+                                rng.randrange(3 * WHEEL_SIZE ** 3)))
+            deadlines[i] = delay
+            self.scheduler.schedule(self.record, delay, i)
+        while self.scheduler.jobs:
+            self.advance_to(self.scheduler.next_deadline())
+        self.assertEqual(len(self.fired), 2000)
+        late = [(i, at, deadlines[i]) for i, at in self.fired if at != deadlines[i]]
+        self.assertEqual(late, [])
+
+    def test_next_deadline_only_ever_moves_to_a_due_job(self):
+        # stepping from one next_deadline() to the next may land on cascade points, never past a job
+        self.scheduler.schedule(self.record, WHEEL_SIZE ** 2 + 3, "far")
+        self.scheduler.schedule(self.record, 5, "near")
+        steps = 0
+        while self.scheduler.jobs:
+            self.advance_to(self.scheduler.next_deadline())
+            steps += 1
+        self.assertEqual(self.fired, [("near", 5), ("far", WHEEL_SIZE ** 2 + 3)])
+        self.assertLess(steps, 10)
+
+    def test_past_the_horizon(self):
+        delay = HORIZON + 12345
+        self.scheduler.schedule(self.record, delay, "late")
+        self.advance_to(HORIZON)
+        self.assertEqual(self.fired, [])
+        self.advance_to(delay - 1)
+        self.assertEqual(self.fired, [])
+        self.advance_to(delay)
+        self.assertEqual(self.fired, [("late", delay)])
+
+    def test_cancel(self):
+        job = self.scheduler.schedule(self.record, WHEEL_SIZE * 3, "cancelled")
+        self.scheduler.schedule(self.record, WHEEL_SIZE * 3, "kept")
+        job.cancel()
+        job.cancel()  # twice is fine
+        self.assertEqual(self.scheduler.jobs, 1)
+        self.assertFalse(job.scheduled)
+        self.advance_to(WHEEL_SIZE * 3)
+        self.advance_to(WHEEL_SIZE * 4)
+        self.assertEqual(self.fired, [("kept", WHEEL_SIZE * 3)])
+
+    def test_cancelled_by_a_job_due_in_the_same_tick(self):
+        b = None
+        self.scheduler.schedule(lambda: (self.record("a"), b.cancel()), 1)
+        b = self.scheduler.schedule(self.record, 1.5, "b")
+        self.advance_to(2)
+        self.assertEqual([name for name, _ in self.fired], ["a"])
+        self.assertEqual(self.scheduler.jobs, 0)
+
+    def test_recurring_does_not_drift(self):
+        job = self.scheduler.every(5, self.record, "tick")
+        for t in range(1, 31):
+            self.advance_to(t + 0.5)  # the loop always runs a little late
+        self.assertEqual([at for _, at in self.fired], [5.5, 10.5, 15.5, 20.5, 25.5, 30.5])
+        self.assertEqual(job.runs, 6)
+
+    def test_recurring_cancelled_from_its_own_callback(self):
+        job = self.scheduler.every(5, lambda: (self.record("tick"), job.cancel()))
+        self.advance_to(20)
+        self.assertEqual(len(self.fired), 1)
+        self.assertEqual(self.scheduler.jobs, 0)
+
+    def test_missed_runs_are_coalesced(self):
+        job = self.scheduler.every(5, self.record, "tick")
+        self.advance_to(52)  # suspended through nine runs
+        self.assertEqual(self.fired, [("tick", 52)])
+        self.assertEqual(job.nominal, 55)
+        self.advance_to(55)
+        self.assertEqual(len(self.fired), 2)
+
+    def test_misfire_grace_skips_late_runs(self):
+        job = self.scheduler.every(5, self.record, "tick", misfire_grace=1)
+        self.advance_to(8)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(job.misfires, 1)
+        self.advance_to(10)
+        self.assertEqual(self.fired, [("tick", 10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# test_secret_cache.py - cached secrets are wiped when they expire, even if never looked up again
+#
+#   python -m pytest tests/test_secret_cache.py
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.scheduler import Scheduler  # noqa: E402
+from src.secret_cache import SecretCache  # noqa: E402
+
+TTL = 60.0
+
+
+class SecretExpiryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.now = 1000.0
+        self.scheduler = Scheduler(clock=lambda: self.now)  # not started: advance() drives it
+        self.cache = SecretCache(lookup=lambda service, username: f"{service}/{username}", ttl=TTL,
+                                 scheduler=self.scheduler)
+
+    async def asyncTearDown(self):
+        await self.cache.stop()
+
+    def advance(self, seconds):
+        self.now += seconds
+        self.scheduler.advance()
+
+    async def test_expired_secret_is_wiped_without_a_lookup(self):
+        await self.cache.get("fxetrx/demo", "token")
+        entry = self.cache._entries[("fxetrx/demo", "token")]
+        self.advance(TTL - 1)
+        self.assertIn(("fxetrx/demo", "token"), self.cache._entries)
+        self.advance(2)
+        self.assertEqual(len(self.cache._entries), 0)
+        self.assertTrue(entry._map.closed)
+        self.assertEqual(self.scheduler.jobs, 0)
+
+    async def test_dropped_secret_cancels_its_expiry(self):
+        await self.cache.get("fxetrx/demo", "token")
+        self.cache.invalidate("fxetrx/demo")
+        self.assertEqual(self.scheduler.jobs, 0)
+
+    async def test_refetched_secret_is_not_wiped_by_the_old_expiry(self):
+        await self.cache.get("fxetrx/demo", "token")
+        self.cache.invalidate("fxetrx/demo", "token")
+        self.advance(TTL / 2)
+        await self.cache.get("fxetrx/demo", "token")
+        self.advance(TTL / 2 + 1)
+        self.assertEqual(await self.cache.get("fxetrx/demo", "token"), "fxetrx/demo/token")
+        self.assertEqual(self.cache.hits, 1)
+
+    async def test_eviction_cancels_the_expiry(self):
+        self.cache.max_entries = 1
+        await self.cache.get("fxetrx/demo", "a")
+        await self.cache.get("fxetrx/demo", "b")
+        self.assertEqual(self.scheduler.jobs, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+# test_service_template.py - component start/stop order, failed startup and shutdown on a signal
+#
+#   python -m pytest tests/test_service_template.py
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.service_template import CrossPlatformService  # noqa: E402
+
+
+class _Component:
+    def __init__(self, name, events, fail_start=False, fail_stop=False):
+        self.name = name
+        self.events = events
+        self.fail_start = fail_start
+        self.fail_stop = fail_stop
+
+    async def start(self):
+        if self.fail_start:
+            raise RuntimeError(f"{self.name} cannot start")
+        self.events.append(f"start {self.name}")
+
+    async def stop(self):
+        self.events.append(f"stop {self.name}")
+        if self.fail_stop:
+            raise RuntimeError(f"{self.name} cannot stop")
+
+
+class _Notifier:
+    def __init__(self, events):
+        self.events = events
+
+    async def starting(self):
+        self.events.append("starting")
+
+    async def ready(self):
+        self.events.append("ready")
+
+    async def stopping(self):
+        self.events.append("stopping")
+
+    async def stopped(self):
+        self.events.append("stopped")
+
+
+class LifecycleTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def service(self, *components):
+        return CrossPlatformService(components, _Notifier(self.events))
+
+    def test_components_start_in_order_and_stop_in_reverse(self):
+        service = self.service(_Component("a", self.events), _Component("b", self.events))
+        service.start()
+        self.assertTrue(service.running)
+        service.stop()
+        self.assertFalse(service.running)
+        self.assertEqual(self.events, ["starting", "start a", "start b", "ready",
+                                       "stopping", "stop b", "stop a", "stopped"])
+
+    def test_failed_start_stops_what_started_and_raises(self):
+        service = self.service(_Component("a", self.events), _Component("b", self.events, fail_start=True),
+                               _Component("c", self.events))
+        with self.assertRaisesRegex(RuntimeError, "b cannot start"):
+            service.start()
+        self.assertFalse(service.running)
+        self.assertIsNone(service.thread)
+        self.assertEqual(self.events, ["starting", "start a", "stopping", "stop a", "stopped"])
+
+    def test_a_failing_stop_does_not_skip_the_others(self):
+        service = self.service(_Component("a", self.events), _Component("b", self.events, fail_stop=True))
+        service.start()
+        service.stop()
+        self.assertEqual(self.events[-3:], ["stop b", "stop a", "stopped"])
+
+    def test_stopping_twice_is_harmless(self):
+        service = self.service(_Component("a", self.events))
+        service.start()
+        service.stop()
+        service.stop()
+        service.request_stop()
+        self.assertEqual(self.events.count("stop a"), 1)
+
+    def test_stop_does_not_wait_for_a_poll_interval(self):
+        service = self.service(_Component("a", self.events))
+        service.start()
+        start = time.monotonic()
+        service.stop()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    @unittest.skipUnless(hasattr(signal, "SIGTERM") and os.name == "posix", "POSIX signals")
+    def test_sigterm_stops_run_forever(self):
+        if threading.current_thread() is not threading.main_thread():
+            self.skipTest("signal handlers need the main thread")
+        service = self.service(_Component("a", self.events))
+
+        def terminate():
+            while not service.running:
+                time.sleep(0.01)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        threading.Thread(target=terminate, daemon=True).start()
+        service.run_forever()
+        self.assertEqual(self.events[-3:], ["stopping", "stop a", "stopped"])
+
+
+if __name__ == "__main__":
+    unittest.main()